@@ -0,0 +1,120 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+from typing import TextIO
+
+from .albumpage import AlbumPage
+from .config import Config
+from .defs import UTF8, DownloadResult
+from .iinfo import AlbumInfo
+from .logger import Log
+
+__all__ = ('AlbumExporter',)
+
+ALBUM_EXPORT_SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+ALBUM_EXPORT_SQLITE_COMMIT_INTERVAL = 50
+ALBUM_EXPORT_FIELDS = (
+    'id', 'title', 'result', 'subfolder', 'folder', 'score', 'uploader', 'pages',
+    'tags', 'artists', 'categories', 'description', 'comments', 'preview',
+)
+# list fields are stored as json arrays in sqlite
+ALBUM_EXPORT_SQLITE_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS albums (id INTEGER PRIMARY KEY, title TEXT, result TEXT, subfolder TEXT, folder TEXT,'
+    ' score TEXT, uploader TEXT, pages INTEGER, tags TEXT, artists TEXT, categories TEXT,'
+    ' description TEXT, comments TEXT, preview TEXT)'
+)
+
+
+class AlbumExporter:
+    """
+    Structured albums metadata sink. Writes one record per processed album (all scraped fields) as soon as album is processed,
+    either as json lines or into sqlite database (depending on file extension). Records are staged when album page is evaluated
+    and written once album processing result is known: when album scan is finished or, if album has images to download,
+    once all of them are processed ('success' means all images were downloaded)\n
+    **Static**
+    """
+    _file: TextIO | None = None
+    _db: sqlite3.Connection | None = None
+    _staged: dict[int, dict[str, int | str | list[str]]] = {}
+    _uncommitted = 0
+
+    @staticmethod
+    def enabled() -> bool:
+        return bool(Config.album_export)
+
+    @staticmethod
+    def open() -> None:
+        if not AlbumExporter.enabled() or AlbumExporter._file is not None or AlbumExporter._db is not None:
+            return
+        try:
+            if os.path.splitext(Config.album_export)[1].lower() in ALBUM_EXPORT_SQLITE_EXTENSIONS:
+                AlbumExporter._db = sqlite3.connect(Config.album_export)
+                AlbumExporter._db.execute(ALBUM_EXPORT_SQLITE_SCHEMA)
+            else:
+                AlbumExporter._file = open(Config.album_export, 'at', encoding=UTF8)
+        except (OSError, sqlite3.Error):
+            Log.error(f'Error: unable to open albums export file \'{Config.album_export}\'! Albums export disabled')
+
+    @staticmethod
+    def close() -> None:
+        AlbumExporter._staged.clear()
+        if AlbumExporter._file is not None:
+            AlbumExporter._file.close()
+            AlbumExporter._file = None
+        if AlbumExporter._db is not None:
+            AlbumExporter._db.commit()
+            AlbumExporter._db.close()
+            AlbumExporter._db = None
+            AlbumExporter._uncommitted = 0
+
+    @staticmethod
+    def stage(ai: AlbumInfo, page: AlbumPage) -> None:
+        """Remembers scraped album fields until album processing is finished"""
+        if AlbumExporter._file is None and AlbumExporter._db is None:
+            return
+        AlbumExporter._staged[ai.id] = {
+            'score': page.score,
+            'uploader': page.uploader,
+            'pages': page.expected_pages_count or 0,
+            'tags': sorted(page.tags_raw),
+            'artists': list(page.arts_raw),
+            'categories': list(page.cats_raw),
+        }
+
+    @staticmethod
+    def commit(ai: AlbumInfo, result: DownloadResult) -> None:
+        """Writes staged album record"""
+        record = AlbumExporter._staged.pop(ai.id, None)
+        if record is None:
+            return
+        record.update(
+            id=ai.id, title=ai.title, result=result.name.lower(), subfolder=ai.subfolder, folder=ai.name,
+            description=ai.description.strip(), comments=ai.comments.strip(), preview=ai.preview_link,
+        )
+        try:
+            if AlbumExporter._file is not None:
+                AlbumExporter._file.write(json.dumps({k: record[k] for k in ALBUM_EXPORT_FIELDS}, ensure_ascii=False) + '\n')
+                AlbumExporter._file.flush()
+            elif AlbumExporter._db is not None:
+                values = [json.dumps(record[k], ensure_ascii=False) if isinstance(record[k], list) else record[k] for k in ALBUM_EXPORT_FIELDS]
+                AlbumExporter._db.execute(f'INSERT OR REPLACE INTO albums VALUES ({", ".join("?" * len(values))})', values)
+                AlbumExporter._uncommitted += 1
+                if AlbumExporter._uncommitted >= ALBUM_EXPORT_SQLITE_COMMIT_INTERVAL:
+                    AlbumExporter._db.commit()
+                    AlbumExporter._uncommitted = 0
+        except (OSError, sqlite3.Error):
+            Log.error(f'Error: unable to export {ai.sname} to \'{Config.album_export}\'!')
+
+#
+#
+#########################################
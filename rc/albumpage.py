@@ -0,0 +1,250 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+from asyncio import get_running_loop
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from bs4 import BeautifulSoup
+
+from .config import Config
+from .defs import DOWNLOAD_POLICY_ALWAYS, UTF8, DownloadResult
+from .iinfo import AlbumInfo
+from .logger import Log, LogRecord
+from .metrics import MetricRecord, Metrics
+from .tagger import (
+    TagBag,
+    filtered_tags,
+    get_artist_num,
+    get_category_num,
+    get_tag_num,
+    is_filtered_out_by_extra_tags,
+    solve_tag_conflicts,
+)
+
+__all__ = ('AlbumPage', 'AlbumPageParser', 'evaluate_album_page', 'parse_album_page')
+
+# album fields which can be changed by parsing / evaluation
+ALBUM_PAGE_AI_FIELDS = ('title', 'tags', 'description', 'comments', 'subfolder')
+
+
+class AlbumPage:
+    """
+    Data extracted from album html page
+    """
+    def __init__(self) -> None:
+        self.empty = True
+        self.not_found = False
+        self.score = ''
+        self.arts_raw = TagBag()
+        self.cats_raw = TagBag()
+        self.tags_raw = TagBag()
+        self.has_tags = False
+        self.uploader = ''
+        self.expected_pages_count: int | None = None
+        self.preview_link: str | None = None
+        self.file_links: list[str] = []
+        # evaluation results
+        self.evaluated = False
+        self.result: DownloadResult | None = None
+        self.my_tags = 'no_tags'
+
+
+def parse_album_page(ai: AlbumInfo, raw: bytes | None) -> AlbumPage:
+    """Parses album html page. Sets album title, description and comments"""
+    sname = ai.sname
+    page = AlbumPage()
+    with Metrics.timer('parse_seconds', 'html'):
+        a_html = BeautifulSoup(raw, 'html.parser', from_encoding=UTF8) if raw else BeautifulSoup()
+
+    if not len(a_html):
+        return page
+    page.empty = False
+
+    if a_html.find('title', string='404 Not Found'):
+        page.not_found = True
+        return page
+
+    if not ai.title:
+        titleh1 = a_html.find('h1', class_=lambda x: x.endswith('title'))
+        ai.title = titleh1.text if titleh1 else ''
+
+    Log.info(f'Scanning {sname}: \'{ai.title}\'')
+
+    try:
+        page.score = str(int(a_html.find('span', class_='voters count').text))
+    except Exception:
+        Log.warn(f'Warning: cannot extract score for {sname}.')
+    try:
+        arts = [' '.join(str(a.text).lower().split(' ')[:-1]) for a in a_html.find('div', string='Artists:').parent.find_all('a')]
+    except Exception:
+        Log.warn(f'Warning: cannot extract authors for {sname}.')
+        arts: list[str] = []
+    try:
+        cats = [' '.join(str(c.text).lower().split(' ')[:-1]) for c in a_html.find('div', string='Categories:').parent.find_all('a')]
+    except Exception:
+        Log.warn(f'Warning: cannot extract categories for {sname}.')
+        cats: list[str] = []
+    tdiv = a_html.find('div', string='Tags:')
+    if tdiv is None:
+        Log.info(f'Warning: album {sname} has no tags!')
+    page.has_tags = tdiv is not None
+    tags: list[str] = [' '.join(str(t.text).lower().split(' ')[:-1]) for t in tdiv.parent.find_all('a')] if tdiv else []
+    page.arts_raw, page.cats_raw, page.tags_raw = tuple(
+        TagBag((_.replace(' ', '_').lower() for _ in actlist), num_getter if Config.check_votes else None)
+        for actlist, num_getter in zip((arts, cats, tags), (get_artist_num, get_category_num, get_tag_num), strict=True)
+    )
+    if (Config.save_descriptions or Config.save_comments or Config.check_description_pos or Config.check_description_neg
+            or Config.album_export):
+        cidivs = a_html.find_all('div', class_='comment-info')
+        cudivs = [cidiv.find('a') for cidiv in cidivs]
+        ctdivs = [cidiv.find('div', class_='coment-text') for cidiv in cidivs]
+        desc_em = a_html.find('em')  # exactly one
+        uploader_div = a_html.find('div', string=' Uploaded By: ')
+        my_uploader = uploader_div.parent.find('a', class_='name').text.lower().strip() if uploader_div else 'unknown'
+        page.uploader = my_uploader
+        has_description = (cudivs[-1].text.lower() == my_uploader) if (cudivs and ctdivs) else False  # first comment by uploader
+        if cudivs and ctdivs:
+            assert len(ctdivs) == len(cudivs)
+        if Config.save_descriptions or Config.check_description_pos or Config.check_description_neg or Config.album_export:
+            desc_comment = (f'{cudivs[-1].text}:\n' + ctdivs[-1].get_text('\n').strip()) if has_description else ''
+            desc_base = (f'\n{my_uploader}:\n' + desc_em.get_text('\n') + '\n') if desc_em else ''
+            ai.description = desc_base or (f'\n{desc_comment}\n' if desc_comment else '')
+        if Config.save_comments or Config.album_export:
+            comments_list = [f'{cudivs[i].text}:\n' + ctdivs[i].get_text('\n').strip() for i in range(len(ctdivs) - int(has_description))]
+            ai.comments = ('\n' + '\n\n'.join(comments_list) + '\n') if comments_list else ''
+
+    try:
+        pages_div = a_html.find('div', string='Pages:')
+        page.expected_pages_count = int(pages_div.parent.find('span').text)
+    except Exception:
+        pass
+    try:
+        page.preview_link = a_html.find('img', src=lambda x: f'/{ai.id}/preview.' in x)['src']
+    except Exception:
+        pass
+    page.file_links = [str(_['href']) for _ in a_html.find_all('a', class_='item')]
+    return page
+
+
+def evaluate_album_page(ai: AlbumInfo, page: AlbumPage, extra_ids: list[int]) -> DownloadResult | None:
+    """Applies filters and scenario to parsed album page, builds folder name tags. Returns failure result if album is to be skipped"""
+    sname = ai.sname
+    scenario = Config.scenario
+    tags_raw = page.tags_raw
+    page.evaluated = True
+    for calist in (page.cats_raw, page.arts_raw):
+        tags_raw.merge(calist)
+    if Config.save_tags:
+        ai.tags = ' '.join(sorted(tags_raw))
+    if Config.check_uploader and ai.uploader:
+        tags_raw.add(ai.uploader)
+    if Config.solve_tag_conflicts:
+        solve_tag_conflicts(ai, tags_raw)
+    with Metrics.timer('filter_seconds', 'tags'):
+        is_filtered_out = is_filtered_out_by_extra_tags(ai, tags_raw, Config.extra_tags, Config.id_sequence, ai.subfolder, extra_ids)
+    if is_filtered_out:
+        Log.info(f'Info: album {sname} is filtered out by{" outer" if scenario else ""} extra tags, skipping...')
+        page.result = DownloadResult.FAIL_FILTERED_OUTER if scenario else DownloadResult.FAIL_SKIPPED
+        return page.result
+    score, rating = page.score, ai.rating
+    for vsrs, csri, srn, pc in zip((score, rating), (Config.min_score, Config.min_rating), ('score', 'rating'), ('', '%'), strict=True):
+        if len(vsrs) > 0 and csri is not None:
+            try:
+                if int(vsrs) < csri:
+                    Log.info(f'Info: album {sname} has low {srn} \'{vsrs}{pc}\' (required {csri:d}), skipping...')
+                    page.result = DownloadResult.FAIL_SKIPPED
+                    return page.result
+            except Exception:
+                pass
+    if scenario:
+        with Metrics.timer('filter_seconds', 'scenario'):
+            matching_sq = scenario.get_matching_subquery(ai, tags_raw, score, rating)
+        if matching_sq:
+            ai.subfolder = matching_sq.subfolder
+        elif utpalways_sq := scenario.get_utp_always_subquery() if not page.has_tags else None:
+            ai.subfolder = utpalways_sq.subfolder
+        else:
+            Log.info(f'Info: unable to find matching or utp scenario subquery for {sname}, skipping...')
+            page.result = DownloadResult.FAIL_SKIPPED
+            return page.result
+    elif not page.has_tags and len(Config.extra_tags) > 0 and Config.utp != DOWNLOAD_POLICY_ALWAYS:
+        Log.warn(f'Warning: could not extract tags from {sname}, skipping due to untagged albums download policy...')
+        page.result = DownloadResult.FAIL_SKIPPED
+        return page.result
+    page.my_tags = filtered_tags(sorted(tags_raw)) or page.my_tags
+    return None
+
+
+def _worker_init(config_vars: dict, metrics_enabled: bool) -> None:
+    vars(Config).update(config_vars)
+    Metrics._reset()
+    if metrics_enabled:
+        Metrics.enable()
+
+
+def _worker_process(ai: AlbumInfo, raw: bytes | None, extra_ids: list[int], evaluate: bool,
+                    ) -> tuple[AlbumPage, AlbumInfo, list[LogRecord], list[MetricRecord]]:
+    records = Log.collect()
+    metric_records = Metrics.collect() if Metrics.enabled() else []
+    page = parse_album_page(ai, raw)
+    if evaluate and not (page.empty or page.not_found):
+        evaluate_album_page(ai, page, extra_ids)
+    return page, ai, records, metric_records
+
+
+class AlbumPageParser:
+    """
+    Album pages processor. Parses (and evaluates unless votes check is required) album pages
+    either in place or using a pool of worker processes, keeping event loop free for network i/o
+    """
+    _instance: AlbumPageParser | None = None
+
+    @staticmethod
+    def get() -> AlbumPageParser | None:
+        return AlbumPageParser._instance
+
+    def __enter__(self) -> AlbumPageParser:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+        AlbumPageParser._instance = None
+
+    def __init__(self) -> None:
+        assert AlbumPageParser._instance is None
+        AlbumPageParser._instance = self
+
+        self._pool: ProcessPoolExecutor | None = None
+        if Config.cpu_workers:
+            config_vars = {k: v for k, v in vars(Config).items() if k != 'aborted'}
+            self._pool = ProcessPoolExecutor(Config.cpu_workers, get_context('spawn'),
+                                             initializer=_worker_init, initargs=(config_vars, Metrics.enabled()))
+
+    async def process(self, ai: AlbumInfo, raw: bytes | None, extra_ids: list[int]) -> AlbumPage:
+        evaluate = not Config.check_votes
+        if self._pool is None:
+            page = parse_album_page(ai, raw)
+            if evaluate and not (page.empty or page.not_found):
+                evaluate_album_page(ai, page, extra_ids)
+            return page
+        page, ai_copy, records, metric_records = await get_running_loop().run_in_executor(
+            self._pool, _worker_process, ai, raw, extra_ids, evaluate)
+        Log.write_records(records)
+        Metrics.apply_records(metric_records)
+        for field in ALBUM_PAGE_AI_FIELDS:
+            setattr(ai, field, getattr(ai_copy, field))
+        return page
+
+#
+#
+#########################################
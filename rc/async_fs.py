@@ -0,0 +1,118 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import functools
+import os
+from asyncio import get_running_loop
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, TypeVar
+
+from .defs import FS_WORKER_THREADS
+from .util import normalize_path
+
+__all__ = ('AsyncFS',)
+
+T = TypeVar('T')
+
+
+class AsyncFS:
+    """
+    Async facade for blocking filesystem calls. Calls are executed by a dedicated thread pool so slow (network) filesystems
+    don't stall the event loop. Directories known to exist are cached\n
+    **Static**
+    """
+    _executor: ThreadPoolExecutor | None = None
+    _known_dirs: set[str] = set()
+
+    @staticmethod
+    def _reset() -> None:
+        AsyncFS.shutdown()
+        AsyncFS._known_dirs.clear()
+
+    @staticmethod
+    def shutdown() -> None:
+        if AsyncFS._executor is not None:
+            AsyncFS._executor.shutdown()
+            AsyncFS._executor = None
+
+    @staticmethod
+    async def run(func: Callable[..., T], *args: Any) -> T:
+        """Executes blocking func in filesystem thread pool"""
+        if AsyncFS._executor is None:
+            AsyncFS._executor = ThreadPoolExecutor(FS_WORKER_THREADS, thread_name_prefix='AsyncFS')
+        return await get_running_loop().run_in_executor(AsyncFS._executor, functools.partial(func, *args))
+
+    @staticmethod
+    async def isfile(path: str) -> bool:
+        return await AsyncFS.run(os.path.isfile, path)
+
+    @staticmethod
+    async def isdir(path: str) -> bool:
+        path = normalize_path(path)
+        if path in AsyncFS._known_dirs:
+            return True
+        if await AsyncFS.run(os.path.isdir, path):
+            AsyncFS._known_dirs.add(path)
+            return True
+        return False
+
+    @staticmethod
+    async def getsize(path: str) -> int:
+        """Returns file size, 0 if file doesn't exist"""
+        return await AsyncFS.run(_getsize, path)
+
+    @staticmethod
+    async def makedirs(path: str) -> None:
+        """Creates directory (and parents) unless it is known to exist"""
+        path = normalize_path(path)
+        if path not in AsyncFS._known_dirs:
+            await AsyncFS.run(functools.partial(os.makedirs, exist_ok=True), path)
+            AsyncFS._known_dirs.add(path)
+
+    @staticmethod
+    async def listdir_files(path: str) -> list[str]:
+        """Returns names of files in directory"""
+        return await AsyncFS.run(_listdir_files, path)
+
+    @staticmethod
+    async def samefile(path1: str, path2: str) -> bool:
+        return await AsyncFS.run(os.path.samefile, path1, path2)
+
+    @staticmethod
+    async def rename(oldpath: str, newpath: str) -> None:
+        await AsyncFS.run(os.rename, oldpath, newpath)
+        AsyncFS.forget_dir(oldpath)
+
+    @staticmethod
+    async def remove(path: str) -> None:
+        await AsyncFS.run(os.remove, path)
+
+    @staticmethod
+    def forget_dir(path: str) -> None:
+        """Drops directory (and its subdirectories) from known directories"""
+        path = normalize_path(path)
+        AsyncFS._known_dirs.difference_update([known_dir for known_dir in AsyncFS._known_dirs if known_dir.startswith(path)])
+
+
+def _getsize(path: str) -> int:
+    try:
+        return os.stat(path).st_size
+    except FileNotFoundError:
+        return 0
+
+
+def _listdir_files(path: str) -> list[str]:
+    with os.scandir(path) as listing:
+        return [de.name for de in listing if de.is_file()]
+
+#
+#
+#########################################
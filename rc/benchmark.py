@@ -0,0 +1,586 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+import json
+import os
+import random
+import re
+import sys
+import time
+from argparse import ZERO_OR_MORE, ArgumentParser, Namespace
+from asyncio import new_event_loop, sleep
+from collections.abc import Callable, Sequence
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection
+from tempfile import TemporaryDirectory
+from typing import Any
+
+from aiohttp import web
+
+from .defs import ACTION_STORE_TRUE, CONNECT_RETRY_DELAYS, SITE, UTF8, Mem
+from .rex import re_media_filename
+from .tagger import ART_NUMS, CAT_NUMS, TAG_NUMS, TagBag, load_artist_nums, load_category_nums, load_tag_nums
+from .validators import positive_int, positive_nonzero_int, valid_int
+
+__all__ = ('override_site', 'run_benchmark')
+
+BENCH_HOST = '127.0.0.1'
+BENCH_ALBUMS_PER_PAGE = 20
+BENCH_CHUNK_SIZE = 64 * Mem.KB
+
+re_simple_tag = re.compile(r'^[a-z\d_]+$')
+
+HELP_ARG_BENCH_MODE = 'Pipeline to drive: \'ids\' (process_ids), \'pages\' (process_pages) or \'watch\' (process_watch, single poll)'
+HELP_ARG_BENCH_ALBUMS = 'Number of albums served by fixture server. Default is \'20\''
+HELP_ARG_BENCH_IMAGES = 'Images per album, \'min-max\'. Default is \'5-15\''
+HELP_ARG_BENCH_SIZE = 'Synthetic image size (in KB). Default is \'64\''
+HELP_ARG_BENCH_LATENCY = 'Artificial latency per request (in milliseconds). Default is \'0\''
+HELP_ARG_BENCH_BANDWIDTH = 'Per-connection bandwidth limit (in KB/s). Default is \'0\' (unlimited)'
+HELP_ARG_BENCH_ERROR_RATE = 'Fraction of requests failing with 503 error, 0-100 percent. Default is \'0\''
+HELP_ARG_BENCH_429_RATE = 'Fraction of requests failing with 429 error, 0-100 percent. Default is \'0\''
+HELP_ARG_BENCH_MISSING_RATE = 'Fraction of album ids returning 404, 0-100 percent. Default is \'0\''
+HELP_ARG_BENCH_FIXTURES = (
+    'Folder containing recorded pages: \'album_<id>.html\', \'search_<page>.html\', \'voting_<id>.json\'.'
+    ' Original site address is replaced with fixture server address. Missing fixtures are generated'
+)
+HELP_ARG_BENCH_SEED = 'Random seed for generated fixtures and injected errors. Default is \'0\''
+HELP_ARG_BENCH_RETRY_SCALE = 'Retry delays multiplier (percent), real delays for 429 are a minute long. Default is \'0\''
+HELP_ARG_BENCH_RUNS = 'Run the app this many times using the same destination folder (to measure repeated / continued runs). Default is \'1\''
+HELP_ARG_BENCH_DELAY = 'Keep base request delay (disabled by default to measure pipeline itself)'
+HELP_ARG_BENCH_OUTPUT = 'Write results to this file instead of stdout'
+HELP_ARG_BENCH_MICRO = (
+    'Run cpu-only microbenchmark instead of pipeline benchmark (no server / downloads):'
+    ' \'scenario\' - scenario subquery matching for \'-albums\' random albums,'
+    ' \'tags\' - folder name tags building for \'-albums\' random albums'
+)
+HELP_ARG_BENCH_ITERATIONS = 'Microbenchmark iterations. Default is \'10\''
+HELP_ARG_BENCH_SUBQUERIES = 'Number of subqueries in generated scenario (microbenchmark). Default is \'40\''
+HELP_ARG_BENCH_ARGS = 'Additional arguments for the app itself (extra tags, -script, -dmode, -log, etc.), pass after \'--\''
+
+
+class FixtureServer:
+    """
+    Local stand-in for the website serving recorded or generated album / search / voting pages and synthetic images\n
+    Runs in a separate process so it doesn't affect measured CPU time and memory usage
+    """
+    def __init__(self, params: Namespace) -> None:
+        self._params = params
+        self._base = ''
+        self._faults = random.Random(params.seed)
+        self._stats: dict[str, int] = {
+            'album_pages': 0, 'listing_pages': 0, 'voting_pages': 0, 'images': 0, 'image_heads': 0, 'image_bytes': 0,
+            'injected_503': 0, 'injected_429': 0, 'missing_404': 0,
+        }
+        self._image_data = self._make_image(params.size * Mem.KB)
+
+    @staticmethod
+    def _make_image(size: int) -> bytes:
+        soi, eoi = b'\xff\xd8\xff\xe0', b'\xff\xd9'
+        return soi + random.Random(size).randbytes(max(0, size - len(soi) - len(eoi))) + eoi
+
+    def _rnd(self, album_id: int) -> random.Random:
+        return random.Random(self._params.seed * 1000003 + album_id)
+
+    def _album_exists(self, album_id: int) -> bool:
+        return 0 < album_id <= self._params.albums and self._rnd(album_id).uniform(0, 100) >= self._params.missing_rate
+
+    def _read_fixture(self, name: str) -> str | None:
+        if self._params.fixtures and os.path.isfile(fixture_path := os.path.join(self._params.fixtures, name)):
+            with open(fixture_path, 'rt', encoding=UTF8) as ffile:
+                return ffile.read().replace(SITE, self._base)
+        return None
+
+    async def _before_request(self) -> web.Response | None:
+        if self._params.latency:
+            await sleep(self._params.latency / 1000)
+        fault = self._faults.uniform(0, 100)
+        if fault < self._params.rate_429:
+            self._stats['injected_429'] += 1
+            return web.Response(status=429)
+        if fault < self._params.rate_429 + self._params.error_rate:
+            self._stats['injected_503'] += 1
+            return web.Response(status=503)
+        return None
+
+    def _make_album_html(self, album_id: int) -> str:
+        rnd = self._rnd(album_id)
+        images_count = rnd.randint(*self._params.images)
+        tags = rnd.sample(sorted(TAG_NUMS), min(len(TAG_NUMS), rnd.randint(5, 25)))
+        arts = rnd.sample(sorted(ART_NUMS), min(len(ART_NUMS), rnd.randint(0, 2)))
+        cats = rnd.sample(sorted(CAT_NUMS), min(len(CAT_NUMS), rnd.randint(0, 3)))
+
+        def act_block(name: str, acts: list[str]) -> str:
+            links = ''.join(f'<a href="#">{act.replace("_", " ")} {rnd.randint(1, 999):d}</a>' for act in acts)
+            return f'<div class="col"><div>{name}:</div>{links}</div>'
+
+        image_links = ''.join(
+            f'<a class="item" href="{self._base}/get_image/{album_id:d}/{album_id * 1000 + i:d}.jpg/"></a>' for i in range(images_count)
+        )
+        return (
+            f'<html><head><title>Album {album_id:d}</title></head><body>'
+            f'<h1 class="album-title">Album {album_id:d}</h1>'
+            f'<span class="voters count">{rnd.randint(-5, 50):d}</span>'
+            f'{act_block("Artists", arts)}{act_block("Categories", cats)}{act_block("Tags", tags)}'
+            f'<div class="col"><div>Pages:</div><span>{images_count:d}</span></div>'
+            f'<img src="{self._base}/contents/albums/preview/{album_id:d}/preview.jpg"/>'
+            f'<div class="images">{image_links}</div>'
+            f'</body></html>'
+        )
+
+    def _make_listing_html(self, page: int) -> str:
+        maxpage = max(1, (self._params.albums + BENCH_ALBUMS_PER_PAGE - 1) // BENCH_ALBUMS_PER_PAGE)
+        last_id = self._params.albums - (page - 1) * BENCH_ALBUMS_PER_PAGE
+        items = ''.join(
+            f'<div class="item thumb"><a href="{self._base}/comics/{album_id:d}/album-{album_id:d}/">'
+            f'<img data-original="{self._base}/contents/albums/preview/{album_id:d}/preview.jpg"/></a>'
+            f'<div class="thumb_title">Album {album_id:d}</div></div>'
+            for album_id in range(last_id, max(0, last_id - BENCH_ALBUMS_PER_PAGE), -1) if self._album_exists(album_id)
+        )
+        pagination = f'<div class="pagination"><a data-action="ajax" data-parameters="sort_by:post_date;from_albums:{maxpage:d}">'
+        return f'<html><body>{items}{pagination}</a></div></body></html>'
+
+    async def handle_album(self, request: web.Request) -> web.StreamResponse:
+        if fault := await self._before_request():
+            return fault
+        album_id = int(request.match_info['album_id'])
+        self._stats['album_pages'] += 1
+        if not self._album_exists(album_id):
+            self._stats['missing_404'] += 1
+            return web.Response(status=404, text='<html><head><title>404 Not Found</title></head></html>', content_type='text/html')
+        html = self._read_fixture(f'album_{album_id:d}.html') or self._make_album_html(album_id)
+        return web.Response(text=html, content_type='text/html')
+
+    async def handle_listing(self, request: web.Request) -> web.StreamResponse:
+        if fault := await self._before_request():
+            return fault
+        page = int(request.query.get('from_albums') or 1)
+        self._stats['listing_pages'] += 1
+        html = self._read_fixture(f'search_{page:d}.html') or self._make_listing_html(page)
+        return web.Response(text=html, content_type='text/html')
+
+    async def handle_voting(self, request: web.Request) -> web.StreamResponse:
+        if fault := await self._before_request():
+            return fault
+        album_id = int(request.query.get('video_id') or 0)
+        self._stats['voting_pages'] += 1
+        text = self._read_fixture(f'voting_{album_id:d}.json') or json.dumps({
+            'status': 'success', 'video_id': album_id, 'logged_in': 0, 'can_vote': 0,
+            'tags': [], 'items': [], 'pending_tags': [], 'pending_items': [],
+        })
+        return web.Response(text=text, content_type='application/json')
+
+    async def handle_image(self, request: web.Request) -> web.StreamResponse:
+        if fault := await self._before_request():
+            return fault
+        data = self._image_data
+        range_s = request.headers.get('Range', '')
+        offset = int(range_s[range_s.find('=') + 1:range_s.find('-')]) if range_s.startswith('bytes=') else 0
+        if offset >= len(data) > 0 and range_s:
+            return web.Response(status=416, headers={'Content-Range': f'bytes */{len(data):d}'})
+        response = web.StreamResponse(status=206 if offset else 200)
+        response.content_type = 'image/jpeg'
+        response.content_length = len(data) - offset
+        response.headers['ETag'] = f'"{len(data):x}"'
+        if offset:
+            response.headers['Content-Range'] = f'bytes {offset:d}-{len(data) - 1:d}/{len(data):d}'
+        await response.prepare(request)
+        if request.method == 'HEAD':
+            self._stats['image_heads'] += 1
+            return response
+        chunk_delay = BENCH_CHUNK_SIZE / (self._params.bandwidth * Mem.KB) if self._params.bandwidth else 0.0
+        for pos in range(offset, len(data), BENCH_CHUNK_SIZE):
+            chunk = data[pos:pos + BENCH_CHUNK_SIZE]
+            await response.write(chunk)
+            self._stats['image_bytes'] += len(chunk)
+            if chunk_delay:
+                await sleep(chunk_delay * len(chunk) / BENCH_CHUNK_SIZE)
+        self._stats['images'] += 1
+        await response.write_eof()
+        return response
+
+    async def serve(self, conn: Connection) -> None:
+        load_tag_nums()
+        load_artist_nums()
+        load_category_nums()
+        app = web.Application()
+        app.router.add_get('/comic/{album_id}/a/', self.handle_album)
+        app.router.add_get('/search/', self.handle_listing)
+        app.router.add_get('/tag_vote_state_public.php', self.handle_voting)
+        app.router.add_get('/get_image/{album_id}/{image_name}/', self.handle_image)
+        app.router.add_get('/contents/albums/preview/{album_id}/{image_name}', self.handle_image)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, BENCH_HOST, 0).start()
+        self._base = f'http://{BENCH_HOST}:{runner.addresses[0][1]:d}'
+        conn.send(self._base)
+        while not conn.poll():
+            await sleep(0.1)
+        conn.recv()
+        conn.send(self._stats)
+        await runner.cleanup()
+
+
+def _server_process_main(params: Namespace, conn: Connection) -> None:
+    from .logger import Log
+    Log._disabled = True
+    loop = new_event_loop()
+    loop.run_until_complete(FixtureServer(params).serve(conn))
+    loop.close()
+
+
+def override_site(base: str) -> list[tuple[object, str, str]]:
+    """Replaces website address in every url template already imported by app modules. Returns replaced values to restore"""
+    replaced: list[tuple[object, str, str]] = []
+    for module_name, module in list(sys.modules.items()):
+        if module is None or module_name.split('.')[0] != __package__:
+            continue
+        for name, value in list(vars(module).items()):
+            if isinstance(value, str) and value.startswith(SITE):
+                replaced.append((module, name, value))
+                setattr(module, name, value.replace(SITE, base, 1))
+    return replaced
+
+
+def _time_calls(func: Callable[[Any], Any], items: Sequence[Any], iterations: int) -> float:
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        for item in items:
+            func(item)
+    return time.perf_counter() - start_time
+
+
+def micro_scenario(params: Namespace) -> dict[str, int | float | str]:
+    """Random scenario vs random albums: sequential evaluation (recompiling / precompiled filters) vs indexed scenario matching"""
+    from .iinfo import AlbumInfo
+    from .scenario import DownloadScenario
+    from .tagger import ExtraTagsFilter
+
+    load_tag_nums()
+    rnd = random.Random(params.seed)
+    tags = rnd.sample(sorted(tag for tag in TAG_NUMS if re_simple_tag.fullmatch(tag)), 150)  # small pool so subqueries actually compete
+
+    def random_extra_tag() -> str:
+        kind = rnd.randint(0, 9)
+        tag = rnd.choice(tags)
+        return (tag if kind < 4 else f'-{tag}' if kind < 6 else f'({"~".join(rnd.sample(tags, 3))})' if kind < 8 else
+                f'{tag[:max(1, len(tag) // 2)]}*' if kind < 9 else f'-({",".join(rnd.sample(tags, 2))})')
+
+    queries = [f'sub{i:d}: {" ".join(random_extra_tag() for _ in range(rnd.randint(1, 4)))}' for i in range(params.subqueries)]
+    scenario = DownloadScenario('; '.join([*queries, 'rest: * -utp always']))
+    albums = [(AlbumInfo(i + 1, f'Album {i + 1:d}'), TagBag(rnd.sample(tags, rnd.randint(10, 40)))) for i in range(params.albums)]
+
+    def match_sequential(album: tuple[AlbumInfo, TagBag], recompile: bool) -> int:
+        ai, tags_raw = album
+        for i, sq in enumerate(scenario.queries):
+            sq_filter = ExtraTagsFilter(sq.extra_tags) if recompile else scenario._filters[i]
+            if not sq_filter.is_filtered_out(ai, tags_raw, sq.id_sequence, sq.subfolder):
+                return i
+        return -1
+
+    def match_indexed(album: tuple[AlbumInfo, TagBag]) -> int:
+        sq = scenario.get_matching_subquery(album[0], album[1], '', '')
+        return scenario.queries.index(sq) if sq else -1
+
+    results = [match_indexed(album) for album in albums]
+    mismatches = sum(int(match_sequential(album, False) != result) for album, result in zip(albums, results, strict=True))
+    time_recompile = _time_calls(lambda album: match_sequential(album, True), albums, params.iterations)
+    time_compiled = _time_calls(lambda album: match_sequential(album, False), albums, params.iterations)
+    time_indexed = _time_calls(match_indexed, albums, params.iterations)
+    calls = len(albums) * params.iterations
+    return {
+        'micro': 'scenario',
+        'exit_code': int(mismatches > 0),
+        'subqueries': len(scenario),
+        'calls': calls,
+        'mismatches': mismatches,
+        'matched_by_catch_all': results.count(len(scenario) - 1),
+        'sequential_recompile_us': round(time_recompile / calls * 10**6, 3),
+        'sequential_compiled_us': round(time_compiled / calls * 10**6, 3),
+        'pruned_us': round(time_indexed / calls * 10**6, 3),
+        'speedup': round(time_recompile / max(time_indexed, 1e-9), 2),
+    }
+
+
+def _filtered_tags_reference(tags_list: Sequence[str]) -> str:
+    """Unmemoized quadratic folder name tags builder (baseline)"""
+    from .defs import TAGS_CONCAT_CHAR
+    from .rex import (
+        re_bracketed_tag,
+        re_not_a_letter,
+        re_numbered_or_counted_tag,
+        re_replace_symbols,
+        re_tags_exclude_major1,
+        re_tags_exclude_major2,
+        re_tags_to_not_exclude,
+        re_tags_to_process,
+    )
+    from .tagger import TAG_ALIASES, trim_undersores
+
+    tags_list_final: list[str] = []
+    for tag in tags_list:
+        tag = re_replace_symbols.sub('_', tag.replace('-', '').replace('\'', '').replace('.', ''))
+        alias = TAG_ALIASES.get(tag)
+        if alias is None and re_tags_to_process.match(tag) is None:
+            continue
+        tag = alias or tag
+        aser_match = re_bracketed_tag.match(tag)
+        aser_valid = bool(aser_match)
+        if aser_match:
+            if re_tags_exclude_major1.match(aser_match.group(1)) or re_tags_exclude_major2.match(aser_match.group(2)):
+                continue
+            tag = trim_undersores(aser_match.group(1))
+            if len(tag) >= 17:
+                continue
+        elif alias is None and re_tags_to_not_exclude.match(tag) is None:
+            continue
+        tag = trim_undersores(tag)
+        do_add = True
+        if len(tags_list_final) > 0:
+            nutag = re_not_a_letter.sub('', re_numbered_or_counted_tag.sub(r'\1', tag))
+            for i in reversed(range(len(tags_list_final))):
+                nut = re_not_a_letter.sub('', re_numbered_or_counted_tag.sub(r'\1', tags_list_final[i].lower()))
+                if len(nut) >= len(nutag) and (nutag in nut):
+                    do_add = False
+                    break
+            if do_add:
+                for i in reversed(range(len(tags_list_final))):
+                    nut = re_not_a_letter.sub('', re_numbered_or_counted_tag.sub(r'\1', tags_list_final[i].lower()))
+                    if len(nutag) >= len(nut) and (nut in nutag):
+                        if aser_valid is False and tags_list_final[i][0].isupper():
+                            aser_valid = True
+                        del tags_list_final[i]
+        if do_add:
+            if aser_valid:
+                for i, c in enumerate(tag):
+                    if (i == 0 or tag[i - 1] == '_') and c.isalpha():
+                        tag = f'{tag[:i]}{c.upper()}{tag[i + 1:]}'
+            tags_list_final.append(tag)
+    return trim_undersores(TAGS_CONCAT_CHAR.join(sorted(tags_list_final)))
+
+
+def micro_tags(params: Namespace) -> dict[str, int | float | str]:
+    """Folder name tags of random albums drawn from full tags vocabulary: reference (quadratic, unmemoized) vs memoized builder"""
+    from .tagger import filtered_tags, load_tag_aliases
+
+    load_tag_nums()
+    load_tag_aliases()
+    rnd = random.Random(params.seed)
+    vocabulary = sorted(TAG_NUMS)
+    hot_tags = rnd.sample(vocabulary, 300)  # tags recurring across albums
+    albums = [rnd.sample(hot_tags, rnd.randint(10, 150)) + rnd.sample(vocabulary, rnd.randint(0, 100)) for _ in range(params.albums)]
+
+    mismatches = sum(int(_filtered_tags_reference(tags) != filtered_tags(tags)) for tags in albums)
+    time_reference = _time_calls(_filtered_tags_reference, albums, params.iterations)
+    time_memoized = _time_calls(filtered_tags, albums, params.iterations)
+    calls = len(albums) * params.iterations
+    return {
+        'micro': 'tags',
+        'exit_code': int(mismatches > 0),
+        'vocabulary': len(vocabulary),
+        'calls': calls,
+        'mismatches': mismatches,
+        'reference_us': round(time_reference / calls * 10**6, 3),
+        'memoized_us': round(time_memoized / calls * 10**6, 3),
+        'speedup': round(time_reference / max(time_memoized, 1e-9), 2),
+    }
+
+
+MICRO_BENCHMARKS: dict[str, Callable[[Namespace], dict[str, int | float | str]]] = {
+    'scenario': micro_scenario,
+    'tags': micro_tags,
+}
+
+
+def run_micro_benchmark(params: Namespace) -> dict[str, int | float | str]:
+    from .config import Config
+    from .defs import LoggingFlags
+
+    logging_flags = Config.logging_flags
+    Config.logging_flags = LoggingFlags.ERROR
+    try:
+        return MICRO_BENCHMARKS[params.micro](params)
+    finally:
+        Config.logging_flags = logging_flags
+
+
+def _reset_app_state() -> None:
+    """Drops module-level state left by previous app run so it can be run again within the same process"""
+    from .albumexport import AlbumExporter
+    from .async_fs import AsyncFS
+    from .config import Config
+    from .downloader import AlbumDownloadWorker, ImageDownloadWorker
+    from .fetch_html import RequestQueue
+    from .idgaps import IdGapModel, IdGapsPredictor
+    from .imgindex import ImageIndex
+    from .metrics import Metrics
+    from .path_util import _found_album_ids_dict, _found_foldernames_dict
+    from .shard import _claimed_ids
+
+    AlbumDownloadWorker._instance = None
+    ImageDownloadWorker._instance = None
+    IdGapsPredictor._instance = None
+    _found_foldernames_dict.clear()
+    _found_album_ids_dict.clear()
+    _claimed_ids.clear()
+    Config._reset()
+    RequestQueue._reset()
+    Metrics._reset()
+    ImageIndex._reset()
+    IdGapModel._reset()
+    AsyncFS._reset()
+    AlbumExporter.close()
+
+
+def _scan_results(dest: str) -> tuple[int, int, int, int]:
+    albums_count = images_count = bytes_count = disk_bytes_count = 0
+    inodes: set[tuple[int, int]] = set()
+    for _, _, filenames in os.walk(dest):
+        media_files = [fname for fname in filenames if re_media_filename.fullmatch(fname)]
+        albums_count += int(bool(media_files))
+        images_count += len(media_files)
+    for dirpath, _, filenames in os.walk(dest):
+        for fstat in (os.stat(os.path.join(dirpath, fname)) for fname in filenames if re_media_filename.fullmatch(fname)):
+            bytes_count += fstat.st_size
+            if (fstat.st_dev, fstat.st_ino) not in inodes:  # hardlinked images are only stored once
+                inodes.add((fstat.st_dev, fstat.st_ino))
+                disk_bytes_count += fstat.st_size
+    return albums_count, images_count, bytes_count, disk_bytes_count
+
+
+def _peak_rss_kb() -> int | None:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // Mem.KB if sys.platform == 'darwin' else peak
+
+
+def valid_images_range(val: str) -> tuple[int, int]:
+    parts = val.split('-', 1)
+    images_min = positive_nonzero_int(parts[0])
+    images_max = valid_int(parts[-1], lb=images_min)
+    return images_min, images_max
+
+
+def valid_percent(val: str) -> float:
+    fval = float(val)
+    assert 0.0 <= fval <= 100.0
+    return fval
+
+
+def parse_benchmark_args(args: Sequence[str]) -> Namespace:
+    parser = ArgumentParser(prog=f'{__package__}.benchmark', description='Offline scan / download pipeline benchmark')
+    parser.add_argument('-mode', default='ids', help=HELP_ARG_BENCH_MODE, choices=('ids', 'pages', 'watch'))
+    parser.add_argument('-albums', metavar='#number', default=20, help=HELP_ARG_BENCH_ALBUMS, type=positive_nonzero_int)
+    parser.add_argument('-images', metavar='#min-max', default=(5, 15), help=HELP_ARG_BENCH_IMAGES, type=valid_images_range)
+    parser.add_argument('-size', metavar='#KB', default=64, help=HELP_ARG_BENCH_SIZE, type=positive_int)
+    parser.add_argument('-latency', metavar='#ms', default=0, help=HELP_ARG_BENCH_LATENCY, type=positive_int)
+    parser.add_argument('-bandwidth', metavar='#KB/s', default=0, help=HELP_ARG_BENCH_BANDWIDTH, type=positive_int)
+    parser.add_argument('-error_rate', metavar='#percent', default=0.0, help=HELP_ARG_BENCH_ERROR_RATE, type=valid_percent)
+    parser.add_argument('-rate_429', metavar='#percent', default=0.0, help=HELP_ARG_BENCH_429_RATE, type=valid_percent)
+    parser.add_argument('-missing_rate', metavar='#percent', default=0.0, help=HELP_ARG_BENCH_MISSING_RATE, type=valid_percent)
+    parser.add_argument('-fixtures', metavar='#path', default='', help=HELP_ARG_BENCH_FIXTURES)
+    parser.add_argument('-seed', metavar='#number', default=0, help=HELP_ARG_BENCH_SEED, type=positive_int)
+    parser.add_argument('-retry_scale', metavar='#percent', default=0.0, help=HELP_ARG_BENCH_RETRY_SCALE, type=valid_percent)
+    parser.add_argument('-runs', metavar='#number', default=1, help=HELP_ARG_BENCH_RUNS, type=positive_nonzero_int)
+    parser.add_argument('-delay', action=ACTION_STORE_TRUE, help=HELP_ARG_BENCH_DELAY)
+    parser.add_argument('-out', metavar='#filepath', default='', help=HELP_ARG_BENCH_OUTPUT)
+    parser.add_argument('-micro', default='', help=HELP_ARG_BENCH_MICRO, choices=tuple(MICRO_BENCHMARKS))
+    parser.add_argument('-iterations', metavar='#number', default=10, help=HELP_ARG_BENCH_ITERATIONS, type=positive_nonzero_int)
+    parser.add_argument('-subqueries', metavar='#number', default=40, help=HELP_ARG_BENCH_SUBQUERIES, type=positive_nonzero_int)
+    parser.add_argument(dest='app_args', nargs=ZERO_OR_MORE, help=HELP_ARG_BENCH_ARGS)
+    return parser.parse_args(args)
+
+
+def run_benchmark(args: Sequence[str]) -> dict[str, int | float | str | dict[str, int] | None]:
+    from .config import Config
+    from .main import main_sync
+
+    params = parse_benchmark_args(args)
+    if params.micro:
+        return run_micro_benchmark(params)
+
+    conn_main, conn_server = Pipe()
+    server = Process(target=_server_process_main, args=(params, conn_server), daemon=True)
+    server.start()
+    base = conn_main.recv()
+    replaced_templates = override_site(base)
+    retry_delays_orig = CONNECT_RETRY_DELAYS.copy()
+    for status, delays in retry_delays_orig.items():
+        CONNECT_RETRY_DELAYS[status] = tuple(delay * params.retry_scale / 100 for delay in delays)
+
+    try:
+        with TemporaryDirectory(prefix=f'{__package__}_benchmark_') as tempdir:
+            dest = f'{tempdir}/'.replace('\\', '/')
+            if params.mode == 'ids':
+                app_args = ['ids', '-start', '1', '-count', str(params.albums)]
+            elif params.mode == 'watch':
+                app_args = ['watch', '-start', '1', '-polls', '1']
+            else:
+                pages_count = max(1, (params.albums + BENCH_ALBUMS_PER_PAGE - 1) // BENCH_ALBUMS_PER_PAGE)
+                app_args = ['pages', '-start', '1', '-pages', str(pages_count)]
+            app_args.extend(['-path', dest, *params.app_args])
+            if '-log' not in app_args and '--log-level' not in app_args:
+                app_args.extend(['-log', 'warn'])
+
+            Config.nodelay = not params.delay
+            cpu_time_start, wall_time_start = time.process_time(), time.perf_counter()
+            for run_num in range(params.runs):
+                if run_num > 0:
+                    _reset_app_state()
+                    Config.nodelay = not params.delay
+                exit_code = main_sync(app_args)
+                if exit_code != 0:
+                    break
+            cpu_time, wall_time = time.process_time() - cpu_time_start, time.perf_counter() - wall_time_start
+            albums_count, images_count, bytes_count, disk_bytes_count = _scan_results(dest)
+    finally:
+        for module, name, value in replaced_templates:
+            setattr(module, name, value)
+        CONNECT_RETRY_DELAYS.update(retry_delays_orig)
+
+    conn_main.send(None)
+    server_stats: dict[str, int] = conn_main.recv()
+    server.join(5.0)
+
+    return {
+        'mode': params.mode,
+        'exit_code': exit_code,
+        'albums': albums_count,
+        'images': images_count,
+        'bytes': bytes_count,
+        'disk_bytes': disk_bytes_count,
+        'wall_time_s': round(wall_time, 3),
+        'cpu_time_s': round(cpu_time, 3),
+        'albums_per_s': round(albums_count / wall_time, 3),
+        'images_per_s': round(images_count / wall_time, 3),
+        'mb_per_s': round(bytes_count / Mem.MB / wall_time, 3),
+        'peak_rss_kb': _peak_rss_kb(),
+        'server': server_stats,
+    }
+
+
+def main(args: Sequence[str]) -> int:
+    results = run_benchmark(args)
+    results_str = json.dumps(results, indent=2)
+    out_path = parse_benchmark_args(args).out
+    if out_path:
+        with open(out_path, 'wt', encoding=UTF8) as ofile:
+            ofile.write(f'{results_str}\n')
+    else:
+        print(results_str)
+    return 0 if results['exit_code'] == 0 else 1
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
+
+#
+#
+#########################################
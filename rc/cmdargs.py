@@ -19,7 +19,9 @@ from .defs import (
     DOWNLOAD_MODE_DEFAULT,
     DOWNLOAD_MODES,
     DOWNLOAD_POLICY_DEFAULT,
+    HELP_ARG_ALBUM_EXPORT,
     HELP_ARG_ALL_PAGES,
+    HELP_ARG_ALLOW_DUPLICATE_NAMES,
     HELP_ARG_BEGIN_STOP_ID,
     HELP_ARG_BLACKLIST,
     HELP_ARG_CHECK_TITLEDESC,
@@ -27,6 +29,8 @@ from .defs import (
     HELP_ARG_CMDFILE,
     HELP_ARG_CONTINUE,
     HELP_ARG_COOKIE,
+    HELP_ARG_CPU_WORKERS,
+    HELP_ARG_DEDUP_IMAGES,
     HELP_ARG_DMMODE,
     HELP_ARG_DUMP_INFO,
     HELP_ARG_DWN_SCENARIO,
@@ -38,18 +42,28 @@ from .defs import (
     HELP_ARG_HEADER,
     HELP_ARG_ID_COUNT,
     HELP_ARG_ID_END,
+    HELP_ARG_ID_GAPS_CONFIDENCE,
     HELP_ARG_ID_START,
+    HELP_ARG_IDFILE,
     HELP_ARG_IDSEQUENCE,
     HELP_ARG_INCLUDE_PREVIEWS,
+    HELP_ARG_INCREMENTAL_SYNC,
+    HELP_ARG_INCREMENTAL_SYNC_RECHECK,
     HELP_ARG_LINKSEQUENCE,
     HELP_ARG_LOCK_FILES,
+    HELP_ARG_LOG_FILE,
+    HELP_ARG_LOG_JSON,
     HELP_ARG_LOGGING,
     HELP_ARG_LOOKAHEAD,
+    HELP_ARG_LOOKAHEAD_PROBE,
     HELP_ARG_MERGE_LISTS,
+    HELP_ARG_METRICS_FILE,
+    HELP_ARG_METRICS_PORT,
     HELP_ARG_MINRATING,
     HELP_ARG_MINSCORE,
     HELP_ARG_MODEL,
     HELP_ARG_NAMING,
+    HELP_ARG_NO_SEARCH_PUSHDOWN,
     HELP_ARG_NOCOLORS,
     HELP_ARG_NOMOVE,
     HELP_ARG_PAGE_COUNT,
@@ -57,16 +71,21 @@ from .defs import (
     HELP_ARG_PAGE_START,
     HELP_ARG_PATH,
     HELP_ARG_PREDICT_ID_GAPS,
+    HELP_ARG_PROFILE,
     HELP_ARG_PROXY,
     HELP_ARG_PROXYNODOWN,
     HELP_ARG_PROXYNOHTML,
+    HELP_ARG_RELINK_KNOWN_IMAGES,
     HELP_ARG_REPORT_DUPLICATES,
     HELP_ARG_RETRIES,
     HELP_ARG_SEARCH_ACT,
     HELP_ARG_SEARCH_RULE,
     HELP_ARG_SEARCH_STR,
+    HELP_ARG_SEEK_PAGES,
     HELP_ARG_SESSION_ID,
+    HELP_ARG_SHARD,
     HELP_ARG_SKIP_EMPTY_LISTS,
+    HELP_ARG_SKIP_EXISTING,
     HELP_ARG_SOLVE_TAG_CONFLICTS,
     HELP_ARG_SPEEDLIMIT,
     HELP_ARG_STORE_CONTINUE_CMDFILE,
@@ -77,9 +96,15 @@ from .defs import (
     HELP_ARG_UPLOADER,
     HELP_ARG_UTPOLICY,
     HELP_ARG_VERSION,
+    HELP_ARG_WATCH_DELAY,
+    HELP_ARG_WATCH_POLLS,
+    HELP_ARG_WATCH_START,
+    IDGAP_CONFIDENCE_DEFAULT,
     IDGAP_PREDICTION_DEFAULT,
     IDGAP_PREDICTION_MODES,
     LOGGING_FLAGS_DEFAULT,
+    LOOKAHEAD_WATCH_RESCAN_DELAY_MAX,
+    LOOKAHEAD_WATCH_RESCAN_DELAY_MIN,
     MAX_DEST_SCAN_SUB_DEPTH_DEFAULT,
     MAX_DEST_SCAN_UPLEVELS_DEFAULT,
     NAMING_FLAGS_DEFAULT,
@@ -87,6 +112,7 @@ from .defs import (
     SEARCH_RULES,
     UNTAGGED_POLICIES,
     UTF8,
+    IntPair,
 )
 from .logger import Log
 from .scenario import DownloadScenario
@@ -102,15 +128,21 @@ from .validators import (
     naming_flags,
     positive_int,
     positive_nonzero_int,
+    valid_delay_range,
     valid_filepath_abs,
+    valid_filepath_in,
+    valid_filepath_out,
+    valid_id_gaps_confidence,
     valid_int,
     valid_kwarg,
     valid_lookahead,
     valid_path,
+    valid_port,
     valid_proxy,
     valid_rating,
     valid_search_string,
     valid_session_id,
+    valid_shard,
     valid_timeout,
 )
 from .version import APP_NAME, APP_VERSION
@@ -137,6 +169,7 @@ PARSER_TITLE_NONE = ''
 PARSER_TITLE_IDS = 'ids'
 PARSER_TITLE_PAGES = 'pages'
 PARSER_TITLE_FILE = 'ifile'
+PARSER_TITLE_WATCH = 'watch'
 
 PARSER_TITLE_NAMES_REMAP: dict[str, str] = {
     PARSER_TITLE_FILE: 'file',
@@ -147,6 +180,8 @@ PARSER_PARAM_PARSER_TITLE = 'zzzparser_title'
 
 IDGP_DEFAULT = IDGAP_PREDICTION_DEFAULT
 """'0'"""
+WATCH_DELAY_DEFAULT = IntPair(LOOKAHEAD_WATCH_RESCAN_DELAY_MIN, LOOKAHEAD_WATCH_RESCAN_DELAY_MAX)
+"""'300-1800'"""
 
 PARSED_ARGS_NO_CONSUME = {
     PARSER_PARAM_PARSER_TYPE,
@@ -165,7 +200,9 @@ def parse_logging_args(args: Sequence[str]) -> None:
     add_logging_args(parser)
     parsed = parser.parse_known_args(args)
     Config.logging_flags = parsed[0].log_level
-    Config.disable_log_colors = parsed[0].disable_log_colors
+    Config.nocolors = parsed[0].disable_log_colors
+    Config.log_file = parsed[0].log_file
+    Config.log_json = parsed[0].log_json
 
 
 def read_cmdfile(cmdfile_path: str) -> list[str]:
@@ -211,8 +248,8 @@ def execute_parser(parser: ArgumentParser, args: Sequence[str]) -> Namespace:
                 if not parsed.get_maxid:
                     if parsed.end < parsed.start + parsed.pages - 1:
                         parsed.end = parsed.start + parsed.pages - 1
-            else:
-                if parsed.use_id_sequence or parsed.use_link_sequence:
+            elif getattr(parsed, PARSER_PARAM_PARSER_TITLE) == PARSER_TITLE_IDS:
+                if parsed.use_id_sequence or parsed.use_link_sequence or parsed.use_id_file:
                     parsed.start = parsed.end = None
                 else:
                     parsed.end = max(parsed.end, parsed.start + parsed.count - 1)
@@ -249,6 +286,7 @@ def create_parsers() -> dict[str, ArgumentParser]:
 
     _ = create_parser(subs_main, PARSER_TITLE_IDS, 'Scan posts by id')
     _ = create_parser(subs_main, PARSER_TITLE_PAGES, 'Scan post pages')
+    _ = create_parser(subs_main, PARSER_TITLE_WATCH, 'Watch for new posts')
     _ = create_parser(subs_main, PARSER_TITLE_FILE, 'Read cmdline from file')
     return parsers
 
@@ -275,9 +313,16 @@ def add_common_args(par: ArgumentParser) -> None:
     do.add_argument('-unfinish', '--keep-unfinished', action=ACTION_STORE_TRUE, help=HELP_ARG_UNFINISH)
     do.add_argument('--store-continue-cmdfile', action=ACTION_STORE_TRUE, help=HELP_ARG_STORE_CONTINUE_CMDFILE)
     do.add_argument('-nomove', '--no-rename-move', action=ACTION_STORE_TRUE, help=HELP_ARG_NOMOVE)
+    do.add_argument('-isync', '--incremental-sync', action=ACTION_STORE_TRUE, help=HELP_ARG_INCREMENTAL_SYNC)
+    do.add_argument('-isync_recheck', '--incremental-sync-recheck', metavar='#ratio', default=0, help=HELP_ARG_INCREMENTAL_SYNC_RECHECK,
+                    type=positive_int)
     do.add_argument('-naming', default=NAMING_DEFAULT, help=HELP_ARG_NAMING, type=naming_flags)
     do.add_argument('-dmode', '--download-mode', default=DM_DEFAULT, help=HELP_ARG_DMMODE, choices=DOWNLOAD_MODES)
     do.add_argument('-script', '--download-scenario', default=None, help=HELP_ARG_DWN_SCENARIO, type=DownloadScenario)
+    do.add_argument('-cpu_workers', metavar='#number', default=0, help=HELP_ARG_CPU_WORKERS, type=positive_int)
+    do.add_argument('-dedup', '--dedup-images', action=ACTION_STORE_TRUE, help=HELP_ARG_DEDUP_IMAGES)
+    do.add_argument('-relink', '--relink-known-images', action=ACTION_STORE_TRUE, help=HELP_ARG_RELINK_KNOWN_IMAGES)
+    do.add_argument('-shard', metavar='#K/N', default=None, help=HELP_ARG_SHARD, type=valid_shard)
     doex = par.add_argument_group(title='extra download options')
     doex.add_argument('-tdump', '--dump-tags', action=ACTION_STORE_TRUE, help='')
     doex.add_argument('-ddump', '--dump-descriptions', action=ACTION_STORE_TRUE, help='')
@@ -286,6 +331,7 @@ def add_common_args(par: ArgumentParser) -> None:
     doex.add_argument('-dnoempty', '--skip-empty-lists', action=ACTION_STORE_TRUE, help=HELP_ARG_SKIP_EMPTY_LISTS)
     # doex.add_argument('-sdump', '--dump-screenshots', action=ACTION_STORE_TRUE, help=HELP_ARG_DUMP_SCREENSHOTS)
     doex.add_argument('-previews', '--include-previews', action=ACTION_STORE_TRUE, help=HELP_ARG_INCLUDE_PREVIEWS)
+    doex.add_argument('-export', '--album-export', metavar='#filepath', default=None, help=HELP_ARG_ALBUM_EXPORT, type=valid_filepath_out)
     dofi = par.add_argument_group(title='filtering options')
     dofi.add_argument(dest='extra_tags', nargs=ZERO_OR_MORE, action=ACTION_EXTEND, help=HELP_ARG_EXTRA_TAGS)
     # dofi.add_argument('-duration', metavar='#min-max', default=valid_duration(''), help=HELP_ARG_DURATION, type=valid_duration)
@@ -300,12 +346,18 @@ def add_common_args(par: ArgumentParser) -> None:
     dofi.add_argument('--check-title-neg', action=ACTION_STORE_TRUE, help='')
     dofi.add_argument('--check-description-pos', action=ACTION_STORE_TRUE, help='')
     dofi.add_argument('--check-description-neg', action=ACTION_STORE_TRUE, help=HELP_ARG_CHECK_TITLEDESC)
+    dime = par.add_argument_group(title='metrics options')
+    dime.add_argument('-metrics_file', metavar='#filepath', default=None, help=HELP_ARG_METRICS_FILE, type=valid_filepath_out)
+    dime.add_argument('-metrics_port', metavar='#port', default=None, help=HELP_ARG_METRICS_PORT, type=valid_port)
+    dime.add_argument('--profile', metavar='#filepath', default=None, help=HELP_ARG_PROFILE, type=valid_filepath_out)
 
 
 def add_logging_args(par: ArgumentParser) -> None:
     lo = par.add_argument_group(title='logging options')
     lo.add_argument('-log', '--log-level', default=log_level(LOGGING_DEFAULT.name.lower()), help=HELP_ARG_LOGGING, type=log_level)
     lo.add_argument('-nocolors', '--disable-log-colors', action=ACTION_STORE_TRUE, help=HELP_ARG_NOCOLORS)
+    lo.add_argument('-log_file', metavar='#filepath', default=None, help=HELP_ARG_LOG_FILE, type=valid_filepath_out)
+    lo.add_argument('--log-json', action=ACTION_STORE_TRUE, help=HELP_ARG_LOG_JSON)
 
 
 def add_help(par: ArgumentParser, is_root: bool):
@@ -323,6 +375,7 @@ def parse_arglist(args: Sequence[str]) -> Namespace:
     parser_root.usage = (
         f'\n{INDENT}{MODULE} {PARSER_TITLE_IDS} ...'
         f'\n{INDENT}{MODULE} {PARSER_TITLE_PAGES} ...'
+        f'\n{INDENT}{MODULE} {PARSER_TITLE_WATCH} ...'
     )
 
     # Ids
@@ -331,7 +384,7 @@ def parse_arglist(args: Sequence[str]) -> Namespace:
         f'\n{INDENT}{MODULE} {PARSER_TITLE_IDS}'
         f' -start #number -end|-count #number [options...] [extra tags...]'
         f'\n{INDENT}{MODULE} {PARSER_TITLE_IDS}'
-        f' --use-id-sequence|--use-link-sequence [options...] [extra tags...]'
+        f' --use-id-sequence|--use-link-sequence|--use-id-file #filepath [options...] [extra tags...]'
     )
     pcig1 = pci.add_argument_group(title='options')
     pcigm1 = pcig1.add_mutually_exclusive_group(required=True)
@@ -340,10 +393,15 @@ def parse_arglist(args: Sequence[str]) -> Namespace:
     pcigm2.add_argument('-count', metavar='#number', default=1, help=HELP_ARG_ID_COUNT, type=positive_nonzero_int)
     pcigm2.add_argument('-end', metavar='#number', default=1, help=HELP_ARG_ID_END, type=positive_nonzero_int)
     pcig1.add_argument('-lookahead', metavar='#number', default=0, help=HELP_ARG_LOOKAHEAD, type=valid_lookahead)
+    pcig1.add_argument('-lprobe', '--lookahead-probe', action=ACTION_STORE_TRUE, help=HELP_ARG_LOOKAHEAD_PROBE)
     pcig1.add_argument('-gpred', '--predict-id-gaps', default=IDGP_DEFAULT, help=HELP_ARG_PREDICT_ID_GAPS, choices=IDGAP_PREDICTION_MODES)
+    pcig1.add_argument('-gconf', '--id-gaps-confidence', metavar='#percent', default=IDGAP_CONFIDENCE_DEFAULT, help=HELP_ARG_ID_GAPS_CONFIDENCE,
+                       type=valid_id_gaps_confidence)
     pcigm1.add_argument('-seq', '--use-id-sequence', action=ACTION_STORE_TRUE, help=HELP_ARG_IDSEQUENCE)
     pcigm1.add_argument('-links', '--use-link-sequence', action=ACTION_STORE_TRUE, help=HELP_ARG_LINKSEQUENCE)
+    pcigm1.add_argument('-idfile', '--use-id-file', metavar='#filepath', default=None, help=HELP_ARG_IDFILE, type=valid_filepath_in)
     pcig1.add_argument('-votecheck', '--check-votes', action=ACTION_STORE_TRUE, help=HELP_ARG_CHECK_VOTES)
+    pcig1.add_argument('-nopush', '--no-search-pushdown', action=ACTION_STORE_TRUE, help=HELP_ARG_NO_SEARCH_PUSHDOWN)
 
     # Pages
     pcp = parsers[PARSER_TITLE_PAGES]
@@ -362,6 +420,9 @@ def parse_arglist(args: Sequence[str]) -> Namespace:
     pcpg1.add_argument('-stop_id', metavar='#number', default=1, help='', type=positive_nonzero_int)
     pcpg1.add_argument('-begin_id', metavar='#number', default=10**9, help=HELP_ARG_BEGIN_STOP_ID, type=positive_nonzero_int)
     pcpg1.add_argument('-pall', '--scan-all-pages', action=ACTION_STORE_TRUE, help=HELP_ARG_ALL_PAGES)
+    pcpg1.add_argument('-pseek', '--seek-pages', action=ACTION_STORE_TRUE, help=HELP_ARG_SEEK_PAGES)
+    pcpg1.add_argument('-dnames', '--allow-duplicate-names', action=ACTION_STORE_TRUE, help=HELP_ARG_ALLOW_DUPLICATE_NAMES)
+    pcpg1.add_argument('-skipex', '--skip-existing', action=ACTION_STORE_TRUE, help=HELP_ARG_SKIP_EXISTING)
     pcpgm2 = pcpg1.add_mutually_exclusive_group()
     # pcpgm2.add_argument('-playlist_id', metavar='#number', default=(0, ''), help='', type=valid_playlist_id)
     # pcpgm2.add_argument('-playlist_name', metavar='#name', default=(0, ''), help=HELP_ARG_PLAYLIST, type=valid_playlist_name)
@@ -378,6 +439,21 @@ def parse_arglist(args: Sequence[str]) -> Namespace:
     pcpg1.add_argument('-blacklist', metavar='#[(a|c|t):]name[,...]', default='', help=HELP_ARG_BLACKLIST, type=valid_blacklist)
     pcpg1.add_argument('-votecheck', '--check-votes', action=ACTION_STORE_TRUE, help=HELP_ARG_CHECK_VOTES)
 
+    # Watch
+    pcw = parsers[PARSER_TITLE_WATCH]
+    pcw.usage = (
+        f'\n{INDENT}{MODULE} {PARSER_TITLE_WATCH}'
+        f' [-start #number] [-delay #min-max] [options...] [extra tags...]'
+    )
+    pcwg1 = pcw.add_argument_group(title='options')
+    pcwg1.add_argument('-start', metavar='#number', default=0, help=HELP_ARG_WATCH_START, type=positive_nonzero_int)
+    pcwg1.add_argument('-delay', metavar='#min-max', default=WATCH_DELAY_DEFAULT, help=HELP_ARG_WATCH_DELAY, type=valid_delay_range)
+    pcwg1.add_argument('-polls', metavar='#number', default=0, help=HELP_ARG_WATCH_POLLS, type=positive_int)
+    pcwg1.add_argument('-gpred', '--predict-id-gaps', default=IDGP_DEFAULT, help=HELP_ARG_PREDICT_ID_GAPS, choices=IDGAP_PREDICTION_MODES)
+    pcwg1.add_argument('-gconf', '--id-gaps-confidence', metavar='#percent', default=IDGAP_CONFIDENCE_DEFAULT, help=HELP_ARG_ID_GAPS_CONFIDENCE,
+                       type=valid_id_gaps_confidence)
+    pcwg1.add_argument('-votecheck', '--check-votes', action=ACTION_STORE_TRUE, help=HELP_ARG_CHECK_VOTES)
+
     # File
     pcf = parsers[PARSER_TITLE_FILE]
     pcf.usage = (
@@ -387,7 +463,7 @@ def parse_arglist(args: Sequence[str]) -> Namespace:
     pcfg1 = pcf.add_argument_group(title='options')
     pcfg1.add_argument('-path', metavar='#filepath', required=True, help=HELP_ARG_CMDFILE, type=valid_filepath_abs)
 
-    [add_common_args(_) for _ in (parser_root, pci, pcp)]
+    [add_common_args(_) for _ in (parser_root, pci, pcp, pcw)]
     [add_logging_args(_) for _ in parsers.values()]
     [add_help(_, _ == parser_root) for _ in parsers.values()]
     return execute_parser(parser_root, args)
@@ -6,10 +6,13 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 #
 #
 
+from collections.abc import Collection
+
 from .defs import (
     CONNECT_RETRIES_BASE,
     DOWNLOAD_MODE_DEFAULT,
     DOWNLOAD_POLICY_DEFAULT,
+    IDGAP_CONFIDENCE_DEFAULT,
     IDGAP_PREDICTION_DEFAULT,
     LOGGING_FLAGS,
     MAX_DEST_SCAN_SUB_DEPTH_DEFAULT,
@@ -19,6 +22,7 @@ from .defs import (
 
 if False is True:  # for hinting only
     from aiohttp import ClientTimeout  # noqa: I001
+    from defs import IntPair, Shard
     from scenario import DownloadScenario
 
 __all__ = ('Config',)
@@ -46,6 +50,8 @@ class BaseConfig:
         'begin_id': 'end_id',
         'header': 'extra_headers',
         'cookie': 'extra_cookies',
+        'delay': 'watch_delay',
+        'polls': 'watch_polls',
     }
 
     def __init__(self) -> None:
@@ -71,6 +77,8 @@ class BaseConfig:
         self.continue_mode: bool | None = None
         self.keep_unfinished: bool | None = None
         self.no_rename_move: bool | None = None
+        self.incremental_sync: bool | None = None
+        self.incremental_sync_recheck: int = 0
         self.save_tags: bool | None = None
         self.save_descriptions: bool | None = None
         self.save_comments: bool | None = None
@@ -78,11 +86,13 @@ class BaseConfig:
         self.skip_empty_lists: bool | None = None
         self.include_previews: bool | None = None
         self.extra_tags: list[str] | None = None
-        self.id_sequence: list[int] | None = None
+        self.id_sequence: Collection[int] | None = None
         self.scenario: DownloadScenario | None = None
         self.naming_flags: int = 0
         self.logging_flags: int = 0
         self.nocolors: bool | None = None
+        self.log_file: str | None = None
+        self.log_json: bool | None = None
         self.start: int = 0
         self.end: int = 0
         self.start_id: int = 0
@@ -104,12 +114,25 @@ class BaseConfig:
         self.check_votes: bool | None = None
         self.extra_headers: list[tuple[str, str]] | None = None
         self.extra_cookies: list[tuple[str, str]] | None = None
+        self.metrics_file: str | None = None
+        self.metrics_port: int | None = None
+        self.profile: str | None = None
+        self.cpu_workers: int = 0
+        self.shard: Shard | None = None
+        self.dedup_images: bool | None = None
+        self.relink_known_images: bool | None = None
+        self.album_export: str | None = None
         # module-specific params (pages only or ids only)
         self.scan_all_pages: bool | None = None
+        self.seek_pages: bool | None = None
         self.use_id_sequence: bool | None = None
         self.use_link_sequence: bool | None = None
+        self.use_id_file: str | None = None
         self.lookahead: int | None = None
+        self.lookahead_probe: bool | None = None
         self.predict_id_gaps: str | None = None
+        self.id_gaps_confidence: int | None = None
+        self.no_search_pushdown: bool | None = None
         self.search: str | None = None
         self.search_tags: str | None = None
         self.search_arts: str | None = None
@@ -125,6 +148,9 @@ class BaseConfig:
         self.model: str | None = None
         self.get_maxid: bool | None = None
         self.allow_duplicate_names: bool | None = None
+        self.skip_existing: bool | None = None
+        self.watch_delay: IntPair | None = None
+        self.watch_polls: int = 0
         # extras (can't be set through cmdline arguments)
         self.nodelay: bool = False
         self.detect_id_gaps: bool = False
@@ -133,9 +159,13 @@ class BaseConfig:
         arglist = [
             '-path', self.dest_base, '-continue', '--store-continue-cmdfile',
             '-log', next(x for x in LOGGING_FLAGS if int(LOGGING_FLAGS[x], 16) == self.logging_flags),
+            *(('-log_file', self.log_file) if self.log_file else ()),
+            *(('--log-json',) if self.log_json else ()),
             # *(('-quality', self.quality) if self.quality != DEFAULT_QUALITY and not self.scenario else ()),
             # *(('-duration', str(self.duration)) if self.duration and not self.scenario else ()),
             *(('--predict-id-gaps', str(self.predict_id_gaps)) if self.predict_id_gaps != IDGAP_PREDICTION_DEFAULT else ()),
+            *(('--id-gaps-confidence', self.id_gaps_confidence)
+              if self.id_gaps_confidence and self.id_gaps_confidence != IDGAP_CONFIDENCE_DEFAULT else ()),
             *(('--lock-files',) if self.lock_files else ()),
             *(('--solve-tag-conflicts',) if self.solve_tag_conflicts else ()),
             *(('--report-duplicates',) if self.report_duplicates else ()),
@@ -168,7 +198,14 @@ class BaseConfig:
             # *(('-sdump',) if self.save_screenshots else ()),
             *(('-previews',) if self.include_previews else ()),
             *(('-nomove',) if self.no_rename_move else ()),
+            *(('-isync',) if self.incremental_sync else ()),
+            *(('-isync_recheck', self.incremental_sync_recheck) if self.incremental_sync_recheck else ()),
             *(('-session_id', self.session_id) if self.session_id else ()),
+            *(('-cpu_workers', self.cpu_workers) if self.cpu_workers else ()),
+            *(('-shard', str(self.shard)) if self.shard else ()),
+            *(('-dedup',) if self.dedup_images else ()),
+            *(('-relink',) if self.relink_known_images else ()),
+            *(('-export', self.album_export) if self.album_export else ()),
             *self.extra_tags,
             *(('-script', self.scenario.fmt_str) if self.scenario else ()),
         ]
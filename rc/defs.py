@@ -30,15 +30,33 @@ MAX_DEST_SCAN_SUB_DEPTH_DEFAULT = 1
 MAX_DEST_SCAN_UPLEVELS_DEFAULT = 0
 MAX_IMAGES_QUEUE_SIZE = 10
 MAX_SCAN_QUEUE_SIZE = 1
+ALBUM_ID_MAX = 200000
+LOOKAHEAD_PROBE_WIDTH = 5
+LISTING_PAGE_ALBUMS_COUNT = 20
+SEARCH_PUSHDOWN_MIN_GAIN = 2
+BLACKLIST_PUSHDOWN_EXPANSION_MAX = 20
+FS_WORKER_THREADS = 4
 DOWNLOAD_STATUS_CHECK_TIMER = 60
 DOWNLOAD_QUEUE_STALL_CHECK_TIMER = 30
 DOWNLOAD_CONTINUE_FILE_CHECK_TIMER = 30
 # SCAN_CANCEL_KEYSTROKE = 'q'
 # SCAN_CANCEL_KEYCOUNT = 2
-# LOOKAHEAD_WATCH_RESCAN_DELAY_MIN = 300
-# LOOKAHEAD_WATCH_RESCAN_DELAY_MAX = 1800
+LOOKAHEAD_WATCH_RESCAN_DELAY_MIN = 300
+LOOKAHEAD_WATCH_RESCAN_DELAY_MAX = 1800
+WATCH_RETRY_POLLS = 5
 RESCAN_DELAY_EMPTY = 1
+METRICS_WRITE_INTERVAL = 10
+LOG_BATCH_SIZE_MAX = 200
+LOG_FILE_SIZE_MAX = 10 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
+METRICS_HISTOGRAM_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
 PREDICTION_REENABLE_THRESHOLD = 3
+IDGAP_MODEL_BUCKET_SIZE = 200
+IDGAP_MODEL_MAX_PERIOD = 4
+IDGAP_MODEL_MIN_SAMPLES = 8
+IDGAP_VERIFY_INTERVAL = 10
+IDGAP_CONFIDENCE_MIN = 50
+IDGAP_CONFIDENCE_DEFAULT = 95
 VOTE_TO_REMOVAL_THRESHOLD = -9
 
 DURATION_MAX = 36000  # 10 hours (in seconds)
@@ -208,16 +226,40 @@ HELP_ARG_LOOKAHEAD = (
     'Continue scanning indefinitely after reaching end id until number of non-existing videos encountered in a row'
     ' reaches this number'
 )
+HELP_ARG_LOOKAHEAD_PROBE = (
+    'Find max existing id after end id by probing ids (galloping forward, then binary search) before scanning instead of scanning'
+    f' ids one by one until lookahead number of non-existing ids in a row. Every probe checks up to {LOOKAHEAD_PROBE_WIDTH:d} ids in a row'
+    ' (ids predicted to be non-existent are not checked, see \'--predict-id-gaps\', never more than lookahead) so smaller gaps are tolerated'
+)
+HELP_ARG_WATCH_START = (
+    'First post id to process. Default is to continue after last post id processed by previous watcher run in this destination'
+    ' (or to only process posts uploaded after start if there was none)'
+)
+HELP_ARG_WATCH_DELAY = (
+    f'Delay between polls (in seconds), random value within range is used every time.'
+    f' Default is \'{LOOKAHEAD_WATCH_RESCAN_DELAY_MIN:d}-{LOOKAHEAD_WATCH_RESCAN_DELAY_MAX:d}\''
+)
+HELP_ARG_WATCH_POLLS = 'Stop after this many polls. Default is \'0\' (run until interrupted)'
 HELP_ARG_PREDICT_ID_GAPS = (
-    'Enable ids known to be non-existent prediction. When video is uploaded to the website post id usually gets incremented more than once.'
-    ' This options allows to skip gaps within id ranges known to contain them, this may cut scan time by up to -66%%.'
-    ' Automatically disables itself if encounters a contradicting post sequence.'
+    'Enable non-existent ids prediction. When album is uploaded to the website post id usually gets incremented more than once.'
+    f' Id gaps model learns dead id ranges and periodic gaps from encountered existing / non-existent ids, stores it in destination'
+    f' folder (\'{PREFIX}!idgaps.json\') and skips ids predicted to be non-existent, this may cut scan time by up to -66%%.'
+    f' Every {IDGAP_VERIFY_INTERVAL:d}th predicted id is requested anyway, prediction disables itself if one of them exists'
+    f' (\'auto\' re-enables it once predictions are confirmed again).'
     ' WARNING: unsafe - may skip valid posts (not trying to request post info), use at your own risk'
 )
+HELP_ARG_ID_GAPS_CONFIDENCE = (
+    f'Min confidence (in percent, {IDGAP_CONFIDENCE_MIN:d}-100) of id being non-existent required for id gap prediction to skip it.'
+    f' Default is \'{IDGAP_CONFIDENCE_DEFAULT:d}\''
+)
 HELP_ARG_IDSEQUENCE = (
     'Use album id sequence instead of id range. This disables start / count / end id parametes and expects an id sequence among extra tags.'
     ' Sequence structure: (id=<id1>~id=<id2>~id=<id3>~...~id=<idN>)'
 )
+HELP_ARG_IDFILE = (
+    'Use album ids from a file instead of id range. This disables start / count / end id parametes.'
+    ' Ids are separated by whitespace or commas, \'id=\' prefix is allowed: <id1> id=<id2>,<id3>...'
+)
 HELP_ARG_LINKSEQUENCE = (
     'Use links instead of id range. This disables start / count / end id parametes and expects at least one link among extra tags'
 )
@@ -266,6 +308,10 @@ HELP_ARG_UTPOLICY = (
 )
 HELP_ARG_DMMODE = '[Debug] Download (file creation) mode'
 HELP_ARG_ALL_PAGES = 'Do not interrupt pages scan if encountered a page having all post ids filtered out'
+HELP_ARG_SEEK_PAGES = (
+    'Locate first page within post id upper bound (\'-begin_id\') by probing pages instead of scanning every page from start page.'
+    ' Takes a few page requests regardless of how deep in the listing the id window is. Not applicable to favourites'
+)
 HELP_ARG_EXTRA_TAGS = (
     'All remaining \'args\' and \'-args\' count as tags to require or exclude. All spaces must be replaced with \'_\'.'
     ' Albums containing any of \'-tags\', or not containing all \'tags\' will be skipped.'
@@ -331,6 +377,11 @@ HELP_ARG_LOGGING = (
     f' All messages equal or above this level will be logged. Default is \'info\''
 )
 HELP_ARG_NOCOLORS = 'Disable logging level dependent colors in log'
+HELP_ARG_LOG_FILE = (
+    f'Also write log to a file (without colors). File is rotated when it reaches {LOG_FILE_SIZE_MAX // (1024 * 1024):d} Mb,'
+    f' {LOG_FILE_BACKUPS:d} old files are kept'
+)
+HELP_ARG_LOG_JSON = 'Write log messages as json lines: {"time": ..., "level": ..., "message": ...}'
 HELP_ARG_HEADER = 'Append additional header. Example: \'-header user_agent=googlebot/1.1\'. Can be used multiple times'
 HELP_ARG_COOKIE = 'Append additional cookie. Example: \'-cookie shm_user=user1\'. Can be used multiple times'
 HELP_ARG_INCLUDE_PREVIEWS = 'Download album preview (ignores download mode)'
@@ -338,6 +389,14 @@ HELP_ARG_DUMP_INFO = 'Save tags / comments to text file (separately)'
 HELP_ARG_SKIP_EMPTY_LISTS = 'Do not store tags / descriptions / comments list if it contains no useful data'
 HELP_ARG_MERGE_LISTS = 'Merge exising tags / descriptions / comments list(s) with saved info (only if saving is enabled)'
 HELP_ARG_CONTINUE = 'Try to continue unfinished files, may be slower if most files already exist'
+HELP_ARG_INCREMENTAL_SYNC = (
+    'Trust existing album folders: if folder name contains pages count \'[N]\' and folder contains exactly N images'
+    ' album is considered complete and skipped without a single network request. Requires \'title\' naming flag to be useful'
+)
+HELP_ARG_INCREMENTAL_SYNC_RECHECK = (
+    'Incremental sync recheck ratio. Every complete album is still fully rechecked once in #ratio days'
+    ' (each run rechecks about 1 / #ratio of them). Default is \'0\' (never)'
+)
 HELP_ARG_UNFINISH = 'Do not clean up unfinished files on interrupt'
 HELP_ARG_NOMOVE = 'Instead of moving already existing album to destination folder download to its original location'
 HELP_ARG_TIMEOUT = f'Connection timeout (in seconds). Default is \'{CONNECT_TIMEOUT_BASE:d}\''
@@ -352,7 +411,44 @@ HELP_ARG_ALLOW_DUPLICATE_NAMES = (
     'Disable search results deduplication (by name).'
     ' By default exact matches will be dropped except the latest one (highest album id)'
 )
+HELP_ARG_SKIP_EXISTING = (
+    'Do not request albums already present in destination folder (matched by album id in folder name).'
+    ' Check is performed using search results, before album page is ever fetched. Existing albums won\'t be updated'
+)
+HELP_ARG_METRICS_FILE = (
+    f'Periodically (every {METRICS_WRITE_INTERVAL:d} seconds) store run metrics (request latency per endpoint, bytes received,'
+    f' retries by status code, queue sizes, parse / filter / disk write times) to a json file'
+)
+HELP_ARG_METRICS_PORT = 'Serve run metrics in Prometheus text format at \'http://127.0.0.1:#port/metrics\''
+HELP_ARG_ALBUM_EXPORT = (
+    'Export metadata of every processed album (title, tags, artists, categories, score, uploader, pages count, description,'
+    ' comments, processing result) to a file as soon as album is processed. Format is picked by file extension:'
+    ' sqlite database for \'.db\', \'.sqlite\', \'.sqlite3\', json lines otherwise. Existing file is appended to'
+)
+HELP_ARG_PROFILE = 'Profile the run using cProfile and save results to a file (readable with pstats / snakeviz)'
+HELP_ARG_CPU_WORKERS = (
+    'Number of worker processes to parse and filter album pages in, leaving main process for network only.'
+    ' Default is \'0\' (parse in main process)'
+)
+HELP_ARG_SHARD = (
+    'Process only a part of albums: shard #K of #N (albums with id %% N = K - 1). Runs with the same #N can be started'
+    ' on different hosts with shared destination folder: albums are claimed using claim files so no album is processed twice,'
+    ' the last finished shard merges everyone\'s tags / descriptions / comments lists'
+)
+HELP_ARG_DEDUP_IMAGES = (
+    'Deduplicate images by content: hash images while downloading and hardlink duplicates found across albums instead of storing'
+    ' new copies. Index of known images is kept in destination folder so images with known id are linked without downloading'
+)
+HELP_ARG_RELINK_KNOWN_IMAGES = (
+    'Before downloading an image look it up by id among images already present in any album folder found in destination'
+    ' and hardlink (or copy) it from there instead. Index of known images is kept in destination folder'
+)
 HELP_ARG_CHECK_VOTES = 'Query website voting system for downvoted tags/categories/artists to ignore during filtering'
+HELP_ARG_NO_SEARCH_PUSHDOWN = (
+    'Always request every album page within id range. By default, if required extra tags are plain tags / artists / categories'
+    ' selective enough (by known posts count), albums are looked up using website search restricted by id range instead'
+    ' (extra tags are still checked as usual)'
+)
 
 
 class DownloadResult(IntEnum):
@@ -389,6 +485,24 @@ class StrPair(NamedTuple):
     second: str
 
 
+class DownloadSummary(NamedTuple):
+    stored_lists: list[StrPair]
+    '''Info lists stored by export_album_info()'''
+    unfinished: dict[int, DownloadResult]
+    '''Albums which failed or were not found, by id'''
+
+
+class Shard(NamedTuple):
+    index: int  # 1-based
+    count: int
+
+    def __str__(self) -> str:
+        return f'{self.index:d}/{self.count:d}'
+
+    def owns(self, album_id: int) -> bool:
+        return album_id % self.count == self.index - 1
+
+
 class Duration(NamedTuple):
     min: int
     max: int
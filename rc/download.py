@@ -9,34 +9,44 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 import os
 import pathlib
 import sys
+import time
 import urllib.parse
-from asyncio import sleep
+from asyncio import gather, sleep
+from collections.abc import Collection
+from contextlib import nullcontext
 
 from aiofile import async_open
-from aiohttp import ClientConnectorError, ClientPayloadError
+from aiohttp import ClientConnectorError, ClientPayloadError, ClientResponse
 
+from .albumexport import AlbumExporter
+from .albumpage import AlbumPageParser, evaluate_album_page
+from .async_fs import AsyncFS
 from .config import Config
 from .defs import (
     DOWNLOAD_MODE_SKIP,
     DOWNLOAD_MODE_TOUCH,
-    DOWNLOAD_POLICY_ALWAYS,
     FULLPATH_MAX_BASE_LEN,
     PREFIX,
     SITE_AJAX_REQUEST_ALBUM,
+    START_TIME,
     TAGS_CONCAT_CHAR,
     DownloadResult,
+    DownloadSummary,
+    LoggingFlags,
     Mem,
     NamingFlags,
 )
 from .downloader import AlbumDownloadWorker, ImageDownloadWorker
 from .dthrottler import ThrottleChecker
-from .fetch_html import ensure_conn_closed, fetch_html, wrap_request
-from .idgaps import IdGapsPredictor
-from .iinfo import AIState, AlbumInfo, IIFlags, IIState, ImageInfo, export_album_info, get_min_max_ids
+from .fetch_html import ensure_conn_closed, fetch_html_raw, wrap_request
+from .idgaps import IdGapModel, IdGapsPredictor
+from .iinfo import AIState, AlbumInfo, AlbumInfoJournal, IIFlags, IIState, ImageInfo, export_album_info, get_min_max_ids
+from .imgindex import ImageIndex
 from .logger import Log
-from .path_util import FileLock, FileLockError, folder_already_exists, try_rename
+from .metrics import Metrics
+from .path_util import FileLock, FileLockError, folder_already_exists, get_album_folder_pages_count, try_rename
 from .rex import re_album_foldername, re_media_filename, re_replace_symbols
-from .tagger import filtered_tags, is_filtered_out_by_extra_tags, solve_tag_conflicts
+from .shard import claim_album, finish_shard, release_claims
 from .util import (
     calc_sleep_time_retry,
     calculate_eta,
@@ -50,149 +60,104 @@ from .voting import filter_act_by_votes_count
 __all__ = ('at_interrupt', 'download')
 
 
-async def download(sequence: list[AlbumInfo], filtered_count: int) -> None:
+async def download(sequence: Collection[AlbumInfo], filtered_count: int, *, finalize=True) -> DownloadSummary:
     minid, maxid = get_min_max_ids(sequence)
     eta_min = calculate_eta(sequence)
     # interrupt_msg = f'\nPress \'{SCAN_CANCEL_KEYSTROKE}\' twice to stop' if by_id else ''
     Log.info(f'\nOk! {len(sequence):d} ids (+{filtered_count:d} filtered out), bound {minid:d} to {maxid:d}.'
              f' Working...\n'
              f'\nThis will take at least {eta_min:d} seconds{f" ({format_time(eta_min)})" if eta_min >= 60 else ""}!\n')
-    with AlbumDownloadWorker(sequence, process_album) as adwn, ImageDownloadWorker(process_image) as idwn:
+    await AsyncFS.run(ImageIndex.load)
+    await AsyncFS.run(IdGapModel.load)
+    await AsyncFS.run(AlbumInfoJournal.open)
+    await AsyncFS.run(AlbumExporter.open)
+    with (AlbumDownloadWorker(sequence, process_album) as adwn, ImageDownloadWorker(process_image) as idwn,
+          nullcontext() if AlbumPageParser.get() else AlbumPageParser()):
         await adwn.run()
         await idwn.run()
-    export_album_info(sequence)
+        processed_items = adwn.get_processed_items()
+        unfinished = adwn.get_unfinished()
+    await AsyncFS.run(ImageIndex.store)
+    await AsyncFS.run(IdGapModel.store)
+    await AsyncFS.run(AlbumExporter.close)
+    stored_lists = await AsyncFS.run(export_album_info, processed_items)
+    if finalize and not Config.aborted:
+        finish_shard(stored_lists)
+    return DownloadSummary(stored_lists, unfinished)
+
+
+def need_incremental_recheck(ai: AlbumInfo) -> bool:
+    """Recheck selection rotates daily so every complete album gets rechecked once per N days (N = recheck ratio)"""
+    ratio = Config.incremental_sync_recheck
+    return ratio > 0 and (ai.id + START_TIME.toordinal()) % ratio == 0
 
 
 async def process_album(ai: AlbumInfo) -> DownloadResult:
     adwn, idwn = AlbumDownloadWorker.get(), ImageDownloadWorker.get()
     gpred = IdGapsPredictor.get()
-    scenario = Config.scenario
     sname = ai.sname
     extra_ids = adwn.get_extra_ids()
-    my_tags = 'no_tags'
     rating = ai.rating
-    score = ''
 
-    if predicted_prefix := gpred.need_skip(ai):
-        Log.warn(f'Id gap prediction {predicted_prefix} forces error 404 for {sname}, skipping...')
-        gpred.count_nonexisting()
+    if confidence := gpred.need_skip(ai):
+        Log.warn(f'Id gap prediction ({confidence:.1%} confidence) forces error 404 for {sname}, skipping...')
         return DownloadResult.FAIL_NOT_FOUND
 
+    if Config.incremental_sync and (existing_folder := folder_already_exists(ai.id)):
+        expected_count, existing_count = await AsyncFS.run(get_album_folder_pages_count, existing_folder)
+        if 0 < expected_count == existing_count:
+            if need_incremental_recheck(ai):
+                Log.debug(f'Album {sname} is complete in \'{existing_folder}\' but was selected for periodic recheck...')
+            else:
+                Log.info(f'Album {sname} found in \'{existing_folder}\' and all its {existing_count:d} images already exist. Skipped.')
+                gpred.count_existing(ai)
+                return DownloadResult.FAIL_ALREADY_EXISTS
+
+    if not claim_album(ai):
+        Log.info(f'Album {sname} is already claimed by another shard, skipping...')
+        return DownloadResult.FAIL_SKIPPED
+
     ai.set_state(AIState.ACTIVE)
-    a_html = await fetch_html(SITE_AJAX_REQUEST_ALBUM % ai.id)
-    if a_html is None:
-        Log.error(f'Error: unable to retreive html for {sname}! Aborted!')
-        gpred.count_nonexisting()
-        return DownloadResult.FAIL_SKIPPED if Config.aborted else DownloadResult.FAIL_RETRIES
+    a_raw = await fetch_html_raw(SITE_AJAX_REQUEST_ALBUM % ai.id)
+    page = await AlbumPageParser.get().process(ai, a_raw, extra_ids)
 
-    if not len(a_html):
+    if page.empty:
         Log.error(f'Got empty HTML page for {sname}! Rescanning...')
         return DownloadResult.FAIL_EMPTY_HTML
 
-    if a_html.find('title', string='404 Not Found'):
+    if page.not_found:
         Log.error(f'Got error 404 for {sname}, skipping...')
-        gpred.count_nonexisting()
+        gpred.count_nonexisting(ai)
         return DownloadResult.FAIL_NOT_FOUND
 
     gpred.count_existing(ai)
 
-    if not ai.title:
-        titleh1 = a_html.find('h1', class_=lambda x: x.endswith('title'))
-        ai.title = titleh1.text if titleh1 else ''
-
-    Log.info(f'Scanning {sname}: \'{ai.title}\'')
-
-    try:
-        score = str(int(a_html.find('span', class_='voters count').text))
-    except Exception:
-        Log.warn(f'Warning: cannot extract score for {sname}.')
-    try:
-        arts = [' '.join(str(a.text).lower().split(' ')[:-1]) for a in a_html.find('div', string='Artists:').parent.find_all('a')]
-    except Exception:
-        Log.warn(f'Warning: cannot extract authors for {sname}.')
-        arts: list[str] = []
-    try:
-        cats = [' '.join(str(c.text).lower().split(' ')[:-1]) for c in a_html.find('div', string='Categories:').parent.find_all('a')]
-    except Exception:
-        Log.warn(f'Warning: cannot extract categories for {sname}.')
-        cats: list[str] = []
-    tdiv = a_html.find('div', string='Tags:')
-    if tdiv is None:
-        Log.info(f'Warning: album {sname} has no tags!')
-    tags: list[str] = [' '.join(str(t.text).lower().split(' ')[:-1]) for t in tdiv.parent.find_all('a')] if tdiv else []
-    arts_raw, cats_raw, tags_raw = tuple([_.replace(' ', '_').lower() for _ in actlist] for actlist in (arts, cats, tags))
-    if Config.check_votes:
-        await filter_act_by_votes_count(ai, sname, arts_raw, cats_raw, tags_raw)
-    for calist in (cats_raw, arts_raw):
-        for add_tag in [ca for ca in calist if ca]:
-            if add_tag not in tags_raw:
-                tags_raw.append(add_tag)
-    if Config.save_tags:
-        ai.tags = ' '.join(sorted(tags_raw))
-    if Config.save_descriptions or Config.save_comments or Config.check_description_pos or Config.check_description_neg:
-        cidivs = a_html.find_all('div', class_='comment-info')
-        cudivs = [cidiv.find('a') for cidiv in cidivs]
-        ctdivs = [cidiv.find('div', class_='coment-text') for cidiv in cidivs]
-        desc_em = a_html.find('em')  # exactly one
-        uploader_div = a_html.find('div', string=' Uploaded By: ')
-        my_uploader = uploader_div.parent.find('a', class_='name').text.lower().strip() if uploader_div else 'unknown'
-        has_description = (cudivs[-1].text.lower() == my_uploader) if (cudivs and ctdivs) else False  # first comment by uploader
-        if cudivs and ctdivs:
-            assert len(ctdivs) == len(cudivs)
-        if Config.save_descriptions or Config.check_description_pos or Config.check_description_neg:
-            desc_comment = (f'{cudivs[-1].text}:\n' + ctdivs[-1].get_text('\n').strip()) if has_description else ''
-            desc_base = (f'\n{my_uploader}:\n' + desc_em.get_text('\n') + '\n') if desc_em else ''
-            ai.description = desc_base or (f'\n{desc_comment}\n' if desc_comment else '')
-        if Config.save_comments:
-            comments_list = [f'{cudivs[i].text}:\n' + ctdivs[i].get_text('\n').strip() for i in range(len(ctdivs) - int(has_description))]
-            ai.comments = ('\n' + '\n\n'.join(comments_list) + '\n') if comments_list else ''
-    if Config.check_uploader and ai.uploader and ai.uploader not in tags_raw:
-        tags_raw.append(ai.uploader)
-    if Config.solve_tag_conflicts:
-        solve_tag_conflicts(ai, tags_raw)
-    if is_filtered_out_by_extra_tags(ai, tags_raw, Config.extra_tags, Config.id_sequence, ai.subfolder, extra_ids):
-        Log.info(f'Info: album {sname} is filtered out by{" outer" if scenario else ""} extra tags, skipping...')
-        return DownloadResult.FAIL_FILTERED_OUTER if scenario else DownloadResult.FAIL_SKIPPED
-    for vsrs, csri, srn, pc in zip((score, rating), (Config.min_score, Config.min_rating), ('score', 'rating'), ('', '%'), strict=True):
-        if len(vsrs) > 0 and csri is not None:
-            try:
-                if int(vsrs) < csri:
-                    Log.info(f'Info: album {sname} has low {srn} \'{vsrs}{pc}\' (required {csri:d}), skipping...')
-                    return DownloadResult.FAIL_SKIPPED
-            except Exception:
-                pass
-    if scenario:
-        if matching_sq := scenario.get_matching_subquery(ai, tags_raw, score, rating):
-            ai.subfolder = matching_sq.subfolder
-        elif utpalways_sq := scenario.get_utp_always_subquery() if tdiv is None else None:
-            ai.subfolder = utpalways_sq.subfolder
-        else:
-            Log.info(f'Info: unable to find matching or utp scenario subquery for {sname}, skipping...')
-            return DownloadResult.FAIL_SKIPPED
-    elif tdiv is None and len(Config.extra_tags) > 0 and Config.utp != DOWNLOAD_POLICY_ALWAYS:
-        Log.warn(f'Warning: could not extract tags from {sname}, skipping due to untagged albums download policy...')
-        return DownloadResult.FAIL_SKIPPED
-    my_tags = filtered_tags(sorted(tags_raw)) or my_tags
+    if not page.evaluated:
+        if Config.check_votes:
+            await filter_act_by_votes_count(ai, sname, page.arts_raw, page.cats_raw, page.tags_raw)
+        evaluate_album_page(ai, page, extra_ids)
+    AlbumExporter.stage(ai, page)
+    if page.result is not None:
+        return page.result
+    score = page.score
+    my_tags = page.my_tags
 
     prefix = PREFIX if has_naming_flag(NamingFlags.PREFIX) else ''
 
-    try:
-        pages_div = a_html.find('div', string='Pages:')
-        expected_pages_count = int(pages_div.parent.find('span').text)
-    except Exception:
+    expected_pages_count = page.expected_pages_count
+    if expected_pages_count is None:
         Log.error(f'Cannot find expected pages count section for {sname}, failed!')
         return DownloadResult.FAIL_RETRIES
-    try:
-        ai.preview_link = a_html.find('img', src=lambda x: f'/{ai.id}/preview.' in x)['src']
-    except Exception:
+    if page.preview_link is None:
         Log.error(f'Error: cannot find preview section for {sname}! Aborted!')
         return DownloadResult.FAIL_DELETED
+    ai.preview_link = page.preview_link
 
     if Config.include_previews:
         pii = ImageInfo(ai, ai.id, ai.preview_link, f'{prefix}!{ai.id}_{ai.preview_link[ai.preview_link.rfind("/") + 1:]}')
         ai.images.append(pii)
 
-    file_links = [str(_['href']) for _ in a_html.find_all('a', class_='item')]
+    file_links = page.file_links
 
     if len(file_links) == 0:
         Log.error(f'Error: {ai.sfsname} pages count is 0 (raw: {expected_pages_count:d})! Aborted!')
@@ -232,9 +197,9 @@ async def process_album(ai: AlbumInfo) -> DownloadResult:
 
     existing_folder = folder_already_exists(ai.id)
     if existing_folder:
-        curalbum_folder, curalbum_name = os.path.split(existing_folder.strip('/'))
+        curalbum_folder, curalbum_name = os.path.split(existing_folder.rstrip('/'))
         existing_folder_name = os.path.split(existing_folder)[1]
-        same_loc = os.path.isdir(ai.my_folder_base) and os.path.samefile(curalbum_folder, ai.my_folder_base)
+        same_loc = await AsyncFS.isdir(ai.my_folder_base) and await AsyncFS.samefile(curalbum_folder, ai.my_folder_base)
         loc_str = f' ({"same" if same_loc else "different"} location)'
         if Config.continue_mode:
             if existing_folder != ai.my_folder:
@@ -258,8 +223,7 @@ async def process_album(ai: AlbumInfo) -> DownloadResult:
                             Log.warn(f'Warning: unable to rename folder to {ai.my_folder} (already exists?). Old name will be preserved!')
                             ai.name = pathlib.Path(normalize_path(existing_folder)).name
         else:
-            existing_files: list[str] = [de.name for de in os.scandir(existing_folder) if de.is_file()]
-            existing_files = list(filter(re_media_filename.fullmatch, existing_files))
+            existing_files = list(filter(re_media_filename.fullmatch, await AsyncFS.listdir_files(existing_folder)))
             ai_filenames = [imi.filename for imi in ai.images]
             if len(existing_files) == ai.images_count and all(filename in ai_filenames for filename in existing_files):
                 Log.info(f'Album {ai.sfsname} (or similar) found{loc_str} and all its {len(ai.images):d} images already exist. Skipped.'
@@ -278,11 +242,17 @@ async def process_album(ai: AlbumInfo) -> DownloadResult:
                 ai.subfolder = new_subfolder
                 if not await try_rename(existing_folder, normalize_path(os.path.abspath(ai.my_folder), False)):
                     Log.warn(f'Warning: folder {ai.sfsname} already exists! Old folder will be preserved.')
-    elif Config.continue_mode is False and os.path.isdir(ai.my_folder) and all(os.path.isfile(imi.my_fullpath) for imi in ai.images):
+    elif (Config.continue_mode is False and await AsyncFS.isdir(ai.my_folder)
+          and all(await gather(*(AsyncFS.isfile(imi.my_fullpath) for imi in ai.images)))):
         Log.info(f'Album {ai.sfsname} and all its {len(ai.images):d} images already exist. Skipped.')
         ai.images.clear()
         return DownloadResult.FAIL_ALREADY_EXISTS
 
+    if Config.continue_mode and await AsyncFS.isdir(ai.my_folder) and await check_existing_images(ai) == len(ai.images):
+        Log.info(f'Album {ai.sfsname} and all its {len(ai.images):d} images are already complete. Skipped.')
+        ai.images.clear()
+        return DownloadResult.FAIL_ALREADY_EXISTS
+
     Log.info(f'Saving {ai.sfsname}: {ai.images_count:d} images will be downloaded to {ai.my_sfolder_full}')
     [idwn.store_image_info(ii) for ii in ai.images]
 
@@ -290,6 +260,55 @@ async def process_album(ai: AlbumInfo) -> DownloadResult:
     return DownloadResult.SUCCESS
 
 
+async def wrap_image_request(method: str, ii: ImageInfo, **kwargs) -> ClientResponse:
+    """Requests image link following redirects manually, so redirect to another (image) host uses download proxy settings"""
+    ckwargs = {'allow_redirects': not (Config.proxy and (Config.download_without_proxy or Config.html_without_proxy))}
+    ckwargs.update({'noproxy': bool(Config.proxy and Config.html_without_proxy)})
+    r = await wrap_request(method, ii.link, **ckwargs, **kwargs)
+    while r.status in (301, 302):
+        if urllib.parse.urlparse(r.headers['Location']).hostname != urllib.parse.urlparse(ii.link).hostname:
+            ckwargs.update({'noproxy': Config.download_without_proxy, 'allow_redirects': True})
+        ensure_conn_closed(r)
+        r = await wrap_request(method, r.headers['Location'], **ckwargs, **kwargs)
+    return r
+
+
+async def check_existing_image(ii: ImageInfo, file_size: int) -> bool:
+    """Checks whether existing image file is complete using HEAD request, records result in images index"""
+    r = None
+    try:
+        r = await wrap_image_request('HEAD', ii)
+        if r.status != 200 or (r.content_type and 'text' in r.content_type) or r.content_length != file_size:
+            return False
+        ImageIndex.add_verified(ii, file_size, r.headers.get('ETag', ''), r.headers.get('Last-Modified', ''))
+        return True
+    except Exception as e:
+        Log.debug(f'{ii.album.sname}/{ii.sname}: completeness check failed: {sys.exc_info()[0]}: {e!s}')
+        return False
+    finally:
+        ensure_conn_closed(r)
+
+
+async def check_existing_images(ai: AlbumInfo) -> int:
+    """
+    Finds complete images among existing album image files without starting any downloads.
+    Images recorded as complete in images index are not requested, others are checked concurrently using HEAD requests.
+    Marks complete images with a flag and returns their count
+    """
+    to_check: list[tuple[ImageInfo, int]] = []
+    for ii, file_size in zip(ai.images, await gather(*(AsyncFS.getsize(ii.my_fullpath) for ii in ai.images)), strict=True):
+        if file_size == 0 or Config.download_mode == DOWNLOAD_MODE_TOUCH:
+            continue
+        if ImageIndex.is_complete(ii, file_size):
+            ii.set_flag(IIFlags.KNOWN_COMPLETE)
+        else:
+            to_check.append((ii, file_size))
+    for (ii, _), is_complete in zip(to_check, await gather(*(check_existing_image(ii, size) for ii, size in to_check)), strict=True):
+        if is_complete:
+            ii.set_flag(IIFlags.KNOWN_COMPLETE)
+    return sum(ii.has_flag(IIFlags.KNOWN_COMPLETE) for ii in ai.images)
+
+
 async def process_image(ii: ImageInfo) -> DownloadResult:
     while True:
         try:
@@ -304,6 +323,8 @@ async def process_image(ii: ImageInfo) -> DownloadResult:
 
 async def download_image(ii: ImageInfo) -> DownloadResult:
     ret = DownloadResult.SUCCESS
+    # per-image messages are only formatted if they are going to be logged
+    log_info, log_warn = Log.should_log(LoggingFlags.INFO), Log.should_log(LoggingFlags.WARN)
     skip = Config.download_mode == DOWNLOAD_MODE_SKIP and not ii.is_preview
 
     if skip is True:
@@ -311,17 +332,23 @@ async def download_image(ii: ImageInfo) -> DownloadResult:
         ret = DownloadResult.FAIL_SKIPPED
     else:
         ii.set_state(IIState.DOWNLOADING)
-        if not os.path.isdir(ii.my_folder):
+        if not await AsyncFS.isdir(ii.my_folder):
             try:
-                os.makedirs(ii.my_folder)
+                await AsyncFS.makedirs(ii.my_folder)
             except Exception:
                 raise OSError(f'ERROR: Unable to create subfolder \'{ii.my_folder}\'!')
         else:
-            curfile = os.path.isfile(ii.my_fullpath)
+            curfile = await AsyncFS.isfile(ii.my_fullpath)
             if curfile:
                 ii.set_flag(IIFlags.ALREADY_EXISTED_EXACT)
                 if Config.continue_mode is False:
-                    Log.info(f'{ii.filename} already exists. Skipped.')
+                    if log_info:
+                        Log.info(f'{ii.filename} already exists. Skipped.')
+                    ii.set_state(IIState.DONE)
+                    return DownloadResult.FAIL_ALREADY_EXISTS
+                if ii.has_flag(IIFlags.KNOWN_COMPLETE):
+                    if log_info:
+                        Log.info(f'{ii.filename} is already completed. Skipped.')
                     ii.set_state(IIState.DONE)
                     return DownloadResult.FAIL_ALREADY_EXISTS
 
@@ -329,43 +356,45 @@ async def download_image(ii: ImageInfo) -> DownloadResult:
     sname = f'{ii.album.sname}/{ii.sname} {ii.my_num_fmt}'
     idwn = ImageDownloadWorker.get()
     status_checker = ThrottleChecker(ii)
+    if (not skip and Config.download_mode != DOWNLOAD_MODE_TOUCH and not await AsyncFS.isfile(ii.my_fullpath)
+            and await ImageIndex.try_link_known(ii)):
+        if log_info:
+            Log.info(f'{sname} is already known, linked from its previous location')
+        ii.set_state(IIState.DONE)
+        return DownloadResult.SUCCESS
     try_num = 0
     while (not skip) and try_num <= Config.retries:
         r = None
         try:
-            file_exists = os.path.isfile(ii.my_fullpath)
+            file_exists = await AsyncFS.isfile(ii.my_fullpath)
             if file_exists and try_num == 0:
                 ii.set_flag(IIFlags.ALREADY_EXISTED_EXACT)
-            file_size = os.stat(ii.my_fullpath).st_size if file_exists else 0
+            file_size = await AsyncFS.getsize(ii.my_fullpath) if file_exists else 0
 
             if Config.download_mode == DOWNLOAD_MODE_TOUCH and not ii.is_preview:
                 if file_exists:
-                    Log.info(f'{sname} already exists, size: {file_size:d} ({file_size / Mem.MB:.2f} Mb)')
+                    if log_info:
+                        Log.info(f'{sname} already exists, size: {file_size:d} ({file_size / Mem.MB:.2f} Mb)')
                     ii.set_state(IIState.DONE)
                     return DownloadResult.FAIL_ALREADY_EXISTS
                 else:
-                    Log.info(f'Saving<touch> {sname} {0.0:.2f} Mb to {sfilename}')
-                    with open(ii.my_fullpath, 'wb'):
-                        ii.set_flag(IIFlags.FILE_WAS_CREATED)
-                        ii.set_state(IIState.DONE)
+                    if log_info:
+                        Log.info(f'Saving<touch> {sname} {0.0:.2f} Mb to {sfilename}')
+                    await AsyncFS.run(pathlib.Path(ii.my_fullpath).touch)
+                    ii.set_flag(IIFlags.FILE_WAS_CREATED)
+                    ii.set_state(IIState.DONE)
                 break
 
             hkwargs: dict[str, dict[str, str]] = {'headers': {'Range': f'bytes={file_size:d}-'} if file_size > 0 else {}}
-            ckwargs = {'allow_redirects': not (Config.proxy and (Config.download_without_proxy or Config.html_without_proxy))}
-            ckwargs.update({'noproxy': bool(Config.proxy and Config.html_without_proxy)})
             # hkwargs['headers'].update({'Referer': SITE_AJAX_REQUEST_ALBUM % ii.id})
-            r = await wrap_request('GET', ii.link, **ckwargs, **hkwargs)
-            while r.status in (301, 302):
-                if urllib.parse.urlparse(r.headers['Location']).hostname != urllib.parse.urlparse(ii.link).hostname:
-                    ckwargs.update({'noproxy': Config.download_without_proxy, 'allow_redirects': True})
-                ensure_conn_closed(r)
-                r = await wrap_request('GET', r.headers['Location'], **ckwargs, **hkwargs)
+            r = await wrap_image_request('GET', ii, **hkwargs)
             content_len: int = r.content_length or 0
             content_range_s = str(r.headers.get('Content-Range', '/')).split('/', 1)
             content_range = int(content_range_s[1]) if len(content_range_s) > 1 and content_range_s[1].isnumeric() else 1
             if (content_len == 0 or r.status == 416) and file_size >= content_range:
-                size_str = f'{file_size:d} ({file_size / Mem.MB:.2f} Mb'
-                Log.warn(f'{sname} is already completed, size: {size_str})')
+                if log_warn:
+                    Log.warn(f'{sname} is already completed, size: {file_size:d} ({file_size / Mem.MB:.2f} Mb)')
+                ImageIndex.add_verified(ii, file_size, r.headers.get('ETag', ''), r.headers.get('Last-Modified', ''))
                 ii.set_state(IIState.DONE)
                 ret = DownloadResult.FAIL_ALREADY_EXISTS
                 break
@@ -379,20 +408,28 @@ async def download_image(ii: ImageInfo) -> DownloadResult:
 
             status_checker.prepare(r, file_size)
             ii.expected_size = file_size + content_len
-            starting_str = f' <continuing at {file_size:d}>' if file_size else ''
-            total_str = f' / {ii.expected_size / Mem.MB:.2f}' if file_size else ''
-            Log.info(f'Saving{starting_str} {sname} {content_len / Mem.MB:.2f}{total_str} Mb to {sfilename}')
+            if log_info:
+                starting_str = f' <continuing at {file_size:d}>' if file_size else ''
+                total_str = f' / {ii.expected_size / Mem.MB:.2f}' if file_size else ''
+                Log.info(f'Saving{starting_str} {sname} {content_len / Mem.MB:.2f}{total_str} Mb to {sfilename}')
 
             await idwn.add_to_writes(ii)
             ii.set_state(IIState.WRITING)
             status_checker.run()
+            hasher = await AsyncFS.run(ImageIndex.new_hasher, ii, file_size)
+            await AsyncFS.makedirs(ii.my_folder)
             async with async_open(ii.my_fullpath, 'ab') as outf:
                 ii.set_flag(IIFlags.FILE_WAS_CREATED)
                 ii.album.dstart_time = ii.album.dstart_time or get_elapsed_time_i()
                 ii.start_time_write = ii.start_time_write or get_elapsed_time_i()
                 bytes_written_this_try = 0
+                write_time = 0.0
                 async for chunk in r.content.iter_chunked(128 * Mem.KB):
+                    write_start_time = time.perf_counter()
                     await outf.write(chunk)
+                    write_time += time.perf_counter() - write_start_time
+                    if hasher is not None:
+                        hasher.update(chunk)
                     ii.bytes_written += len(chunk)
                     bytes_written_this_try += len(chunk)
                     if try_num > 0 and bytes_written_this_try >= 256 * Mem.KB:
@@ -402,15 +439,20 @@ async def download_image(ii: ImageInfo) -> DownloadResult:
                             await sleep(0.5)
             status_checker.reset()
             await idwn.remove_from_writes(ii)
+            Metrics.inc('received_bytes_total', 'image', bytes_written_this_try)
+            Metrics.observe('disk_write_seconds', 'image', write_time)
 
-            file_size = os.stat(ii.my_fullpath).st_size
+            file_size = await AsyncFS.getsize(ii.my_fullpath)
             if ii.expected_size and file_size != ii.expected_size:
                 Log.error(f'Error: file size mismatch for {sfilename}: {file_size:d} / {ii.expected_size:d}')
                 raise OSError(ii.link)
+            validators = (r.headers.get('ETag', ''), r.headers.get('Last-Modified', ''))
+            if await ImageIndex.add_image(ii, hasher.hexdigest() if hasher is not None else '', *validators) and log_info:
+                Log.info(f'{sname} is a duplicate of already downloaded image, replaced with hardlink')
 
             ii.set_state(IIState.DONE)
 
-            if ii.album.all_done():
+            if ii.album.all_done() and log_info:
                 total_time = (get_elapsed_time_i() - ii.album.dstart_time) or 1
                 total_size = ii.album.total_size()
                 Log.info(f'[download] {ii.album.sfsname} ({total_size / Mem.MB:.1f} Mb) completed in {format_time(total_time)} '
@@ -418,19 +460,21 @@ async def download_image(ii: ImageInfo) -> DownloadResult:
             break
         except Exception as e:
             Log.error(f'{sname}: {sys.exc_info()[0]}: {sys.exc_info()[1]}')
+            Metrics.inc('retries_total', f'{r.status:d}' if r is not None else 'none')
             if (r is None or r.status != 403) and not isinstance(e, (ClientPayloadError, ClientConnectorError)):
                 try_num += 1
                 Log.error(f'{sfilename}: error #{try_num:d}...')
             ensure_conn_closed(r)
             # Network error may be thrown before item is added to active downloads
             await idwn.remove_from_writes(ii, True)
+            AsyncFS.forget_dir(ii.my_folder)  # in case it was removed
             status_checker.reset()
             if try_num <= Config.retries:
                 ii.set_state(IIState.DOWNLOADING)
                 await sleep(calc_sleep_time_retry(r))
-            elif Config.keep_unfinished is False and os.path.isfile(ii.my_fullpath) and ii.has_flag(IIFlags.FILE_WAS_CREATED):
+            elif Config.keep_unfinished is False and await AsyncFS.isfile(ii.my_fullpath) and ii.has_flag(IIFlags.FILE_WAS_CREATED):
                 Log.error(f'Failed to download {sfilename}. Removing unfinished file...')
-                os.remove(ii.my_fullpath)
+                await AsyncFS.remove(ii.my_fullpath)
         finally:
             ensure_conn_closed(r)
 
@@ -445,6 +489,10 @@ async def download_image(ii: ImageInfo) -> DownloadResult:
 
 
 def at_interrupt() -> None:
+    ImageIndex.store()
+    IdGapModel.store()
+    release_claims()
+    AlbumExporter.close()
     idwn = ImageDownloadWorker.get()
     if idwn is not None:
         return idwn.at_interrupt()
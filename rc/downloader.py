@@ -13,10 +13,10 @@ from asyncio import Lock as AsyncLock
 from asyncio.queues import Queue as AsyncQueue
 from asyncio.tasks import as_completed, sleep
 from collections import deque
-from collections.abc import Callable, Coroutine
-from contextlib import suppress
+from collections.abc import Callable, Collection, Coroutine
 from typing import Any, TypeAlias
 
+from .albumexport import AlbumExporter
 from .config import Config
 from .defs import (
     CONNECT_REQUEST_DELAY,
@@ -31,9 +31,11 @@ from .defs import (
     DownloadResult,
     Mem,
 )
-from .iinfo import AIFlags, AIState, AlbumInfo, IIFlags, IIState, ImageInfo, get_min_max_ids
+from .iinfo import AIFlags, AIState, AlbumInfo, AlbumInfoJournal, IIFlags, IIState, ImageInfo, get_min_max_ids
 from .logger import Log
+from .metrics import Metrics
 from .path_util import folder_already_exists_arr
+from .shard import release_album
 from .util import calc_sleep_time_downloader, format_time, get_elapsed_time_i, get_elapsed_time_s
 
 __all__ = ('AlbumDownloadWorker', 'ImageDownloadWorker')
@@ -59,13 +61,14 @@ class AlbumDownloadWorker:
     def __exit__(self, exc_type, exc_val, exc_tb) -> None:
         AlbumDownloadWorker._instance = None
 
-    def __init__(self, sequence: list[AlbumInfo], func: FuncA_T) -> None:
+    def __init__(self, sequence: Collection[AlbumInfo], func: FuncA_T) -> None:
         assert AlbumDownloadWorker._instance is None
         AlbumDownloadWorker._instance = self
 
-        self._original_sequence: list[AlbumInfo] = sequence
         self._func: FuncA_T = func
-        self._seq: deque[AlbumInfo] = deque()
+        self._source = iter(sequence)  # consumed lazily
+        self._source_left: int = len(sequence)
+        self._seq: deque[AlbumInfo] = deque()  # lookahead extra albums
         self._queue: AsyncQueue[tuple[AlbumInfo, Coroutine[Any, Any, DownloadResult]]] = AsyncQueue(1)
         self._orig_count: int = len(sequence)
         self._scan_count: int = 0
@@ -79,9 +82,11 @@ class AlbumDownloadWorker:
         self._extra_ids: list[int] = []
 
         self._completed_items: list[AlbumInfo] = []
+        self._processed_items: list[AlbumInfo] = []
         self._downloads_active: dict[int, AlbumInfo] = {}
         self._scans_active: list[AlbumInfo] = []
         self._failed_items: list[AlbumInfo] = []
+        self._unfinished: dict[int, DownloadResult] = {}
 
         self._total_queue_size_last: int = 0
         self._scan_queue_size_last: int = 0
@@ -89,8 +94,6 @@ class AlbumDownloadWorker:
         self._sequence_lock: AsyncLock = AsyncLock()
         self._active_downloads_lock: AsyncLock = AsyncLock()
 
-        self._seq.extend(sequence)  # form our own container to erase from
-
     def _extend_with_extra(self) -> None:
         extra_cur = Config.lookahead - self._404_counter
         if extra_cur > 0:
@@ -100,9 +103,17 @@ class AlbumDownloadWorker:
             minid, maxid = get_min_max_ids(extra_vis)
             Log.warn(f'[lookahead] extending queue after {last_id:d} with {extra_cur:d} extra ids: {minid:d}-{maxid:d}')
             self._seq.extend(extra_vis)
-            self._original_sequence.extend(extra_vis)
             self._extra_ids.extend(extra_idseq)
 
+    def _seq_size(self) -> int:
+        return len(self._seq) + self._source_left
+
+    def _take_next(self) -> AlbumInfo:
+        if self._source_left > 0:
+            self._source_left -= 1
+            return next(self._source)
+        return self._seq.popleft()
+
     async def _at_task_start(self, ai: AlbumInfo) -> None:
         async with self._active_downloads_lock:
             self._scans_active.append(ai)
@@ -110,6 +121,13 @@ class AlbumDownloadWorker:
 
     async def _at_task_finish(self, ai: AlbumInfo, result: DownloadResult) -> None:
         self._scan_count += 1
+        Metrics.inc('albums_total', result.name.lower())
+        if result != DownloadResult.SUCCESS or not ai.images:
+            # album with images to download gets exported once all of them are processed
+            AlbumExporter.commit(ai, result)
+        if result not in (DownloadResult.SUCCESS, DownloadResult.FAIL_ALREADY_EXISTS):
+            # failed album must be processed again by the next run of this shard
+            release_album(ai)
         if result in (DownloadResult.FAIL_NOT_FOUND, DownloadResult.FAIL_RETRIES,
                       DownloadResult.FAIL_DELETED, DownloadResult.FAIL_FILTERED_OUTER, DownloadResult.FAIL_SKIPPED):
             founditems = list(filter(None, [folder_already_exists_arr(ai.id)]))
@@ -119,8 +137,10 @@ class AlbumDownloadWorker:
                          f'\n - {f"{newline} - ".join(f"{newline} - ".join(ffs) for ffs in founditems)}')
         if result == DownloadResult.FAIL_NOT_FOUND:
             ai.set_flag(AIFlags.RETURNED_404)
+        if result in (DownloadResult.FAIL_NOT_FOUND, DownloadResult.FAIL_RETRIES):
+            self._unfinished[ai.id] = result
         self._404_counter = self._404_counter + 1 if result == DownloadResult.FAIL_NOT_FOUND else 0
-        if len(self._seq) + self._queue.qsize() == 0 and Config.lookahead:
+        if self._seq_size() + self._queue.qsize() == 0 and Config.lookahead:
             self._extend_with_extra()
         if ai in self._scans_active:
             async with self._active_downloads_lock:
@@ -144,9 +164,9 @@ class AlbumDownloadWorker:
                 if self.get_workload_size() == 0:
                     break
                 qfull = self._queue.full()
-                sempty = not bool(self._seq)
+                sempty = self._seq_size() == 0
             if qfull is False and sempty is False:
-                ii = self._seq.popleft()
+                ii = self._take_next()
                 ii.set_state(AIState.QUEUED)
                 await self._queue.put((ii, self._func(ii)))
             else:
@@ -156,7 +176,7 @@ class AlbumDownloadWorker:
         while True:
             async with self._sequence_lock:
                 qsize = self._queue.qsize()
-                ssize = len(self._seq)
+                ssize = self._seq_size()
             if ssize + qsize == 0:
                 break
             async with self._active_downloads_lock:
@@ -177,11 +197,13 @@ class AlbumDownloadWorker:
         force_check_seconds = DOWNLOAD_QUEUE_STALL_CHECK_TIMER
         last_check_seconds = 0
         while self.get_workload_size() > 0:
-            await sleep(calc_sleep_time_downloader() if len(self._seq) + self._queue.qsize() > 0 else 1.0)
-            queue_size = len(self._seq) + self._queue.qsize()
+            await sleep(calc_sleep_time_downloader() if self._seq_size() + self._queue.qsize() > 0 else 1.0)
+            queue_size = self._seq_size() + self._queue.qsize()
             scan_count = self._scan_count
             extra_count = max(0, scan_count - self._orig_count)
             active_count = len(self._scans_active)
+            Metrics.set('queue_size', 'albums', queue_size)
+            Metrics.set('active', 'scans', active_count)
             queue_last = self._total_queue_size_last
             scanning_last = self._scan_queue_size_last
             elapsed_seconds = get_elapsed_time_i()
@@ -228,8 +250,8 @@ class AlbumDownloadWorker:
                  f'{f"+{self.get_extra_count():d}" if Config.lookahead else ""} album(s) enqueued for download, '
                  f'{self._already_exist_count:d} already existed, '
                  f'{self._skipped_count:d} skipped, {self._404_count:d} not found')
-        if len(self._seq) > 0:
-            Log.fatal(f'total queue is still at {len(self._seq):d} != 0!')
+        if self._seq_size() > 0:
+            Log.fatal(f'total queue is still at {self._seq_size():d} != 0!')
         if len(self._failed_items) > 0:
             for fmsg in ('\nFailed items:', *(ai.my_sfolder_full for ai in self._failed_items)):
                 Log.fatal(fmsg)
@@ -249,10 +271,15 @@ class AlbumDownloadWorker:
         Log.info(f'Album {ai.sname}: all images processed')
         if all(ii.state == IIState.DONE for ii in ai.images):
             self._completed_items.append(ai)
+            AlbumExporter.commit(ai, DownloadResult.SUCCESS)
         else:
             self._failed_items.append(ai)
+            self._unfinished[ai.id] = DownloadResult.FAIL_RETRIES
+            AlbumExporter.commit(ai, DownloadResult.FAIL_RETRIES)
         ai.images.clear()
         ai.set_state(AIState.PROCESSED)
+        self._processed_items.append(ai)
+        AlbumInfoJournal.append(ai)
         if ai.id in self._downloads_active:
             del self._downloads_active[ai.id]
 
@@ -270,7 +297,7 @@ class AlbumDownloadWorker:
         return self._scan_count > self._404_counter
 
     def get_workload_size(self) -> int:
-        return len(self._seq) + self._queue.qsize() + len(self._scans_active)
+        return self._seq_size() + self._queue.qsize() + len(self._scans_active)
 
     def get_extra_count(self) -> int:
         return len(self._extra_ids)
@@ -278,13 +305,11 @@ class AlbumDownloadWorker:
     def get_extra_ids(self) -> list[int]:
         return self._extra_ids
 
-    def find_ainfo_pred(self, id_: int) -> AlbumInfo | None:
-        with suppress(StopIteration):
-            return next(filter(lambda ai: ai.id == id_, self._original_sequence))
+    def get_processed_items(self) -> list[AlbumInfo]:
+        return self._processed_items
 
-    def find_ainfo_last(self, id_: int) -> AlbumInfo | None:
-        with suppress(StopIteration):
-            return next(reversed(list(filter(lambda vi: vi.id == id_, self._original_sequence))))
+    def get_unfinished(self) -> dict[int, DownloadResult]:
+        return self._unfinished
 
 
 class ImageDownloadWorker:
@@ -340,6 +365,7 @@ class ImageDownloadWorker:
             async with self._active_downloads_lock:
                 self._downloads_active.remove(ii)
         # Log.trace(f'[queue] {ii.sname} removed from active')
+        Metrics.inc('images_total', result.name.lower())
         if ii.album.all_done():
             AlbumDownloadWorker.get().at_album_completed(ii.album)
         if result == DownloadResult.FAIL_ALREADY_EXISTS:
@@ -393,6 +419,9 @@ class ImageDownloadWorker:
             queue_size = len(self._seq) + self._queue.qsize()
             download_count = len(self._downloads_active)
             write_count = len(self._writes_active)
+            Metrics.set('queue_size', 'images', queue_size)
+            Metrics.set('active', 'downloads', download_count)
+            Metrics.set('active', 'writes', write_count)
             queue_last = self._total_queue_size_last
             downloading_last = self._download_queue_size_last
             write_last = self._write_queue_size_last
@@ -9,6 +9,7 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 from __future__ import annotations
 
 import random
+import time
 import urllib.parse
 from asyncio import AbstractEventLoop, Lock, get_running_loop, sleep
 from collections import deque
@@ -22,6 +23,7 @@ from fake_useragent import FakeUserAgent
 from .config import Config
 from .defs import CONNECT_REQUEST_DELAY, MAX_IMAGES_QUEUE_SIZE, UTF8, Mem
 from .logger import Log
+from .metrics import Metrics, endpoint_of
 from .util import calc_sleep_time_retry
 
 __all__ = ('create_session', 'ensure_conn_closed', 'fetch_html', 'fetch_html_raw', 'wrap_request')
@@ -170,7 +172,11 @@ async def wrap_request(method: str, url: str, **kwargs) -> ClientResponse:
     if 'timeout' not in kwargs:
         kwargs.update(timeout=Config.timeout)
     noproxy = kwargs.pop('noproxy', False)
+    request_time = time.perf_counter()
     r = await (sessionw.npsession if noproxy else sessionw.psession).request(method, url, **kwargs)
+    if Metrics.enabled():
+        Metrics.observe('request_seconds', endpoint_of(url), time.perf_counter() - request_time)
+        Metrics.inc('responses_total', str(r.status))
     return r
 
 
@@ -189,6 +195,7 @@ async def fetch_html_raw(url: str, *, tries=0, **kwargs) -> bytes | None:
                 if r.status != 404:
                     r.raise_for_status()
                 content = await r.read()
+                Metrics.inc('received_bytes_total', 'html', len(content))
                 if retries_403_local > 0:
                     Log.trace(f'fetch_html success: took {retries_403_local:d} tries...')
                 return content
@@ -199,6 +206,7 @@ async def fetch_html_raw(url: str, *, tries=0, **kwargs) -> bytes | None:
             else:
                 Log.error(f'[{retries + 1:d}] fetch_html exception status {f"{r.status:d}" if r is not None else "???"}: '
                           f'\'{e.message if isinstance(e, ClientResponseError) else e!s}\'')
+            Metrics.inc('retries_total', f'{r.status:d}' if r is not None else 'none')
             if (r is None or r.status != 403) and not isinstance(e, ClientConnectorError):
                 retries += 1
             elif r is not None and r.status == 403:
@@ -220,7 +228,8 @@ async def fetch_html_raw(url: str, *, tries=0, **kwargs) -> bytes | None:
 
 async def fetch_html(url: str, *, tries=0, **kwargs) -> BeautifulSoup:
     raw = await fetch_html_raw(url, tries=tries, **kwargs)
-    return BeautifulSoup(raw, 'html.parser', from_encoding=UTF8) if raw else BeautifulSoup()
+    with Metrics.timer('parse_seconds', 'html'):
+        return BeautifulSoup(raw, 'html.parser', from_encoding=UTF8) if raw else BeautifulSoup()
 
 #
 #
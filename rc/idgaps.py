@@ -8,31 +8,147 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 
 from __future__ import annotations
 
-import itertools
+import json
+import os
+
+from bs4 import BeautifulSoup
 
 from .config import Config
-from .defs import IDGAP_PREDICTION_AUTO, IDGAP_PREDICTION_OFF, PREDICTION_REENABLE_THRESHOLD, IntPair
-from .downloader import AlbumDownloadWorker
-from .iinfo import AIFlags, AlbumInfo
+from .defs import (
+    ALBUM_ID_MAX,
+    IDGAP_MODEL_BUCKET_SIZE,
+    IDGAP_MODEL_MAX_PERIOD,
+    IDGAP_MODEL_MIN_SAMPLES,
+    IDGAP_PREDICTION_AUTO,
+    IDGAP_PREDICTION_OFF,
+    IDGAP_VERIFY_INTERVAL,
+    LOOKAHEAD_PROBE_WIDTH,
+    PREDICTION_REENABLE_THRESHOLD,
+    PREFIX,
+    SITE_AJAX_REQUEST_ALBUM,
+    UTF8,
+)
+from .fetch_html import fetch_html_raw
+from .iinfo import AlbumInfo
 from .logger import Log
 
-__all__ = ('IdGapsPredictor',)
+__all__ = ('IdGapModel', 'IdGapsPredictor', 'probe_max_id')
 
-ID_SKIPS = (
-    (IntPair(0, 0), 2),
-)
+IDGAP_MODEL_FILE_NAME = f'{PREFIX}!idgaps.json'
+# counters offset of every period residue within bucket counters: period 1 -> 0, period 2 -> 1..2, period 3 -> 3..5, ...
+_PERIOD_OFFSETS = tuple(period * (period - 1) // 2 for period in range(IDGAP_MODEL_MAX_PERIOD + 1))
+_BUCKET_COUNTERS = _PERIOD_OFFSETS[-1] + IDGAP_MODEL_MAX_PERIOD
+
+
+class IdGapModel:
+    """
+    Persistent model of non-existent album ids learned from observed album pages (existing / 404).
+    Ids are split into buckets, every bucket counts existing and non-existing ids per residue of every period
+    up to IDGAP_MODEL_MAX_PERIOD, so both dead id ranges (period 1) and periodic gaps are learned.
+    Evidence of an id is its own bucket counters, previous bucket ones are used if there is not enough of it\n
+    **Static**
+    """
+    _loaded = False
+    _changed = False
+    _buckets: dict[int, list[int]] = {}
+
+    @staticmethod
+    def _reset() -> None:
+        IdGapModel._loaded = False
+        IdGapModel._changed = False
+        IdGapModel._buckets.clear()
+
+    @staticmethod
+    def enabled() -> bool:
+        return Config.predict_id_gaps not in (IDGAP_PREDICTION_OFF, None)
+
+    @staticmethod
+    def _model_path() -> str:
+        return f'{Config.dest_base}{IDGAP_MODEL_FILE_NAME}'
+
+    @staticmethod
+    def load() -> None:
+        if not IdGapModel.enabled() or IdGapModel._loaded:
+            return
+        IdGapModel._loaded = True
+        if not os.path.isfile(IdGapModel._model_path()):
+            return
+        try:
+            with open(IdGapModel._model_path(), 'rt', encoding=UTF8) as model_file:
+                model: dict[str, int | dict[str, list[int]]] = json.load(model_file)
+            if (model['bucket_size'], model['max_period']) != (IDGAP_MODEL_BUCKET_SIZE, IDGAP_MODEL_MAX_PERIOD):
+                Log.warn(f'Warning: id gaps model \'{IdGapModel._model_path()}\' was built with different parameters, discarded')
+                return
+            IdGapModel._buckets.update({int(bucket): counters for bucket, counters in model['buckets'].items()
+                                        if len(counters) == _BUCKET_COUNTERS * 2})
+            Log.debug(f'Loaded id gaps model of {len(IdGapModel._buckets):d} buckets from \'{IdGapModel._model_path()}\'')
+        except (OSError, ValueError, TypeError, KeyError):
+            Log.error(f'Error: unable to load id gaps model from \'{IdGapModel._model_path()}\'! Starting with empty model...')
+            IdGapModel._buckets.clear()
+
+    @staticmethod
+    def store() -> None:
+        if not IdGapModel._changed:
+            return
+        model_path = IdGapModel._model_path()
+        try:
+            with open(f'{model_path}.tmp', 'wt', encoding=UTF8) as model_file:
+                json.dump({'bucket_size': IDGAP_MODEL_BUCKET_SIZE, 'max_period': IDGAP_MODEL_MAX_PERIOD,
+                           'buckets': {f'{bucket:d}': counters for bucket, counters in sorted(IdGapModel._buckets.items())}},
+                          model_file, separators=(',', ':'))
+            os.replace(f'{model_path}.tmp', model_path)
+            IdGapModel._changed = False
+        except OSError:
+            Log.error(f'Error: unable to save id gaps model to \'{model_path}\'!')
+
+    @staticmethod
+    def observe(album_id: int, exists: bool) -> None:
+        if not IdGapModel.enabled():
+            return
+        counters = IdGapModel._buckets.setdefault(album_id // IDGAP_MODEL_BUCKET_SIZE, [0] * (_BUCKET_COUNTERS * 2))
+        for period in range(1, IDGAP_MODEL_MAX_PERIOD + 1):
+            counters[(_PERIOD_OFFSETS[period] + album_id % period) * 2 + (0 if exists else 1)] += 1
+        IdGapModel._changed = True
+
+    @staticmethod
+    def predict(album_id: int) -> float:
+        """Returns estimated probability of album id being non-existent, 0.0 if there is not enough evidence"""
+        bucket = album_id // IDGAP_MODEL_BUCKET_SIZE
+        evidences = [IdGapModel._buckets[b] for b in (bucket, bucket - 1) if b in IdGapModel._buckets]
+        probability = 0.0
+        for period in range(1, IDGAP_MODEL_MAX_PERIOD + 1):
+            index = (_PERIOD_OFFSETS[period] + album_id % period) * 2
+            existing = missing = 0
+            # own bucket evidence is preferred, previous bucket only fills in if there isn't enough of it
+            for counters in evidences:
+                if existing + missing < IDGAP_MODEL_MIN_SAMPLES:
+                    existing, missing = existing + counters[index], missing + counters[index + 1]
+            if existing + missing >= IDGAP_MODEL_MIN_SAMPLES:
+                # most confident period wins, laplace smoothing
+                probability = max(probability, (missing + 1) / (existing + missing + 2))
+        return probability
+
+    @staticmethod
+    def is_gap(album_id: int) -> bool:
+        return IdGapModel.enabled() and IdGapModel.predict(album_id) >= Config.id_gaps_confidence / 100
 
 
 class IdGapsPredictor:
+    """
+    Skips album ids predicted to be non-existent by IdGapModel. Every IDGAP_VERIFY_INTERVAL-th predicted id is requested
+    anyway to verify prediction, prediction gets disabled if one of them exists ('auto' mode re-enables it
+    once predictions are confirmed again)
+    """
     _instance: IdGapsPredictor | None = None
 
     def __init__(self) -> None:
         assert IdGapsPredictor._instance is None
         IdGapsPredictor._instance = self
 
-        self._enabled = Config.predict_id_gaps != IDGAP_PREDICTION_OFF
-        self._streak = 0
-        self._streaks_count = 0
+        self._enabled = IdGapModel.enabled()
+        self._predicted_count = 0
+        self._confirmed_count = 0
+        self._verifying: set[int] = set()
 
     @staticmethod
     def get() -> IdGapsPredictor:
@@ -40,46 +156,84 @@ class IdGapsPredictor:
             IdGapsPredictor._instance = IdGapsPredictor()
         return IdGapsPredictor._instance
 
-    @staticmethod
-    def _get_skip_num(ai: AlbumInfo) -> int:
-        for idpair, num_skip in reversed(ID_SKIPS):
-            if idpair.first <= ai.id <= idpair.second:
-                return num_skip
-        return 0
-
-    def need_skip(self, ai: AlbumInfo) -> int:
-        if num_skip := (self._get_skip_num(ai) if self._enabled else 0):
-            prevs = tuple(AlbumDownloadWorker.get().find_ainfo_last(ai.id - (_ + 1)) for _ in range(num_skip - 1))
-            prev_stats = tuple((bool(prevs[i]), prevs[i] and prevs[i].has_flag(AIFlags.RETURNED_404)) for i in range(num_skip - 1))
-            f_404s: tuple[bool, ...] = ()
-            for i in range(1, num_skip):
-                if all(prev_stats[_][0] for _ in range(num_skip - i)):
-                    f_404s: tuple[bool, ...] = tuple(prev_stats[_][1] for _ in range(num_skip - i))
-                    break
-            found_one = len(f_404s) == 1 and prev_stats[0][0] is not prev_stats[0][1]
-            found_any = not all(_[0] is _[1] for _ in itertools.pairwise(f_404s))
-            if found_one or found_any:
-                return num_skip
-        return 0
-
-    def count_nonexisting(self) -> None:
-        if AlbumDownloadWorker.get().has_found_any():
-            self._streak += 1
+    def need_skip(self, ai: AlbumInfo) -> float:
+        """Returns probability of album id being non-existent if album needs to be skipped, 0.0 otherwise"""
+        if not self._enabled or not IdGapModel.is_gap(ai.id):
+            return 0.0
+        self._predicted_count += 1
+        if self._predicted_count % IDGAP_VERIFY_INTERVAL == 0:
+            Log.debug(f'Id gap prediction: verifying {ai.sname} predicted to be non-existent...')
+            self._verifying.add(ai.id)
+            return 0.0
+        return IdGapModel.predict(ai.id)
+
+    def count_nonexisting(self, ai: AlbumInfo) -> None:
+        if (not self._enabled and Config.predict_id_gaps == IDGAP_PREDICTION_AUTO and IdGapModel.is_gap(ai.id)
+                and ai.id not in self._verifying):
+            self._confirmed_count += 1
+            if self._confirmed_count >= PREDICTION_REENABLE_THRESHOLD:
+                Log.warn(f'Warning: id gap predictor predicted {self._confirmed_count:d} non-existent ids in a row, re-enabling prediction!')
+                self._enabled = True
+        self._verifying.discard(ai.id)
+        IdGapModel.observe(ai.id, False)
 
     def count_existing(self, ai: AlbumInfo) -> None:
-        if self._streak:
-            skip_num = self._get_skip_num(ai)
-            streak_is_complimentary = skip_num > 0 and (self._streak + 1) % skip_num == 0
-            self._streak = 0
-            self._streaks_count = (self._streaks_count + 1) if streak_is_complimentary else 0
+        if ai.id in self._verifying or (not self._enabled and IdGapModel.is_gap(ai.id)):
+            self._confirmed_count = 0
             if self._enabled:
-                streak_valid = skip_num == 0 or streak_is_complimentary
-                if streak_valid is False:
-                    Log.error(f'Error: id gap predictor encountered unexpected valid post offset != {skip_num:d}. Disabling prediction!')
-                    self._enabled = False
-            elif self._streaks_count >= PREDICTION_REENABLE_THRESHOLD and Config.predict_id_gaps == IDGAP_PREDICTION_AUTO:
-                Log.warn(f'Warning: id gap predictor encountered another gap with post offset == {skip_num:d} re-enabling prediction!')
-                self._enabled = True
+                Log.error(f'Error: id gap predictor predicted existing {ai.sname} to be non-existent. Disabling prediction!')
+                self._enabled = False
+        self._verifying.discard(ai.id)
+        IdGapModel.observe(ai.id, True)
+
+
+async def _album_exists(album_id: int, cache: dict[int, bool]) -> bool:
+    if album_id not in cache:
+        raw = await fetch_html_raw(SITE_AJAX_REQUEST_ALBUM % album_id)
+        if raw:
+            cache[album_id] = not BeautifulSoup(raw, 'html.parser', from_encoding=UTF8).find('title', string='404 Not Found')
+            IdGapModel.observe(album_id, cache[album_id])
+        else:
+            # unable to tell if album exists, assume it does
+            cache[album_id] = True
+    return cache[album_id]
+
+
+async def _probe_alive(album_id: int, cache: dict[int, bool]) -> int:
+    """Returns first existing id within probe window starting at album_id, 0 if none. Ids predicted to be non-existent don't count"""
+    probed = 0
+    for idi in range(album_id, album_id + Config.lookahead):
+        if IdGapModel.is_gap(idi):
+            continue
+        if await _album_exists(idi, cache):
+            return idi
+        probed += 1
+        if probed >= LOOKAHEAD_PROBE_WIDTH:
+            break
+    return 0
+
+
+async def probe_max_id(last_id: int) -> int:
+    """
+    Looks for max existing album id after last_id: gallops forward (+1, +2, +4, ...) until probe hits non-existing ids,
+    then binary searches the boundary. Probe at id checks a window of ids so gaps (known gap patterns
+    and unpublished ids) don't end the search prematurely. Returns last_id if nothing was found
+    """
+    cache: dict[int, bool] = {}
+    max_id = last_id
+    lo, step = last_id, 1
+    while last_id + step <= ALBUM_ID_MAX and (found_id := await _probe_alive(last_id + step, cache)):
+        lo, max_id = last_id + step, max(max_id, found_id)
+        step *= 2
+    hi = min(last_id + step, ALBUM_ID_MAX + 1)
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if found_id := await _probe_alive(mid, cache):
+            lo, max_id = mid, max(max_id, found_id)
+        else:
+            hi = mid
+    Log.info(f'[lookahead] max existing id after {last_id:d}: {max_id:d} ({len(cache):d} ids probed)')
+    return max_id
 
 #
 #
@@ -6,16 +6,21 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 #
 #
 
-import itertools
 from asyncio import sleep
 
+from .async_fs import AsyncFS
 from .config import Config
+from .defs import ALBUM_ID_MAX
 from .download import download
 from .fetch_html import create_session
-from .iinfo import AlbumInfo
+from .idgaps import IdGapModel, probe_max_id
+from .iinfo import AlbumIdSequence
 from .logger import Log
+from .pages import process_pages
 from .path_util import scan_dest_folder
-from .tagger import extract_id_or_group, extract_ids_from_links
+from .planner import apply_search_plan, make_search_plan
+from .shard import filter_shard_ids
+from .tagger import extract_id_or_group, extract_ids_from_file, extract_ids_from_links
 from .validators import find_and_resolve_config_conflicts
 
 __all__ = ('process_ids',)
@@ -36,22 +41,50 @@ async def process_ids() -> int:
             Log.fatal('\nNo links provided!' if not Config.extra_tags else
                       f'\nNo valid links found in \'{Config.extra_tags!s}\'!')
             raise ValueError
+    elif Config.use_id_file:
+        base_id_sequence = list(dict.fromkeys(extract_ids_from_file(Config.use_id_file)))
+        base_id_sequence_len = len(base_id_sequence)
+        if base_id_sequence_len == 0:
+            Log.fatal(f'\nNo ids found in \'{Config.use_id_file}\'!')
+            raise ValueError
     else:
         base_id_sequence = range(Config.start, Config.end + 1)
         base_id_sequence_len = 1 + (Config.end - Config.start)
+        if not Config.no_search_pushdown and (plan := make_search_plan(Config.extra_tags, base_id_sequence_len)):
+            Log.info(f'Using website search ({plan!s}, ~{plan.posts:d} posts) to find albums within id range:'
+                     f' ~{plan.requests:d} requests instead of {base_id_sequence_len:d}...')
+            apply_search_plan(plan)
+            return await process_pages()
 
     if find_and_resolve_config_conflicts() is True:
         await sleep(3.0)
 
-    Config.id_sequence = list(itertools.filterfalse(lambda x: x < 0 or x > 200000, base_id_sequence))
-    if removed_count := base_id_sequence_len - len(Config.id_sequence):
+    if Config.lookahead > 0 and Config.lookahead_probe:
+        # learned id gaps let probe skip ids known to be non-existent
+        await AsyncFS.run(IdGapModel.load)
+        async with create_session():
+            max_id = await probe_max_id(Config.end)
+        await AsyncFS.run(IdGapModel.store)
+        # ids up to found max id become a part of id range so there is nothing left to look ahead for
+        Config.end = max(Config.end, max_id)
+        Config.lookahead = 0
+        base_id_sequence = range(Config.start, Config.end + 1)
+        base_id_sequence_len = 1 + (Config.end - Config.start)
+
+    if isinstance(base_id_sequence, range):
+        id_sequence = range(max(Config.start, 0), min(Config.end, ALBUM_ID_MAX) + 1)
+    else:
+        id_sequence = [idi for idi in base_id_sequence if 0 <= idi <= ALBUM_ID_MAX]
+    if removed_count := base_id_sequence_len - len(id_sequence):
         Log.warn(f'Removed {removed_count:d} known to be non-existent ids!')
+    # used for membership checks only
+    Config.id_sequence = id_sequence if isinstance(id_sequence, range) else frozenset(id_sequence)
 
-    v_entries = [AlbumInfo(idi) for idi in Config.id_sequence]
-    orig_count = len(v_entries)
-    removed_count = 0
+    own_id_sequence = filter_shard_ids(id_sequence)
+    removed_count = len(id_sequence) - len(own_id_sequence)
+    v_entries = AlbumIdSequence(own_id_sequence)
 
-    if orig_count == 0:
+    if len(v_entries) == 0:
         Log.fatal('\nNo albums found. Aborted.')
         return -1
 
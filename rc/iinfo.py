@@ -8,18 +8,25 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 
 from __future__ import annotations
 
+import heapq
+import itertools
+import json
 import os
-import re
-from collections.abc import Iterable
+from collections.abc import Collection, Iterable, Iterator, Sequence
+from contextlib import suppress
 from enum import IntEnum
+from typing import TextIO
 
 from .config import Config
-from .defs import DEFAULT_EXT, PREFIX, UTF8
+from .defs import DEFAULT_EXT, PREFIX, UTF8, StrPair
 from .logger import Log
 from .rex import re_infolist_filename
 from .util import get_elapsed_time_i, normalize_filename, normalize_path
 
-__all__ = ('AIFlags', 'AIState', 'AlbumInfo', 'IIFlags', 'IIState', 'ImageInfo', 'export_album_info', 'get_min_max_ids')
+__all__ = (
+    'AIFlags', 'AIState', 'AlbumIdSequence', 'AlbumInfo', 'AlbumInfoJournal', 'IIFlags', 'IIState', 'ImageInfo', 'export_album_info',
+    'get_min_max_ids', 'merge_album_info_lists',
+)
 
 
 class AIState(IntEnum):
@@ -50,6 +57,7 @@ class IIFlags(IntEnum):
     ALREADY_EXISTED_EXACT = 0x1
     ALREADY_EXISTED_SIMILAR = 0x2
     FILE_WAS_CREATED = 0x4
+    KNOWN_COMPLETE = 0x8
 
 
 class AlbumInfo:
@@ -232,7 +240,31 @@ class ImageInfo:
     __repr__ = __str__
 
 
+class AlbumIdSequence(Collection[AlbumInfo]):
+    """
+    Lazy albums sequence over ids (range or list), album info objects are created on iteration
+    """
+    def __init__(self, ids: Sequence[int]) -> None:
+        self._ids = ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self) -> Iterator[AlbumInfo]:
+        return (AlbumInfo(idi) for idi in self._ids)
+
+    def __contains__(self, item: object) -> bool:
+        return (item.id if isinstance(item, AlbumInfo) else item) in self._ids
+
+    def min_max_ids(self) -> tuple[int, int]:
+        if isinstance(self._ids, range):
+            return (self._ids[0], self._ids[-1]) if self._ids else (10**18, 0)
+        return min(self._ids, default=10**18), max(self._ids, default=0)
+
+
 def get_min_max_ids(seq: Iterable[AlbumInfo]) -> tuple[int, int]:
+    if isinstance(seq, AlbumIdSequence):
+        return seq.min_max_ids()
     min_id, max_id = 10**18, 0
     for ii in seq:
         id_ = ii.id
@@ -243,72 +275,91 @@ def get_min_max_ids(seq: Iterable[AlbumInfo]) -> tuple[int, int]:
     return min_id, max_id
 
 
-def try_merge_info_files(info_dict: dict[int, str], subfolder: str, list_type: str) -> list[str]:
-    parsed_files: list[str] = []
-    if not Config.merge_lists:
-        return parsed_files
+def _find_info_lists(subfolder: str, list_type: str, filenames: Collection[str] | None) -> list[str]:
+    """Returns paths of existing info lists to merge (sorted by name) if merging is enabled. If filenames are provided only these lists"""
+    if (not Config.merge_lists) if filenames is None else (not filenames):
+        return []
     dir_fullpath = normalize_path(f'{Config.dest_base}{subfolder}')
     if not os.path.isdir(dir_fullpath):
-        return parsed_files
-    # Log.debug(f'\nMerging {Config.dest_base}{subfolder} \'{list_type}\' info lists...')
+        return []
     with os.scandir(dir_fullpath) as listing:
-        info_lists: list[re.Match[str]] = sorted(filter(
-            None, (re_infolist_filename.fullmatch(f.name) for f in listing
-                   if f.is_file() and f.name.startswith(f'{PREFIX}!{list_type}_'))), key=lambda m: m.string)
-    if not info_lists:
-        return parsed_files
-    parsed_dict: dict[int, str] = {}
-    for fmatch in info_lists:
-        fmname = fmatch.string
-        # Log.debug(f'Parsing {fmname}...')
-        list_fullpath = f'{dir_fullpath}{fmname}'
-        try:
-            with open(list_fullpath, 'rt', encoding=UTF8) as listfile:
-                last_id = 0
-                for line in listfile.readlines():
-                    line = line.strip('\ufeff')
-                    if line in ('', '\n'):
-                        continue
-                    if line.startswith(PREFIX):
-                        delim_idx = line.find(':')
-                        idi = line[len(PREFIX):delim_idx]
-                        last_id = int(idi)
-                        # Log.debug(f'new id: {last_id:d}{f" (override!)" if last_id in parsed_dict else ""}...')
-                        parsed_dict[last_id] = ''
-                        if len(line) > delim_idx + 2:
-                            parsed_dict[last_id] += line[delim_idx + 2:].strip()
-                            # Log.debug(f'at {last_id:d}: (in place) now \'{parsed_dict[last_id]}\'')
-                            last_id = 0
-                    else:
-                        assert last_id
-                        if not parsed_dict[last_id]:
-                            line = f'\n{line}'
-                        parsed_dict[last_id] += line
-                        # Log.debug(f'at {last_id:d}: adding \'{line}\'')
-                parsed_files.append(list_fullpath)
-        except Exception:
-            Log.error(f'Error reading from {fmname}. Skipped')
-            continue
-    for k, v in parsed_dict.items():
-        if k not in info_dict:
-            info_dict[k] = v
-    return parsed_files
-
-
-def export_album_info(info_list: Iterable[AlbumInfo]) -> None:
-    """Saves tags, descriptions and comments for each subfolder in scenario and base dest folder based on album info"""
+        return sorted(f'{dir_fullpath}{f.name}' for f in listing
+                      if f.is_file() and f.name.startswith(f'{PREFIX}!{list_type}_') and re_infolist_filename.fullmatch(f.name)
+                      and (filenames is None or f.name in filenames))
+
+
+def _iter_info_list(list_fullpath: str, parsed_files: list[str]) -> Iterator[tuple[int, str]]:
+    """Yields (id, info) entries of info list in file order. Adds list path to parsed_files once it is read completely"""
+    try:
+        with open(list_fullpath, 'rt', encoding=UTF8) as listfile:
+            last_id, last_info, multiline = 0, '', False
+            for line in listfile:
+                line = line.strip('\ufeff')
+                if line in ('', '\n'):
+                    continue
+                if line.startswith(PREFIX):
+                    if last_id:
+                        yield last_id, last_info
+                    delim_idx = line.find(':')
+                    last_id = int(line[len(PREFIX):delim_idx])
+                    multiline = len(line) <= delim_idx + 2
+                    last_info = '' if multiline else line[delim_idx + 2:].strip()
+                else:
+                    assert multiline
+                    last_info += line if last_info else f'\n{line}'
+            if last_id:
+                yield last_id, last_info
+        parsed_files.append(list_fullpath)
+    except Exception:
+        Log.error(f'Error reading from {os.path.basename(list_fullpath)}. Skipped')
+
+
+def _prioritized(stream: Iterable[tuple[int, str]], priority: int) -> Iterator[tuple[int, int, str]]:
+    for idi, info in stream:
+        yield idi, -priority, info
+
+
+def _merge_info_streams(streams: Sequence[Iterable[tuple[int, str]]]) -> Iterator[tuple[int, str]]:
+    """Streaming k-way merge of id-sorted (id, info) streams. For duplicate ids entry from the latter stream wins"""
+    last_id = 0
+    for idi, _, info in heapq.merge(*(_prioritized(stream, priority) for priority, stream in enumerate(streams))):
+        if idi != last_id:
+            last_id = idi
+            yield idi, info
+
+
+def export_album_info(info_list: Iterable[AlbumInfo]) -> list[StrPair]:
+    """Saves tags, descriptions and comments for each subfolder in scenario and base dest folder based on album info.
+    Albums recovered from journal of interrupted run are included. Returns stored lists as (subfolder, filename) pairs"""
     tags_dict: dict[str, dict[int, str]] = {}
     desc_dict: dict[str, dict[int, str]] = {}
     comm_dict: dict[str, dict[int, str]] = {}
-    for ai in info_list:
+    for ai in itertools.chain(AlbumInfoJournal.recovered(), info_list):
         if ai.state == AIState.PROCESSED:
             for d, s in zip((tags_dict, desc_dict, comm_dict), (ai.tags, ai.description, ai.comments), strict=True):
                 if ai.my_sfolder not in d:
                     d[ai.my_sfolder] = {}
                 d[ai.my_sfolder][ai.id] = s
+    # sharded run: lists are merged by the last finished shard
+    stored_lists = _store_info_lists((tags_dict, desc_dict, comm_dict), {} if Config.shard else None)
+    AlbumInfoJournal.close(True)
+    return stored_lists
+
+
+def merge_album_info_lists(info_lists: Iterable[StrPair]) -> list[StrPair]:
+    """Merges given (subfolder, filename) lists into one per subfolder and list type (all existing lists if merging is enabled)"""
+    merge_files: dict[str, set[str]] = {}
+    for subfolder, filename in info_lists:
+        merge_files.setdefault(subfolder, set()).add(filename)
+    dicts = tuple({subfolder: {} for subfolder in merge_files} for _ in range(3))
+    return _store_info_lists(dicts, None if Config.merge_lists else merge_files)
+
+
+def _store_info_lists(dicts: tuple[dict[str, dict[int, str]], ...], merge_files: dict[str, Collection[str]] | None) -> list[StrPair]:
+    stored_lists: list[StrPair] = []
     for conf, dct, name, proc_cb in zip(
         (Config.save_tags, Config.save_descriptions, Config.save_comments),
-        (tags_dict, desc_dict, comm_dict),
+        dicts,
         ('tags', 'descriptions', 'comments'),
         (lambda tags: f' {tags.strip()}\n', lambda description: f'{description}\n', lambda comments: f'{comments}\n'),
         strict=True,
@@ -316,20 +367,97 @@ def export_album_info(info_list: Iterable[AlbumInfo]) -> None:
         if not conf:
             continue
         for subfolder, sdct in dct.items():
-            merged_files = try_merge_info_files(sdct, subfolder, name)
-            if not sdct:
+            list_paths = _find_info_lists(subfolder, name, None if merge_files is None else merge_files.get(subfolder, ()))
+            if not sdct and not list_paths:
                 continue
-            if Config.skip_empty_lists and not any(sdct[idi] for idi in sdct):
-                continue
-            keys = sorted(sdct.keys())
-            min_id, max_id = keys[0], keys[-1]
-            info_folder = f'{Config.dest_base}{subfolder}'
-            fullpath = f'{normalize_path(info_folder)}{PREFIX}!{name}_{min_id:d}-{max_id:d}.txt'
+            info_folder = normalize_path(f'{Config.dest_base}{subfolder}')
             if not os.path.isdir(info_folder):
                 os.makedirs(info_folder)
-            with open(fullpath, 'wt', encoding=UTF8) as sfile:
-                sfile.writelines(f'{PREFIX}{idi:d}:{proc_cb(sdct[idi])}' for idi in keys)
+            # existing lists are sorted by id, merged output is written to temporary file until ids range is known
+            merged_files: list[str] = []
+            streams = [*(_iter_info_list(list_path, merged_files) for list_path in list_paths), sorted(sdct.items())]
+            tmp_fullpath = f'{info_folder}{PREFIX}!{name}.tmp'
+            min_id = max_id = 0
+            has_info = False
+            with open(tmp_fullpath, 'wt', encoding=UTF8) as sfile:
+                for idi, info in _merge_info_streams(streams):
+                    min_id, max_id = min_id or idi, idi
+                    has_info = has_info or bool(info)
+                    sfile.write(f'{PREFIX}{idi:d}:{proc_cb(info)}')
+            if not max_id or (Config.skip_empty_lists and not has_info):
+                os.remove(tmp_fullpath)
+                continue
+            fullpath = f'{info_folder}{PREFIX}!{name}_{min_id:d}-{max_id:d}.txt'
+            os.replace(tmp_fullpath, fullpath)
             [os.remove(merged_file) for merged_file in merged_files if merged_file != fullpath]
+            stored_lists.append(StrPair(subfolder, os.path.basename(fullpath)))
+    return stored_lists
+
+
+class AlbumInfoJournal:
+    """
+    Append-only journal of processed albums info (tags, descriptions, comments). Records are flushed as albums complete
+    so collected info survives a crash, journal left by interrupted run is picked up by the next export\n
+    **Static**
+    """
+    _file: TextIO | None = None
+    _recovered: list[AlbumInfo] = []
+
+    @staticmethod
+    def _path() -> str:
+        shard_suffix = f'_{Config.shard.index:d}of{Config.shard.count:d}' if Config.shard else ''
+        return f'{Config.dest_base}{PREFIX}!journal{shard_suffix}.jsonl'
+
+    @staticmethod
+    def open() -> None:
+        if AlbumInfoJournal._file is not None or not (Config.save_tags or Config.save_descriptions or Config.save_comments):
+            return
+        journal_path = AlbumInfoJournal._path()
+        try:
+            if os.path.isfile(journal_path):
+                with open(journal_path, 'rt', encoding=UTF8) as jfile:
+                    for line in jfile:
+                        try:
+                            record: dict[str, int | str] = json.loads(line)
+                        except ValueError:  # last record may be incomplete
+                            continue
+                        ai = AlbumInfo(record['id'])
+                        ai.subfolder, ai.tags, ai.description, ai.comments = (record[k] for k in ('subfolder', 'tags', 'description', 'comments'))
+                        ai.set_state(AIState.PROCESSED)
+                        AlbumInfoJournal._recovered.append(ai)
+                if AlbumInfoJournal._recovered:
+                    Log.info(f'Recovered info of {len(AlbumInfoJournal._recovered):d} album(s) from interrupted run journal')
+            os.makedirs(Config.dest_base, exist_ok=True)
+            AlbumInfoJournal._file = open(journal_path, 'at', encoding=UTF8)
+        except OSError:
+            Log.error(f'Error: unable to open albums info journal \'{journal_path}\'!')
+
+    @staticmethod
+    def close(remove: bool) -> None:
+        """Closes journal, removes it if all recorded info is stored"""
+        AlbumInfoJournal._recovered.clear()
+        if AlbumInfoJournal._file is None:
+            return
+        AlbumInfoJournal._file.close()
+        AlbumInfoJournal._file = None
+        if remove:
+            with suppress(OSError):
+                os.remove(AlbumInfoJournal._path())
+
+    @staticmethod
+    def recovered() -> list[AlbumInfo]:
+        return AlbumInfoJournal._recovered
+
+    @staticmethod
+    def append(ai: AlbumInfo) -> None:
+        if AlbumInfoJournal._file is None:
+            return
+        record = {'id': ai.id, 'subfolder': ai.subfolder, 'tags': ai.tags, 'description': ai.description, 'comments': ai.comments}
+        try:
+            AlbumInfoJournal._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            AlbumInfoJournal._file.flush()
+        except OSError:
+            Log.error(f'Error: unable to write to albums info journal \'{AlbumInfoJournal._path()}\'!')
 
 #
 #
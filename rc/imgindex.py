@@ -0,0 +1,250 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+from typing import NamedTuple
+
+from .async_fs import AsyncFS
+from .config import Config
+from .defs import PREFIX, UTF8, Mem
+from .iinfo import ImageInfo
+from .logger import Log
+from .metrics import Metrics
+from .path_util import found_album_folders
+from .rex import re_media_filename
+from .util import normalize_path
+
+__all__ = ('ImageIndex',)
+
+IMAGE_INDEX_FILE_NAME = f'{PREFIX}!images.json'
+IMAGE_HASH_ALGORITHM = 'sha256'
+INDEX_FOLDERS_KEY = '!folders'
+
+
+class ImageRecord(NamedTuple):
+    path: str  # relative to destination folder if inside it
+    size: int
+    digest: str = ''  # empty if content was never hashed
+    etag: str = ''
+    modified: str = ''  # Last-Modified
+    verified: bool = False  # known to be complete (downloaded or checked against server)
+
+
+class ImageIndex:
+    """
+    Persistent index of known images: image id -> (location, size, content hash, http validators) and content hash -> location\n
+    Used to store duplicate images as hardlinks, to link (or copy) images with known id instead of downloading them again
+    and to skip completeness checks of existing images in continue mode\n
+    Index state is only accessed from the event loop; filesystem checks and linking are offloaded to AsyncFS thread pool\n
+    **Static**
+    """
+    _loaded = False
+    _changed = False
+    _images: dict[int, ImageRecord] = {}
+    _hashes: dict[str, str] = {}
+    _folders: dict[str, int] = {}  # found album folder -> its mtime (ns) when it was indexed
+
+    @staticmethod
+    def _reset() -> None:
+        ImageIndex._loaded = False
+        ImageIndex._changed = False
+        ImageIndex._images.clear()
+        ImageIndex._hashes.clear()
+        ImageIndex._folders.clear()
+
+    @staticmethod
+    def enabled() -> bool:
+        return bool(Config.dedup_images or Config.relink_known_images or Config.continue_mode)
+
+    @staticmethod
+    def linking_enabled() -> bool:
+        return bool(Config.dedup_images or Config.relink_known_images)
+
+    @staticmethod
+    def _index_path() -> str:
+        return f'{Config.dest_base}{IMAGE_INDEX_FILE_NAME}'
+
+    @staticmethod
+    def _to_record_path(fullpath: str) -> str:
+        fullpath = normalize_path(fullpath, False)
+        return fullpath[len(Config.dest_base):] if fullpath.startswith(Config.dest_base) else fullpath
+
+    @staticmethod
+    def _to_fullpath(record_path: str) -> str:
+        return record_path if os.path.isabs(record_path) else f'{Config.dest_base}{record_path}'
+
+    @staticmethod
+    def _is_intact(fullpath: str, size: int) -> bool:
+        try:
+            return os.stat(fullpath).st_size == size
+        except OSError:
+            return False
+
+    @staticmethod
+    def load() -> None:
+        if not ImageIndex.enabled() or ImageIndex._loaded:
+            return
+        ImageIndex._loaded = True
+        if os.path.isfile(ImageIndex._index_path()):
+            try:
+                with open(ImageIndex._index_path(), 'rt', encoding=UTF8) as index_file:
+                    images: dict[str, list[str | int | bool] | dict[str, int]] = json.load(index_file)
+                ImageIndex._folders.update(images.pop(INDEX_FOLDERS_KEY, {}))
+                for id_str, values in images.items():
+                    record = ImageRecord(*values)
+                    ImageIndex._images[int(id_str)] = record
+                    if record.digest:
+                        ImageIndex._hashes.setdefault(record.digest, record.path)
+                Log.debug(f'Loaded {len(ImageIndex._images):d} known images from \'{ImageIndex._index_path()}\'')
+            except (OSError, ValueError, TypeError):
+                Log.error(f'Error: unable to load images index from \'{ImageIndex._index_path()}\'! Starting with empty index...')
+                ImageIndex._images.clear()
+                ImageIndex._hashes.clear()
+                ImageIndex._folders.clear()
+        if ImageIndex.linking_enabled():
+            ImageIndex._index_found_folders()
+
+    @staticmethod
+    def _index_found_folders() -> None:
+        """
+        Adds images present in found album folders, replacing records of images which are no longer at their recorded location.
+        Folders which weren't modified since they were last indexed are skipped
+        """
+        added_count = 0
+        for folder in found_album_folders():
+            folder_path = ImageIndex._to_record_path(folder)
+            try:
+                mtime = os.stat(folder).st_mtime_ns
+                if ImageIndex._folders.get(folder_path) == mtime:
+                    continue
+                with os.scandir(folder) as listing:
+                    dentries = [de for de in listing if de.is_file()]
+            except OSError:
+                continue
+            for dentry in dentries:
+                f_match = re_media_filename.fullmatch(dentry.name)
+                size = dentry.stat().st_size if f_match else 0
+                if not size:  # not an image or created in 'touch' mode
+                    continue
+                image_id = int(f_match.group(1))
+                record = ImageIndex._images.get(image_id)
+                if record is None or not ImageIndex._is_intact(ImageIndex._to_fullpath(record.path), record.size):
+                    ImageIndex._images[image_id] = ImageRecord(ImageIndex._to_record_path(f'{folder}/{dentry.name}'), size)
+                    added_count += 1
+            ImageIndex._folders[folder_path] = mtime
+            ImageIndex._changed = True
+        if added_count:
+            Log.debug(f'Indexed {added_count:d} images found in destination folder')
+
+    @staticmethod
+    def store() -> None:
+        if not ImageIndex._changed:
+            return
+        index_path = ImageIndex._index_path()
+        try:
+            with open(f'{index_path}.tmp', 'wt', encoding=UTF8) as index_file:
+                images = {f'{id_:d}': list(record) for id_, record in ImageIndex._images.items()}
+                json.dump({INDEX_FOLDERS_KEY: ImageIndex._folders, **images}, index_file, separators=(',', ':'))
+            os.replace(f'{index_path}.tmp', index_path)
+            ImageIndex._changed = False
+        except OSError:
+            Log.error(f'Error: unable to save images index to \'{index_path}\'!')
+
+    @staticmethod
+    def new_hasher(ii: ImageInfo, offset: int) -> hashlib._Hash | None:
+        """Returns content hasher for image about to be written starting at offset (already written part is hashed first)"""
+        if not Config.dedup_images or ii.is_preview:
+            return None
+        hasher = hashlib.new(IMAGE_HASH_ALGORITHM)
+        if offset > 0:
+            with open(ii.my_fullpath, 'rb') as imgf:
+                while chunk := imgf.read(min(offset, Mem.MB)):
+                    hasher.update(chunk)
+                    offset -= len(chunk)
+        return hasher
+
+    @staticmethod
+    def _link(src: str, dest: str, allow_copy: bool) -> bool:
+        """Places hardlink to src at dest, replacing dest if it exists. If hardlinks are unsupported (or src is on another drive) copies src"""
+        tmp_path = f'{dest}.lnk'
+        try:
+            try:
+                os.link(src, tmp_path)
+            except OSError:
+                if not allow_copy:
+                    raise
+                shutil.copyfile(src, tmp_path)
+            os.replace(tmp_path, dest)
+            return True
+        except OSError:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+            return False
+
+    @staticmethod
+    async def try_link_known(ii: ImageInfo) -> bool:
+        """Links image with known id from its recorded location. Returns True if linked"""
+        record = ImageIndex._images.get(ii.id) if ImageIndex.linking_enabled() and not ii.is_preview else None
+        if record is None:
+            return False
+        src = ImageIndex._to_fullpath(record.path)
+        if src == ii.my_fullpath or not await AsyncFS.run(ImageIndex._is_intact, src, record.size):
+            return False
+        if not await AsyncFS.run(ImageIndex._link, src, ii.my_fullpath, True):
+            Log.warn(f'Warning: unable to link or copy known image \'{src}\' to \'{ii.my_fullpath}\'!')
+            return False
+        Metrics.inc('saved_bytes_total', 'known_id', record.size)
+        return True
+
+    @staticmethod
+    def is_complete(ii: ImageInfo, size: int) -> bool:
+        """Returns True if existing image file is recorded as complete"""
+        record = ImageIndex._images.get(ii.id)
+        return record is not None and record.verified and record.size == size and record.path == ImageIndex._to_record_path(ii.my_fullpath)
+
+    @staticmethod
+    def add_verified(ii: ImageInfo, size: int, etag: str, modified: str) -> None:
+        """Registers existing image file confirmed to be complete"""
+        if not ImageIndex.enabled() or ii.is_preview:
+            return
+        path = ImageIndex._to_record_path(ii.my_fullpath)
+        record = ImageIndex._images.get(ii.id)
+        digest = record.digest if record is not None and record.path == path and record.size == size else ''
+        ImageIndex._images[ii.id] = ImageRecord(path, size, digest, etag, modified, True)
+        ImageIndex._changed = True
+
+    @staticmethod
+    async def add_image(ii: ImageInfo, digest: str, etag: str, modified: str) -> bool:
+        """Registers downloaded image, replacing it with hardlink to known image with the same content. Returns True if replaced"""
+        if not ImageIndex.enabled() or ii.is_preview:
+            return False
+        size = await AsyncFS.getsize(ii.my_fullpath)
+        path = ImageIndex._to_record_path(ii.my_fullpath)
+        linked = False
+        if digest:
+            # lookup and claim happen without suspension so concurrent downloads of the same content can't both miss
+            known_path = ImageIndex._hashes.setdefault(digest, path)
+            if known_path != path:
+                known_fullpath = ImageIndex._to_fullpath(known_path)
+                if not await AsyncFS.run(ImageIndex._is_intact, known_fullpath, size):
+                    ImageIndex._hashes[digest] = path
+                elif await AsyncFS.run(ImageIndex._link, known_fullpath, ii.my_fullpath, False):
+                    Metrics.inc('saved_bytes_total', 'dedup', size)
+                    linked = True
+        ImageIndex._images[ii.id] = ImageRecord(path, size, digest, etag, modified, True)
+        ImageIndex._changed = True
+        return linked
+
+#
+#
+#########################################
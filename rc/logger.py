@@ -6,21 +6,135 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 #
 #
 
+import json
+import os
+import sys
+import time
+from contextlib import suppress
 from locale import getpreferredencoding
+from queue import Empty, Queue
+from threading import Thread
 
 from colorama import Fore
 from colorama import init as colorama_init
 
 from .config import Config
-from .defs import UTF8, LoggingFlags
+from .defs import LOG_BATCH_SIZE_MAX, LOG_FILE_BACKUPS, LOG_FILE_SIZE_MAX, UTF8, LoggingFlags
+
+LogRecord = tuple[float, str, LoggingFlags]
+
+
+class LogWriter(Thread):
+    """
+    Background log writer. Formats queued messages and writes them in batches to console and optional (rotating) log file
+    """
+    def __init__(self) -> None:
+        super().__init__(name='LogWriter', daemon=True)
+        self._queue: Queue[LogRecord | None] = Queue()
+        self._file = None
+        self._file_size = 0
+
+    def put(self, record: LogRecord) -> None:
+        self._queue.put(record)
+
+    def flush(self) -> None:
+        """Blocks until all queued messages are written"""
+        self._queue.join()
+
+    def stop(self) -> None:
+        self._queue.put(None)
+        self.join()
+
+    def run(self) -> None:
+        if Config.log_file:
+            self._open_file()
+        try:
+            while True:
+                batch = [self._queue.get()]
+                while len(batch) < LOG_BATCH_SIZE_MAX and batch[-1] is not None:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except Empty:
+                        break
+                records = [record for record in batch if record is not None]
+                try:
+                    if records:
+                        self._write(records)
+                finally:
+                    [self._queue.task_done() for _ in batch]
+                if len(records) < len(batch):
+                    break
+        finally:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _write(self, records: list[LogRecord]) -> None:
+        lines = [Log.format_record(record, not Config.nocolors and not Config.log_json) for record in records]
+        Log.print('\n'.join(lines))
+        if self._file is not None:
+            if not Config.log_json and not Config.nocolors:
+                lines = [Log.format_record(record, False) for record in records]
+            self._write_file('\n'.join(lines) + '\n')
+
+    def _open_file(self) -> None:
+        try:
+            self._file = open(Config.log_file, 'at', encoding=UTF8, errors=Log.ERR_POLICY)
+            self._file_size = self._file.tell()
+        except OSError:
+            Log.print(f'Unable to open log file \'{Config.log_file}\'! File logging disabled')
+            self._file = None
+
+    def _rotate_file(self) -> None:
+        self._file.close()
+        self._file = None
+        try:
+            for i in reversed(range(1, LOG_FILE_BACKUPS)):
+                if os.path.isfile(f'{Config.log_file}.{i:d}'):
+                    os.replace(f'{Config.log_file}.{i:d}', f'{Config.log_file}.{i + 1:d}')
+            os.replace(Config.log_file, f'{Config.log_file}.1')
+        except OSError:
+            Log.print(f'Unable to rotate log file \'{Config.log_file}\'!')
+        self._open_file()
+
+    def _write_file(self, text: str) -> None:
+        if self._file_size >= LOG_FILE_SIZE_MAX:
+            self._rotate_file()
+            if self._file is None:
+                return
+        try:
+            self._file.write(text)
+            self._file.flush()
+            self._file_size += len(text.encode(UTF8, errors=Log.ERR_POLICY))
+        except OSError:
+            pass
+
+
+class LogCollector:
+    """
+    Collects log records instead of writing them. Used in worker processes to pass messages to main process
+    """
+    def __init__(self) -> None:
+        self.records: list[LogRecord] = []
+
+    def put(self, record: LogRecord) -> None:
+        self.records.append(record)
+
+    def flush(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
 
 
 class Log:
     """
     Basic logger supporting different log levels, colors and extra logging flags\n
+    Messages passing level check are queued and written by background thread (if started)\n
     **Static**
     """
     _disabled = False
+    _writer: LogWriter | LogCollector | None = None
 
     COLORS = {
         LoggingFlags.TRACE: Fore.WHITE,
@@ -37,23 +151,60 @@ class Log:
     def init() -> None:
         if not Config.nocolors:
             colorama_init()
+        if Log._writer is None:
+            Log._writer = LogWriter()
+            Log._writer.start()
+
+    @staticmethod
+    def shutdown() -> None:
+        """Writes all pending messages and stops background writer"""
+        if Log._writer is not None:
+            Log._writer.stop()
+            Log._writer = None
+
+    @staticmethod
+    def flush() -> None:
+        if Log._writer is not None:
+            Log._writer.flush()
+
+    @staticmethod
+    def collect() -> list[LogRecord]:
+        """Redirects all further messages into returned list"""
+        Log._writer = LogCollector()
+        return Log._writer.records
+
+    @staticmethod
+    def write_records(records: list[LogRecord]) -> None:
+        """Writes messages collected elsewhere (see collect())"""
+        for record in records:
+            if Log._writer is not None:
+                Log._writer.put(record)
+            else:
+                Log.print(Log.format_record(record, not Config.nocolors))
 
     @staticmethod
     def should_log(flags: LoggingFlags) -> bool:
         return flags >= Config.logging_flags and not Log._disabled
 
     @staticmethod
-    def log(text: str, flags: LoggingFlags) -> None:
-        # if flags & LoggingFlags.FATAL == 0 and Config.logging_flags & flags != flags:
-        if not Log.should_log(flags):
-            return
-
-        if not Config.nocolors:
+    def format_record(record: LogRecord, colored: bool) -> str:
+        timestamp, text, flags = record
+        if Config.log_json:
+            level = next((f for f in reversed(Log.COLORS.keys()) if f & flags), LoggingFlags.INFO)
+            return json.dumps({
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(timestamp)) + f'.{int(timestamp % 1 * 1000):03d}',
+                'level': level.name.lower(),
+                'message': text,
+            }, ensure_ascii=False)
+        if colored:
             for f in reversed(Log.COLORS.keys()):
                 if f & flags:
                     text = f'{Log.COLORS[f]}{text}{Fore.RESET}'
                     break
+        return text
 
+    @staticmethod
+    def print(text: str) -> None:
         try:
             print(text)
         except UnicodeError:
@@ -61,6 +212,23 @@ class Log:
                 print(text.encode(UTF8, errors=Log.ERR_POLICY).decode(getpreferredencoding(), errors=Log.ERR_POLICY))
             except Exception:
                 print('<Message was not logged due to UnicodeError>')
+        except (OSError, ValueError):  # stdout is closed or broken
+            return
+        if Log._writer is not None:
+            with suppress(OSError, ValueError):
+                sys.stdout.flush()
+
+    @staticmethod
+    def log(text: str, flags: LoggingFlags) -> None:
+        # if flags & LoggingFlags.FATAL == 0 and Config.logging_flags & flags != flags:
+        if not Log.should_log(flags):
+            return
+
+        record = (time.time(), text, flags)
+        if Log._writer is not None:
+            Log._writer.put(record)
+        else:
+            Log.print(Log.format_record(record, not Config.nocolors))
 
     @staticmethod
     def fatal(text: str) -> None:
@@ -10,14 +10,17 @@ import sys
 from asyncio import get_running_loop, run, sleep
 from collections.abc import Callable, Coroutine, Sequence
 
+from .async_fs import AsyncFS
 from .cmdargs import HelpPrintExitException, parse_logging_args, prepare_arglist
 from .config import Config
 from .defs import MIN_PYTHON_VERSION, MIN_PYTHON_VERSION_STR
 from .download import at_interrupt
 from .ids import process_ids
 from .logger import Log
+from .metrics import MetricsExporter, Profiler
 from .pages import process_pages
 from .version import APP_NAME, APP_VERSION
+from .watch import process_watch
 
 __all__ = ('main_async', 'main_sync')
 
@@ -47,12 +50,15 @@ async def main(args: Sequence[str]) -> int:
     actions: dict[str, Callable[[], Coroutine[int]]] = {
         'ids': process_ids,
         'pages': process_pages,
+        'watch': process_watch,
     }
 
     action_name = Config.get_action_string()
     assert action_name in actions, f'Unknown action \'{action_name}\'!'
     proc = actions[action_name]
-    return await proc()
+    with Profiler():
+        async with MetricsExporter():
+            return await proc()
 
 
 async def run_main(args: Sequence[str]) -> int:
@@ -79,7 +85,11 @@ def main_sync(args: Sequence[str]) -> int:
     except RuntimeError:  # no current event loop
         loop = None
     run_func = loop.run_until_complete if loop else run
-    return run_func(main_async(args))
+    try:
+        return run_func(main_async(args))
+    finally:
+        AsyncFS.shutdown()
+        Log.shutdown()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,290 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from __future__ import annotations
+
+import json
+import time
+import urllib.parse
+from asyncio import CancelledError, Task, get_running_loop, sleep
+from bisect import bisect_left
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from .config import Config
+from .defs import METRICS_HISTOGRAM_BUCKETS, METRICS_WRITE_INTERVAL, UTF8
+from .logger import Log
+from .util import get_elapsed_time_i
+
+__all__ = ('MetricRecord', 'Metrics', 'MetricsExporter', 'Profiler', 'endpoint_of')
+
+MetricRecord = tuple[str, str, str, float]
+'''(update method name, metric name, label, value)'''
+
+METRIC_PREFIX = 'rc_'
+METRICS_DESCRIPTIONS: dict[str, tuple[str, str, str]] = {
+    # name: (type, label name, description)
+    'request_seconds': ('histogram', 'endpoint', 'Time until response headers are received'),
+    'parse_seconds': ('histogram', 'stage', 'Html parsing / page processing time'),
+    'filter_seconds': ('histogram', 'stage', 'Tags / scenario filtering time'),
+    'disk_write_seconds': ('histogram', 'kind', 'Time spent writing file chunks, per file'),
+    'received_bytes_total': ('counter', 'kind', 'Bytes received'),
+    'responses_total': ('counter', 'status', 'Responses received, by status code'),
+    'saved_bytes_total': ('counter', 'method', 'Bytes not downloaded or not stored thanks to images deduplication'),
+    'retries_total': ('counter', 'status', 'Request retries, by status code (\'none\' means no response)'),
+    'albums_total': ('counter', 'result', 'Albums processed, by result'),
+    'images_total': ('counter', 'result', 'Images processed, by result'),
+    'queue_size': ('gauge', 'queue', 'Items waiting in queue'),
+    'active': ('gauge', 'queue', 'Items being processed'),
+    'receive_speed_bytes': ('gauge', 'kind', 'Average bytes per second since launch'),
+}
+
+
+class Histogram:
+    """
+    Fixed buckets histogram (seconds)
+    """
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(METRICS_HISTOGRAM_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.buckets[bisect_left(METRICS_HISTOGRAM_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def to_json(self) -> dict[str, int | float]:
+        return {'count': self.count, 'sum': round(self.sum, 6), 'avg': round(self.sum / max(1, self.count), 6), 'max': round(self.max, 6)}
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms container. Does nothing unless enabled\n
+    **Static**
+    """
+    _enabled = False
+    _counters: dict[str, dict[str, float]] = {}
+    _gauges: dict[str, dict[str, float]] = {}
+    _histograms: dict[str, dict[str, Histogram]] = {}
+    _records: list[MetricRecord] | None = None
+
+    @staticmethod
+    def _reset() -> None:
+        Metrics._enabled = False
+        Metrics._counters.clear()
+        Metrics._gauges.clear()
+        Metrics._histograms.clear()
+        Metrics._records = None
+
+    @staticmethod
+    def collect() -> list[MetricRecord]:
+        """Redirects all further updates into returned list (see apply_records())"""
+        Metrics._records = []
+        return Metrics._records
+
+    @staticmethod
+    def apply_records(records: list[MetricRecord]) -> None:
+        """Applies updates collected elsewhere (see collect())"""
+        for method, name, label, value in records:
+            getattr(Metrics, method)(name, label, value)
+
+    @staticmethod
+    def enable() -> None:
+        Metrics._enabled = True
+
+    @staticmethod
+    def enabled() -> bool:
+        return Metrics._enabled
+
+    @staticmethod
+    def inc(name: str, label='', value: float = 1) -> None:
+        if Metrics._records is not None:
+            Metrics._records.append(('inc', name, label, value))
+        elif Metrics._enabled:
+            labels = Metrics._counters.setdefault(name, {})
+            labels[label] = labels.get(label, 0) + value
+
+    @staticmethod
+    def set(name: str, label: str, value: float) -> None:
+        if Metrics._records is not None:
+            Metrics._records.append(('set', name, label, value))
+        elif Metrics._enabled:
+            Metrics._gauges.setdefault(name, {})[label] = value
+
+    @staticmethod
+    def observe(name: str, label: str, value: float) -> None:
+        if Metrics._records is not None:
+            Metrics._records.append(('observe', name, label, value))
+        elif Metrics._enabled:
+            labels = Metrics._histograms.setdefault(name, {})
+            if label not in labels:
+                labels[label] = Histogram()
+            labels[label].observe(value)
+
+    @staticmethod
+    @contextmanager
+    def timer(name: str, label='') -> Iterator[None]:
+        if not Metrics._enabled:
+            yield
+            return
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            Metrics.observe(name, label, time.perf_counter() - start_time)
+
+    @staticmethod
+    def _update_speeds() -> None:
+        elapsed_seconds = max(1, get_elapsed_time_i())
+        for kind, amount in Metrics._counters.get('received_bytes_total', {}).items():
+            Metrics.set('receive_speed_bytes', kind, round(amount / elapsed_seconds, 2))
+
+    @staticmethod
+    def to_json() -> dict[str, dict[str, dict]]:
+        Metrics._update_speeds()
+        return {
+            'elapsed_seconds': get_elapsed_time_i(),
+            'counters': {name: dict(labels) for name, labels in sorted(Metrics._counters.items())},
+            'gauges': {name: dict(labels) for name, labels in sorted(Metrics._gauges.items())},
+            'histograms': {name: {label: h.to_json() for label, h in labels.items()} for name, labels in sorted(Metrics._histograms.items())},
+        }
+
+    @staticmethod
+    def to_prometheus() -> str:
+        """Formats all metrics using Prometheus text exposition format"""
+        def fmt_labels(label_name: str, label: str, extra='') -> str:
+            pairs = [f'{label_name}="{label}"'] if label else []
+            pairs.extend([extra] if extra else [])
+            return f'{{{",".join(pairs)}}}' if pairs else ''
+
+        Metrics._update_speeds()
+        lines: list[str] = []
+        for container in (Metrics._counters, Metrics._gauges, Metrics._histograms):
+            for name, labels in sorted(container.items()):
+                mtype, label_name, description = METRICS_DESCRIPTIONS[name]
+                fullname = f'{METRIC_PREFIX}{name}'
+                lines.extend((f'# HELP {fullname} {description}', f'# TYPE {fullname} {mtype}'))
+                for label, value in sorted(labels.items()):
+                    if isinstance(value, Histogram):
+                        cumulative = 0
+                        for le, bucket_count in zip((*METRICS_HISTOGRAM_BUCKETS, '+Inf'), value.buckets, strict=True):
+                            cumulative += bucket_count
+                            le_pair = f'le="{le}"'
+                            lines.append(f'{fullname}_bucket{fmt_labels(label_name, label, le_pair)} {cumulative:d}')
+                        lines.append(f'{fullname}_sum{fmt_labels(label_name, label)} {value.sum:.6f}')
+                        lines.append(f'{fullname}_count{fmt_labels(label_name, label)} {value.count:d}')
+                    else:
+                        lines.append(f'{fullname}{fmt_labels(label_name, label)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def store(filepath: str) -> None:
+        try:
+            with open(filepath, 'wt', encoding=UTF8) as outfile:
+                json.dump(Metrics.to_json(), outfile, indent=2)
+        except OSError:
+            Log.error(f'Unable to save metrics to \'{filepath}\'!')
+
+
+class MetricsExporter:
+    """
+    Periodically stores metrics to a json file and/or serves them using local http endpoint (Prometheus format)
+    """
+    def __init__(self) -> None:
+        self._writer: Task | None = None
+        self._runner = None
+
+    async def __aenter__(self) -> MetricsExporter:
+        if not (Config.metrics_file or Config.metrics_port):
+            return self
+        Metrics.enable()
+        if Config.metrics_file:
+            self._writer = get_running_loop().create_task(self._file_writer())
+        if Config.metrics_port:
+            await self._start_server()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+            Metrics.store(Config.metrics_file)
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @staticmethod
+    async def _file_writer() -> None:
+        try:
+            while True:
+                await sleep(METRICS_WRITE_INTERVAL)
+                Metrics.store(Config.metrics_file)
+        except CancelledError:
+            pass
+
+    async def _start_server(self) -> None:
+        from aiohttp import web
+
+        async def serve_metrics(_: web.Request) -> web.Response:
+            return web.Response(text=Metrics.to_prometheus(), content_type='text/plain', charset=UTF8)
+
+        app = web.Application()
+        app.router.add_get('/metrics', serve_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        try:
+            await web.TCPSite(self._runner, '127.0.0.1', Config.metrics_port).start()
+            Log.info(f'Serving metrics at http://127.0.0.1:{Config.metrics_port:d}/metrics')
+        except OSError:
+            Log.error(f'Unable to serve metrics at port {Config.metrics_port:d}!')
+            await self._runner.cleanup()
+            self._runner = None
+
+
+class Profiler:
+    """
+    cProfile wrapper, dumps stats to file and prints top entries on exit. Does nothing if profiling wasn't requested
+    """
+    def __init__(self) -> None:
+        self._profile = None
+
+    def __enter__(self) -> Profiler:
+        if Config.profile:
+            from cProfile import Profile
+            self._profile = Profile()
+            self._profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if self._profile is None:
+            return
+        from io import StringIO
+        from pstats import SortKey, Stats
+        self._profile.disable()
+        try:
+            self._profile.dump_stats(Config.profile)
+            Log.info(f'Profiling results saved to \'{Config.profile}\'')
+        except OSError:
+            Log.error(f'Unable to save profiling results to \'{Config.profile}\'!')
+        report = StringIO()
+        Stats(self._profile, stream=report).sort_stats(SortKey.CUMULATIVE).print_stats(25)
+        Log.debug(report.getvalue())
+        self._profile = None
+
+
+def endpoint_of(url: str) -> str:
+    """Returns endpoint type of the url: first path component without extension ('comic', 'search', 'get_image', etc.)"""
+    path = urllib.parse.urlparse(url).path.strip('/')
+    return path.split('/', 1)[0].split('.', 1)[0] or 'root'
+
+#
+#
+#########################################
@@ -8,6 +8,8 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 
 from asyncio import sleep
 
+from bs4 import BeautifulSoup, Tag
+
 from .config import Config
 from .defs import (
     SITE,
@@ -21,21 +23,101 @@ from .download import download
 from .fetch_html import create_session, fetch_html
 from .iinfo import AlbumInfo
 from .logger import Log
-from .path_util import scan_dest_folder
+from .path_util import folder_already_exists, scan_dest_folder
 from .rex import re_page_entry, re_paginator
+from .shard import filter_shard_albums
+from .tagger import extra_tags_to_blacklist, is_filtered_out_by_title
 from .util import has_naming_flag
 from .validators import find_and_resolve_config_conflicts
 from .version import APP_NAME
 
-__all__ = ('process_pages',)
+__all__ = ('extract_album_refs', 'process_pages')
+
+ALBUM_REF_CLASS = 'item thumb'
+
+
+def extract_album_refs(a_html: BeautifulSoup) -> list[Tag]:
+    """Returns album links found on listing page"""
+    return [a for a in (_.find('a') for _ in a_html.find_all('div', class_=ALBUM_REF_CLASS)) if a and SITE in a['href']]
+
+
+def get_page_addr(pi: int) -> str:
+    return (
+        # (SITE_AJAX_REQUEST_PLAYLIST_PAGE % (Config.playlist_id, Config.playlist_name, pi)) if Config.playlist_name else
+        (SITE_AJAX_REQUEST_FAVOURITES_PAGE % (Config.favourites, 0, pi)) if Config.favourites else
+        (SITE_AJAX_REQUEST_UPLOADER_PAGE % (Config.uploader, pi)) if Config.uploader else
+        (SITE_AJAX_REQUEST_MODEL_PAGE % (Config.model, pi)) if Config.model else
+        (SITE_AJAX_REQUEST_SEARCH_PAGE % (Config.search_tags, Config.search_arts, Config.search_cats, Config.search,
+                                          Config.blacklist, pi))
+    )
+
+
+def extract_max_page(a_html: BeautifulSoup) -> int:
+    """Returns max page number found in listing page pagination, 0 if not found"""
+    maxpage = 0
+    if pagination := a_html.find('div', class_='pagination'):
+        for page_ajax in pagination.find_all('a', attrs={'data-action': 'ajax'}):
+            try:
+                maxpage = max(maxpage, int(re_paginator.search(str(page_ajax.get('data-parameters'))).group(1)))
+            except Exception:
+                pass
+    return maxpage
+
+
+async def fetch_page_ids(pi: int) -> tuple[list[int], int] | None:
+    """Returns album ids found on listing page and max page number, None if page can't be fetched"""
+    a_html = await fetch_html(get_page_addr(pi))
+    if not a_html or ((page_title := a_html.find('title')) and page_title.string.lower().strip() == 'page not found'):
+        return None
+    return [int(re_page_entry.search(str(aref['href'])).group(1)) for aref in extract_album_refs(a_html)], extract_max_page(a_html)
+
+
+async def seek_start_page() -> tuple[int, int]:
+    """
+    Looks for the first listing page containing ids not above upper id bound, probing pages using interpolation search
+    (every probe cuts search range by at least a quarter). Listing is ordered by post date so ids are only expected to be
+    roughly descending, search result is adjusted back by one page. Returns start page and max page (0 if unknown)
+    """
+    first_page = await fetch_page_ids(Config.start)
+    if not first_page or not first_page[0]:
+        return Config.start, 0
+    ids, maxpage = first_page
+    if min(ids) <= Config.end_id or maxpage <= Config.start:
+        return Config.start, maxpage
+    # lo: ids are above window, hi: ids intersect or are below window. Last page ids are assumed to end at 0
+    lo, lo_id = Config.start, min(ids)
+    hi, hi_id = min(maxpage, Config.end) + 1, 0
+    probes = 1
+    while hi - lo > 1:
+        span = hi - lo
+        guess = lo + round((lo_id - Config.end_id) * span / max(1, lo_id - hi_id))
+        probe = min(max(guess, lo + max(1, span // 4)), hi - max(1, span // 4))
+        probe_page = await fetch_page_ids(probe)
+        probes += 1
+        if not probe_page or not probe_page[0]:
+            Log.warn(f'Warning: page seek failed to get page {probe:d} ids, seek stopped')
+            break
+        ids = probe_page[0]
+        Log.trace(f'Page seek: page {probe:d} ids {max(ids):d}..{min(ids):d}')
+        if min(ids) <= Config.end_id:
+            hi, hi_id = probe, max(ids)
+        else:
+            lo, lo_id = probe, min(ids)
+    Log.info(f'Page seek: {probes:d} pages probed, starting from page {lo:d} / {maxpage:d}')
+    return lo, maxpage
 
 
 async def process_pages() -> int:
-    album_ref_class = 'item thumb'
-
     if find_and_resolve_config_conflicts() is True:
         await sleep(3.0)
 
+    if not (Config.get_maxid or Config.favourites or Config.uploader or Config.model):
+        # albums having excluded tags won't even be listed, local filter still applies
+        if pushed_blacklist := extra_tags_to_blacklist(Config.extra_tags):
+            blacklist = [bl for bl in (Config.blacklist or '').split(',') if bl]
+            Config.blacklist = ','.join(dict.fromkeys(blacklist + pushed_blacklist.split(',')))
+            Log.info(f'Info: negative extra tags were added to search blacklist: \'{pushed_blacklist}\'')
+
     def check_id_bounds(album_id: int) -> int:
         if album_id > Config.end_id:
             Log.trace(f'skipping {album_id:d} > {Config.end_id:d}')
@@ -45,24 +127,30 @@ async def process_pages() -> int:
             return -1
         return 0
 
+    def is_prefiltered_out(ai: AlbumInfo) -> bool:
+        """Applies filters which can be decided using listing data only, before album page is ever requested"""
+        if Config.skip_existing and (existing_folder := folder_already_exists(ai.id)):
+            Log.info(f'Info: album {ai.sname} already exists in \'{existing_folder}\', skipping...')
+            return True
+        return is_filtered_out_by_title(ai, Config.extra_tags)
+
     v_entries: list[AlbumInfo] = []
+    v_ids: set[int] = set()
     maxpage = Config.end if Config.start == Config.end else 0
 
+    if not Config.get_maxid:
+        scan_dest_folder()
+
     pi = Config.start
     async with create_session():
+        if Config.seek_pages and not Config.get_maxid:
+            pi, maxpage = await seek_start_page()
         while pi <= Config.end:
             if pi > maxpage > 0:
                 Log.info('reached parsed max page, page scan completed')
                 break
 
-            page_addr = (
-                # (SITE_AJAX_REQUEST_PLAYLIST_PAGE % (Config.playlist_id, Config.playlist_name, pi)) if Config.playlist_name else
-                (SITE_AJAX_REQUEST_FAVOURITES_PAGE % (Config.favourites, 0, pi)) if Config.favourites else
-                (SITE_AJAX_REQUEST_UPLOADER_PAGE % (Config.uploader, pi)) if Config.uploader else
-                (SITE_AJAX_REQUEST_MODEL_PAGE % (Config.model, pi)) if Config.model else
-                (SITE_AJAX_REQUEST_SEARCH_PAGE % (Config.search_tags, Config.search_arts, Config.search_cats, Config.search,
-                                                  Config.blacklist, pi))
-            )
+            page_addr = get_page_addr(pi)
             a_html = await fetch_html(page_addr)
             if not a_html:
                 Log.error(f'Error: cannot get html for page {pi:d}')
@@ -79,19 +167,14 @@ async def process_pages() -> int:
             pi += 1
 
             if maxpage == 0:
-                if pagination := a_html.find('div', class_='pagination'):
-                    for page_ajax in pagination.find_all('a', attrs={'data-action': 'ajax'}):
-                        try:
-                            maxpage = max(maxpage, int(re_paginator.search(str(page_ajax.get('data-parameters'))).group(1)))
-                        except Exception:
-                            pass
+                maxpage = extract_max_page(a_html)
                 if maxpage == 0:
                     Log.info('Could not extract max page, assuming single page search')
                     maxpage = 1
                 else:
                     Log.debug(f'Extracted max page: {maxpage:d}')
 
-            arefs = [a for a in (_.find('a') for _ in a_html.find_all('div', class_=album_ref_class)) if a and SITE in a['href']]
+            arefs = extract_album_refs(a_html)
 
             if Config.get_maxid:
                 max_id = max(int(re_page_entry.search(_['href']).group(1)) for _ in arefs)
@@ -109,7 +192,7 @@ async def process_pages() -> int:
                     if bound_res < 0:
                         lower_count += 1
                     continue
-                elif cur_id in v_entries:
+                elif cur_id in v_ids:
                     Log.warn(f'Warning: id {cur_id:d} already queued, skipping')
                     continue
                 my_title = aref.parent.find('div', class_='thumb_title').text.strip()
@@ -117,6 +200,7 @@ async def process_pages() -> int:
                 my_preview_link = aref.parent.find('img').get('data-original')
                 use_utitle = has_naming_flag(NamingFlags.USE_URL_TITLE)
                 v_entries.append(AlbumInfo(cur_id, my_utitle if use_utitle else my_title, preview_link=my_preview_link))
+                v_ids.add(cur_id)
 
             if pi - 1 > Config.start and 0 < lower_count == orig_count and not Config.scan_all_pages:
                 if not (0 < maxpage <= pi - 1):
@@ -127,28 +211,35 @@ async def process_pages() -> int:
         orig_count = len(v_entries)
 
         if Config.allow_duplicate_names is False:
-            known_names = {}
-            i: int
-            for i in reversed(range(len(v_entries))):
-                title = v_entries[i].title.lower()
+            known_names: dict[str, AlbumInfo] = {}
+            for ai in reversed(v_entries):
+                title = ai.title.lower()
                 if title not in known_names:
-                    known_names[title] = v_entries[i]
+                    known_names[title] = ai
                 else:
-                    Log.debug(f'Removing duplicate of {known_names[title].sname}: {v_entries[i].sname} \'{v_entries[i].title}\'')
-                    del v_entries[i]
-
+                    Log.debug(f'Removing duplicate of {known_names[title].sname}: {ai.sname} \'{ai.title}\'')
+            if len(known_names) < len(v_entries):
+                dedup_count = len(v_entries) - len(known_names)
+                v_entries = [ai for ai in v_entries if known_names[ai.title.lower()] is ai]
+                Log.info(f'[Deduplicate] {dedup_count:d} / {orig_count:d} albums were removed as duplicates!')
+
+        # prefilter is applied after deduplication so the latest album with given title is never replaced by an older one
+        prefiltered_count = len(v_entries)
+        v_entries = [ai for ai in v_entries if not is_prefiltered_out(ai)]
+        prefiltered_count -= len(v_entries)
+
+        # sharding is applied after deduplication so every shard makes the same choice
+        v_entries = filter_shard_albums(v_entries)
         removed_count = orig_count - len(v_entries)
 
         if orig_count == removed_count:
             if orig_count > 0:
-                Log.fatal(f'\nAll {orig_count:d} albums already exist. Aborted.')
+                Log.fatal(f'\nAll {orig_count:d} albums already exist or were filtered out. Aborted.')
             else:
                 Log.fatal('\nNo albums found. Aborted.')
             return -1
-        elif removed_count > 0:
-            Log.info(f'[Deduplicate] {removed_count:d} / {orig_count:d} albums were removed as duplicates!')
-
-        scan_dest_folder()
+        elif prefiltered_count > 0:
+            Log.info(f'[Prefilter] {prefiltered_count:d} / {orig_count:d} albums were filtered out using listing data!')
 
         await download(v_entries, removed_count)
 
@@ -11,10 +11,12 @@ from __future__ import annotations
 import os
 import pathlib
 import sys
+from collections.abc import Iterator
 from typing import BinaryIO
 
+from .async_fs import AsyncFS
 from .config import Config
-from .defs import DEFAULT_EXT, PREFIX
+from .defs import DEFAULT_EXT, PREFIX, IntPair
 from .logger import Log
 from .rex import re_album_foldername, re_media_filename
 from .util import normalize_path
@@ -24,6 +26,8 @@ __all__ = (
     'FileLockError',
     'folder_already_exists',
     'folder_already_exists_arr',
+    'found_album_folders',
+    'get_album_folder_pages_count',
     'scan_dest_folder',
     'try_rename',
 )
@@ -31,6 +35,7 @@ __all__ = (
 _opened_file_nondeletable = sys.platform.startswith('win')
 _found_foldernames_dict: dict[str, list[str]] = {}
 _foldername_matches_cache: dict[str, str] = {}
+_found_album_ids_dict: dict[str, list[tuple[str, str]]] = {}
 
 
 class FileLockError(Exception):
@@ -146,6 +151,8 @@ def scan_dest_folder() -> None:
                  f'{total_files_count - base_folders_count:d} folder(s) in {len(_found_foldernames_dict.keys()) - 1:d} subfolder(s) '
                  f'(total folders: {total_files_count:d}, scan depth: {scan_depth:d})')
 
+    _index_found_folders()
+
     if Config.report_duplicates:
         _report_duplicates()
 
@@ -158,39 +165,47 @@ def _get_foldername_match(fname: str) -> str:
     return _foldername_matches_cache[fname]
 
 
-def _folder_exists_in_folder(base_folder: str, idi: int, check_folder: bool) -> str:
-    orig_folder_names = _found_foldernames_dict.get(base_folder)
-    if (not check_folder or os.path.isdir(base_folder)) and orig_folder_names is not None:
-        for fname in orig_folder_names:
-            f_id = _get_foldername_match(fname)
-            if f_id and str(idi) == f_id:
-                return f'{normalize_path(base_folder)}{fname}'
-    return ''
+def _index_found_folders() -> None:
+    """Builds album id -> [(base_folder, folder_name), ...] index so lookups don't have to walk all found folders"""
+    _found_album_ids_dict.clear()
+    for base_folder, fnames in _found_foldernames_dict.items():
+        for fname in fnames:
+            if f_id := _get_foldername_match(fname):
+                if f_id not in _found_album_ids_dict:
+                    _found_album_ids_dict[f_id] = []
+                _found_album_ids_dict[f_id].append((base_folder, fname))
 
 
-def folder_already_exists(idi: int, check_folder=True) -> str:
-    for fullpath in _found_foldernames_dict:
-        if folderpath := _folder_exists_in_folder(fullpath, idi, check_folder):
-            return folderpath
-    return ''
+def _folders_exist_iter(idi: int, check_folder: bool) -> Iterator[str]:
+    for base_folder, fname in _found_album_ids_dict.get(str(idi), ()):
+        if not check_folder or os.path.isdir(base_folder):
+            yield f'{normalize_path(base_folder)}{fname}'
 
 
-def _folder_exists_in_folder_arr(base_folder: str, idi: int, check_folder: bool) -> list[str]:
-    orig_folder_names = _found_foldernames_dict.get(base_folder)
-    folder_folders: list[str] = []
-    if (not check_folder or os.path.isdir(base_folder)) and orig_folder_names is not None:
-        for fname in orig_folder_names:
-            f_id = _get_foldername_match(fname)
-            if f_id and str(idi) == f_id:
-                folder_folders.append(f'{normalize_path(base_folder)}{fname}')
-    return folder_folders
+def folder_already_exists(idi: int, check_folder=True) -> str:
+    return next(_folders_exist_iter(idi, check_folder), '')
 
 
 def folder_already_exists_arr(idi: int, check_folder=True) -> list[str]:
-    found_folders: list[str] = []
-    for fullpath in _found_foldernames_dict:
-        found_folders.extend(_folder_exists_in_folder_arr(fullpath, idi, check_folder))
-    return found_folders
+    return list(_folders_exist_iter(idi, check_folder))
+
+
+def found_album_folders() -> Iterator[str]:
+    """Yields paths of all found album folders"""
+    for folders in _found_album_ids_dict.values():
+        for base_folder, fname in folders:
+            yield f'{normalize_path(base_folder)}{fname}'
+
+
+def get_album_folder_pages_count(folderpath: str) -> IntPair:
+    """Returns pair of (expected pages count stored in album folder name, actual images count), expected count is 0 if not stored"""
+    f_match = re_album_foldername.fullmatch(os.path.split(folderpath.strip('/'))[1])
+    expected_count = int(f_match.group(2)) if f_match and f_match.group(2) else 0
+    if not expected_count or not os.path.isdir(folderpath):
+        return IntPair(expected_count, 0)
+    with os.scandir(folderpath) as listing:
+        existing_count = sum(1 for de in listing if de.is_file() and re_media_filename.fullmatch(de.name))
+    return IntPair(expected_count, existing_count)
 
 
 async def try_rename(oldpath: str, newpath: str) -> bool:
@@ -198,10 +213,10 @@ async def try_rename(oldpath: str, newpath: str) -> bool:
         return True
 
     try:
-        newpath_folder = os.path.split(newpath.strip('/'))[0]
+        newpath_folder = os.path.split(newpath.rstrip('/'))[0]
         async with FileLock(oldpath):
-            os.makedirs(newpath_folder, exist_ok=True)
-            os.rename(oldpath, newpath)
+            await AsyncFS.makedirs(newpath_folder)
+            await AsyncFS.rename(oldpath, newpath)
         return True
     except Exception:
         return False
@@ -0,0 +1,105 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+from collections.abc import Sequence
+from typing import NamedTuple
+
+from .config import Config
+from .defs import LISTING_PAGE_ALBUMS_COUNT, SEARCH_PUSHDOWN_MIN_GAIN, SEARCH_RULE_ANY
+from .logger import Log
+from .tagger import (
+    ART_POST_COUNTS,
+    CAT_POST_COUNTS,
+    TAG_POST_COUNTS,
+    CompiledExtraTag,
+    compile_extra_tags,
+    get_artist_num,
+    get_category_num,
+    get_tag_num,
+)
+
+__all__ = ('SearchPlan', 'apply_search_plan', 'make_search_plan')
+
+SEARCH_KIND_TAG = 0
+SEARCH_KIND_ART = 1
+SEARCH_KIND_CAT = 2
+
+
+class SearchPlan(NamedTuple):
+    search_tags: str
+    search_arts: str
+    search_cats: str
+    posts: int
+    '''Estimated number of albums listed by search (all ids)'''
+    requests: int
+    '''Estimated number of listing + album page requests'''
+
+    def __str__(self) -> str:
+        return ' '.join(f'{n}={v}' for n, v in zip(('tags', 'arts', 'cats'), self[:3], strict=True) if v)
+
+
+def _search_target(name: str) -> tuple[int, str, int] | None:
+    """Returns (search kind, num, posts count) for known tag / artist / category. Ambiguous names cannot be searched for"""
+    known = [(kind, num, posts) for kind, num, posts in (
+        (SEARCH_KIND_TAG, get_tag_num(name), TAG_POST_COUNTS),
+        (SEARCH_KIND_ART, get_artist_num(name), ART_POST_COUNTS),
+        (SEARCH_KIND_CAT, get_category_num(name), CAT_POST_COUNTS),
+    ) if num]
+    if len(known) != 1 or name not in known[0][2]:
+        return None
+    kind, num, posts = known[0]
+    return kind, num, posts[name]
+
+
+def make_search_plan(extra_tags: Sequence[str], ids_count: int) -> SearchPlan | None:
+    """
+    Looks for the most selective required plain tag / artist / category (or an 'or' group of those of the same kind) and
+    estimates cost of finding albums within id range using website search instead of requesting every album page.
+    Returns None if there is nothing to push down or if it isn't going to be cheaper
+    """
+    if Config.scenario or Config.lookahead or Config.check_title_pos or Config.check_description_pos:
+        # required tags can be matched by something search is unaware of
+        return None
+    best: SearchPlan | None = None
+    for cextag in compile_extra_tags(tuple(extra_tags)).extra_tags:
+        if cextag.kind not in (CompiledExtraTag.KIND_POS, CompiledExtraTag.KIND_OR) or not cextag.is_plain():
+            continue
+        targets = [_search_target(matcher.tag) for matcher in cextag.matchers]
+        if None in targets or len({kind for kind, _, _ in targets}) != 1:
+            continue
+        kind = targets[0][0]
+        # multiple search args of the same type default to 'any' rule which is exactly what 'or' group is
+        nums = ','.join(sorted({num for _, num, _ in targets}))
+        posts = sum(posts for _, _, posts in targets)
+        requests = (posts + LISTING_PAGE_ALBUMS_COUNT - 1) // LISTING_PAGE_ALBUMS_COUNT + min(posts, ids_count)
+        if best is None or requests < best.requests:
+            best = SearchPlan(*(nums if kind == k else '' for k in (SEARCH_KIND_TAG, SEARCH_KIND_ART, SEARCH_KIND_CAT)), posts, requests)
+    if best is None:
+        return None
+    if best.requests * SEARCH_PUSHDOWN_MIN_GAIN > ids_count:
+        Log.debug(f'Search pushdown ({best!s}) rejected: ~{best.requests:d} requests vs {ids_count:d} album pages')
+        return None
+    return best
+
+
+def apply_search_plan(plan: SearchPlan) -> None:
+    """Turns ids range run into pages (search) run restricted by the same id range. Extra tags are kept for local verification"""
+    Config.start_id, Config.end_id = Config.start, Config.end
+    Config.start, Config.end = 1, 10**9
+    Config.id_sequence = range(Config.start_id, Config.end_id + 1)
+    Config.search_tags, Config.search_arts, Config.search_cats = plan.search_tags, plan.search_arts, plan.search_cats
+    Config.search_rule_tag = Config.search_rule_art = Config.search_rule_cat = SEARCH_RULE_ANY
+    Config.search = Config.blacklist = ''
+    Config.scan_all_pages = False
+    Config.seek_pages = True
+    Config.allow_duplicate_names = True
+    Config.skip_existing = False
+
+#
+#
+#########################################
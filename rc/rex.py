@@ -31,6 +31,7 @@ re_uscore_mult = re.compile(r'_{2,}')
 re_not_a_letter = re.compile(r'[^a-z]+')
 re_bracketed_tag = re.compile(r'^([^(]+)\(([^)]+)\).*?$')
 re_numbered_or_counted_tag = re.compile(r'^(?!rule_?\d+)1?([^\d]+?)(?:_?\d+|s)?$')
+re_posts_count = re.compile(r', *(\d+) posts?$')
 re_or_group = re.compile(r'^\([^~]+(?:~[^~]+)+\)$')
 re_neg_and_group = re.compile(r'^-\([^,]+(?:,[^,]+)+\)$')
 
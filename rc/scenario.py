@@ -7,8 +7,9 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 #
 
 from argparse import ZERO_OR_MORE, ArgumentParser
-from collections.abc import Sequence
+from collections.abc import Collection, Sequence, Set
 
+from .config import Config
 from .defs import (
     ACTION_STORE_TRUE,
     DOWNLOAD_POLICY_ALWAYS,
@@ -17,7 +18,7 @@ from .defs import (
 )
 from .iinfo import AlbumInfo
 from .logger import Log
-from .tagger import extract_id_or_group, is_filtered_out_by_extra_tags, valid_extra_tag
+from .tagger import ExtraTagsFilter, compile_extra_tags, extract_id_or_group, valid_extra_tag
 from .validators import valid_int, valid_rating
 
 __all__ = ('DownloadScenario',)
@@ -37,7 +38,7 @@ class SubQueryParams:
         self.minrating: int = minrating or 0
         self.minscore: int | None = minscore
         self.untagged_policy: str = utp or ''
-        self.id_sequence: list[int] = id_sequence or []
+        self.id_sequence: set[int] = set(id_sequence or ())
 
     @property
     def utp(self) -> str:
@@ -56,11 +57,16 @@ class SubQueryParams:
 
 
 class DownloadScenario:
+    """
+    Subqueries list. Each subquery's extra tags are precompiled, subqueries which can't match album's tags by their
+    required / excluded plain tags are skipped without full evaluation
+    """
     def __init__(self, fmt_str: str) -> None:
         assert fmt_str
 
         self.fmt_str: str = fmt_str
         self.queries: list[SubQueryParams] = []
+        self._filters: list[ExtraTagsFilter] = []
 
         parser = ArgumentParser(add_help=False)
         parser.add_argument('-seq', '--use-id-sequence', action=ACTION_STORE_TRUE)
@@ -106,6 +112,7 @@ class DownloadScenario:
             raise ValueError
 
         assert len(self) > 0
+        self._compile()
 
     def __len__(self) -> int:
         return len(self.queries)
@@ -113,12 +120,20 @@ class DownloadScenario:
     def _add_subquery(self, subquery: SubQueryParams) -> None:
         self.queries.append(subquery)
 
+    def _compile(self) -> None:
+        self._filters.extend(compile_extra_tags(tuple(sq.extra_tags)) for sq in self.queries)
+
     def has_subquery(self, **kwargs) -> bool:
         return any(all(getattr(sq, k, ...) == kwargs[k] for k in kwargs) for sq in self.queries)
 
-    def get_matching_subquery(self, ai: AlbumInfo, tags_raw: list[str], score: str, rating: str) -> SubQueryParams | None:
-        for sq in self.queries:
-            if not is_filtered_out_by_extra_tags(ai, tags_raw, sq.extra_tags, sq.id_sequence, sq.subfolder):
+    def get_matching_subquery(self, ai: AlbumInfo, tags_raw: Collection[str], score: str, rating: str) -> SubQueryParams | None:
+        tags_set = tags_raw if isinstance(tags_raw, Set) else set(tags_raw)
+        # required tags may be matched by title / description
+        use_key_tags = not (Config.check_title_pos or Config.check_description_pos)
+        for sq, sq_filter in zip(self.queries, self._filters, strict=True):
+            if not sq_filter.can_pass(tags_set, use_key_tags):
+                continue
+            if not sq_filter.is_filtered_out(ai, tags_raw, sq.id_sequence, sq.subfolder, verbose=False, tags_set=tags_set):
                 sq_skip = False
                 for vsrs, csri, srn, pc in zip((score, rating), (sq.minscore, sq.minrating), ('score', 'rating'), ('', '%'), strict=True):
                     if len(vsrs) > 0 and csri is not None and sq_skip is False:
@@ -0,0 +1,144 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+import os
+import shutil
+import socket
+from collections.abc import Sequence
+
+from .config import Config
+from .defs import PREFIX, UTF8, StrPair
+from .iinfo import AlbumInfo, merge_album_info_lists
+from .logger import Log
+from .util import normalize_path
+
+__all__ = ('claim_album', 'filter_shard_albums', 'filter_shard_ids', 'finish_shard', 'release_album', 'release_claims')
+
+SHARD_DIR_NAME = f'{PREFIX}!shards'
+SHARD_MERGE_LOCK_NAME = f'{PREFIX}!merge.lock'
+
+_claimed_ids: set[int] = set()
+
+
+def _shard_dir() -> str:
+    return normalize_path(f'{Config.dest_base}{SHARD_DIR_NAME}')
+
+
+def _shard_done_path(index: int) -> str:
+    return f'{_shard_dir()}{PREFIX}!shard_{index:d}of{Config.shard.count:d}.done'
+
+
+def filter_shard_albums(sequence: list[AlbumInfo]) -> list[AlbumInfo]:
+    """Returns albums belonging to this shard. Does nothing if not sharded"""
+    if not Config.shard:
+        return sequence
+    own_sequence = [ai for ai in sequence if Config.shard.owns(ai.id)]
+    Log.info(f'[Shard {Config.shard!s}] {len(sequence) - len(own_sequence):d} / {len(sequence):d} albums belong to other shards')
+    return own_sequence
+
+
+def filter_shard_ids(ids: Sequence[int]) -> Sequence[int]:
+    """Returns ids belonging to this shard, range stays a range. Does nothing if not sharded"""
+    if not Config.shard:
+        return ids
+    if isinstance(ids, range) and ids.step == 1:
+        own_ids = range(ids.start + (Config.shard.index - 1 - ids.start) % Config.shard.count, ids.stop, Config.shard.count)
+    else:
+        own_ids = [idi for idi in ids if Config.shard.owns(idi)]
+    Log.info(f'[Shard {Config.shard!s}] {len(ids) - len(own_ids):d} / {len(ids):d} albums belong to other shards')
+    return own_ids
+
+
+def _claim_path(album_id: int) -> str:
+    return f'{_shard_dir()}{PREFIX}{album_id:d}.claim'
+
+
+def _claim_owner(claim_path: str) -> str:
+    try:
+        with open(claim_path, 'rt', encoding=UTF8) as claim_file:
+            return claim_file.readline().split(' ', 1)[0]
+    except OSError:
+        return ''
+
+
+def claim_album(ai: AlbumInfo) -> bool:
+    """Marks album as taken by this shard. Returns False if album was already claimed by another shard"""
+    if not Config.shard or ai.id in _claimed_ids:
+        return True
+    claim_path = _claim_path(ai.id)
+    try:
+        os.makedirs(_shard_dir(), exist_ok=True)
+        # open in exclusive mode (create file), raises FileExistsError if already claimed
+        with open(claim_path, 'xt', encoding=UTF8) as claim_file:
+            claim_file.write(f'{Config.shard!s} {socket.gethostname()} {os.getpid():d}\n')
+        _claimed_ids.add(ai.id)
+        return True
+    except FileExistsError:
+        if _claim_owner(claim_path) != str(Config.shard):
+            return False
+        # left by previous (failed or interrupted) run of this very shard
+        Log.debug(f'[Shard {Config.shard!s}] Taking back own claim of {ai.sname}...')
+        _claimed_ids.add(ai.id)
+        return True
+    except OSError:
+        Log.error(f'Error: unable to create claim file \'{claim_path}\'! Proceeding without claim...')
+        return True
+
+
+def _release_claim(album_id: int) -> None:
+    _claimed_ids.discard(album_id)
+    try:
+        os.remove(_claim_path(album_id))
+    except OSError:
+        pass
+
+
+def release_album(ai: AlbumInfo) -> None:
+    """Removes album claim made by this shard so album can be processed again. Does nothing if album wasn't claimed"""
+    if ai.id in _claimed_ids:
+        _release_claim(ai.id)
+
+
+def release_claims() -> None:
+    """Removes all claims made by this shard"""
+    for album_id in list(_claimed_ids):
+        _release_claim(album_id)
+
+
+def finish_shard(stored_lists: list[StrPair]) -> None:
+    """Marks this shard as done. The last finished shard merges info lists stored by every shard and cleans up claims"""
+    if not Config.shard:
+        return
+    try:
+        os.makedirs(_shard_dir(), exist_ok=True)
+        with open(_shard_done_path(Config.shard.index), 'wt', encoding=UTF8) as done_file:
+            done_file.writelines(f'{subfolder}\t{filename}\n' for subfolder, filename in stored_lists)
+    except OSError:
+        Log.error(f'Error: unable to mark shard {Config.shard!s} as done!')
+        return
+    done_paths = [_shard_done_path(index) for index in range(1, Config.shard.count + 1)]
+    if not all(os.path.isfile(done_path) for done_path in done_paths):
+        Log.info(f'[Shard {Config.shard!s}] Done. Info lists will be merged by the last finished shard')
+        return
+    try:
+        # whoever creates lock file first merges
+        with open(f'{_shard_dir()}{SHARD_MERGE_LOCK_NAME}', 'xb'):
+            pass
+    except OSError:
+        return
+    all_lists: list[StrPair] = []
+    for done_path in done_paths:
+        with open(done_path, 'rt', encoding=UTF8) as done_file:
+            all_lists.extend(StrPair(*line.rstrip('\n').split('\t', 1)) for line in done_file if '\t' in line)
+    Log.info(f'[Shard {Config.shard!s}] All {Config.shard.count:d} shards are done, merging {len(all_lists):d} info lists...')
+    merge_album_info_lists(all_lists)
+    shutil.rmtree(_shard_dir(), ignore_errors=True)
+
+#
+#
+#########################################
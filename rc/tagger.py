@@ -6,12 +6,17 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 #
 #
 
+import functools
 import json
 import os
-from collections.abc import Callable, Collection, Iterable, MutableSequence
+import re
+import sys
+from collections import deque
+from collections.abc import Callable, Collection, Iterable, Iterator, MutableSequence, MutableSet, Sequence, Set
 
 from .config import Config
 from .defs import (
+    BLACKLIST_PUSHDOWN_EXPANSION_MAX,
     FILE_LOC_ARTS,
     FILE_LOC_CATS,
     FILE_LOC_TAG_ALIASES,
@@ -21,6 +26,7 @@ from .defs import (
     SITE,
     TAGS_CONCAT_CHAR,
     UTF8,
+    LoggingFlags,
 )
 from .iinfo import AlbumInfo
 from .logger import Log
@@ -32,6 +38,7 @@ from .rex import (
     re_not_a_letter,
     re_numbered_or_counted_tag,
     re_or_group,
+    re_posts_count,
     re_replace_symbols,
     re_tags_exclude_major1,
     re_tags_exclude_major2,
@@ -43,7 +50,13 @@ from .rex import (
 from .util import assert_nonempty, normalize_path
 
 __all__ = (
+    'ExtraTagsFilter',
+    'TagBag',
+    'TextMatcher',
+    'compile_extra_tags',
+    'extra_tags_to_blacklist',
     'extract_id_or_group',
+    'extract_ids_from_file',
     'extract_ids_from_links',
     'filtered_tags',
     'get_artist_num',
@@ -51,6 +64,7 @@ __all__ = (
     'get_matching_tag',
     'get_tag_num',
     'is_filtered_out_by_extra_tags',
+    'is_filtered_out_by_title',
     'solve_tag_conflicts',
     'valid_artists',
     'valid_blacklist',
@@ -63,9 +77,16 @@ TAG_NUMS: dict[str, str] = {}
 CAT_NUMS: dict[str, str] = {}
 ART_NUMS: dict[str, str] = {}
 # PLA_NUMS: dict[str, str] = {}
+TAG_POST_COUNTS: dict[str, int] = {}
+CAT_POST_COUNTS: dict[str, int] = {}
+ART_POST_COUNTS: dict[str, int] = {}
 TAG_ALIASES: dict[str, str] = {}
 TAG_CONFLICTS: dict[str, tuple[list[str], list[str]]] = {}
 
+# word boundaries used by extra tags converted for text matching, see convert_extra_tag_for_text_matching()
+TEXT_WORD_BOUNDARY_CHARS = frozenset(' ()[]_\'"')
+TEXT_NONLITERAL_CHARS = frozenset('*?|`[]{}^$\\')
+
 
 def valid_extra_tag(tag: str, log=True) -> str:
     try:
@@ -144,7 +165,7 @@ def valid_categories(categories_str: str, *, report=True) -> str:
     return ','.join(sorted(category_ids))
 
 
-def valid_blacklist(blacklist_str: str) -> str:
+def valid_blacklist(blacklist_str: str, *, report=True) -> str:
     bl_act_type_artist = 'model'
     bl_act_type_category = 'cat'
     bl_act_type_tag = 'tag'
@@ -183,12 +204,42 @@ def valid_blacklist(blacklist_str: str) -> str:
             errors.append(f'Invalid blacklist string \'{blacklist_str}\'')
 
         if errors:
-            Log.fatal('\n'.join(errors))
+            if report:
+                Log.fatal('\n'.join(errors))
             raise ValueError
 
     return ','.join(','.join(f'{k}:{v}' for v in sorted(containers[k])) for k in containers if containers[k])
 
 
+def extra_tags_to_blacklist(extra_tags: Sequence[str]) -> str:
+    """Converts negative extra tags which resolve to known tags / artists / categories into native search blacklist string.
+    Wildcards are only converted if they don't expand into too many names. Result never excludes anything local filter doesn't"""
+    if Config.check_votes:
+        # downvoted tags are ignored by local filter
+        return ''
+    blacklist: list[str] = []
+    for cextag in compile_extra_tags(tuple(extra_tags)).extra_tags:
+        name = cextag.tag
+        if cextag.kind != CompiledExtraTag.KIND_NEG or is_utag(name):
+            continue
+        if Config.solve_tag_conflicts:
+            if not TAG_CONFLICTS:
+                load_tag_conflicts()
+            if TagMatcher(name).match(TAG_CONFLICTS, TAG_CONFLICTS):
+                # tag may get removed from album tags by local filter
+                continue
+        if is_wtag(name):
+            expanded_count = sum(len(expand(name)) for expand in (expand_tags, expand_artists, expand_categories))
+            if not 0 < expanded_count <= BLACKLIST_PUSHDOWN_EXPANSION_MAX:
+                Log.debug(f'Negative extra tag \'{name}\' expands into {expanded_count:d} names, not adding to blacklist')
+                continue
+        try:
+            blacklist.append(valid_blacklist(name, report=False))
+        except ValueError:
+            continue
+    return ','.join(dict.fromkeys(bl for bls in blacklist for bl in bls.split(',')))
+
+
 def is_utag(tag: str) -> bool:
     return tag.startswith('u:')
 
@@ -366,10 +417,22 @@ def extract_id_or_group(ex_tags: MutableSequence[str]) -> list[int]:
         orgr = ex_tags[i]
         if is_valid_id_or_group(orgr):
             del ex_tags[i]
-            return list(set(int(tag.replace('id=', '')) for tag in orgr[1:-1].split('~')))
+            return sorted(set(int(tag.replace('id=', '')) for tag in orgr[1:-1].split('~')))
     return []
 
 
+def extract_ids_from_file(filepath: str) -> Iterator[int]:
+    """Streams ids from a file, ids are separated by whitespace or commas and may be written as \'id=<id>\'"""
+    with open(filepath, 'rt', encoding=UTF8) as idfile:
+        for line_num, line in enumerate(idfile, 1):
+            for id_str in line.replace(',', ' ').split():
+                id_str = id_str.removeprefix('id=')
+                if not id_str.isdigit():
+                    Log.fatal(f'\nError: invalid id \'{id_str}\' in \'{filepath}\' at line {line_num:d}!')
+                    raise ValueError
+                yield int(id_str)
+
+
 def extract_ids_from_links(ex_tags: MutableSequence[str]) -> list[int]:
     """May alter the input container!"""
     ids: list[int] = []
@@ -413,7 +476,7 @@ def convert_extra_tag_for_text_matching(ex_tag: str) -> str:
 
 def match_text(ex_tag: str, text: str, group_type='') -> str | list[str] | None:
     converted_tag = convert_extra_tag_for_text_matching(ex_tag)
-    text = text.replace('\n', ' ').strip().lower()
+    text = normalize_text(text)
     if group_type == 'or':
         return get_or_group_matching_tag(converted_tag, [text])
     elif group_type == 'and':
@@ -426,7 +489,52 @@ def trim_undersores(base_str: str) -> str:
     return re_uscore_mult.sub('_', base_str).strip('_')
 
 
-def solve_tag_conflicts(ai: AlbumInfo, tags_raw: list[str]) -> None:
+class TagBag(MutableSet[str]):
+    """
+    Ordered set of album tags (or artists / categories). Tag strings are interned, each tag may carry its id
+    (resolved on insertion if id getter is provided, ids of merged bags are preserved)
+    """
+    __slots__ = ('_tags',)
+
+    def __init__(self, tags: Iterable[str] = (), num_getter: Callable[[str], str | None] | None = None) -> None:
+        self._tags: dict[str, str | None] = {}
+        for tag in tags:
+            self.add(tag, num_getter(tag) if num_getter else None)
+
+    def __contains__(self, tag: object) -> bool:
+        return tag in self._tags
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._tags)
+
+    def __len__(self) -> int:
+        return len(self._tags)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({list(self._tags)!r})'
+
+    def add(self, tag: str, num: str | None = None) -> None:
+        if tag not in self._tags:
+            self._tags[sys.intern(tag)] = num
+
+    def discard(self, tag: str) -> None:
+        self._tags.pop(tag, None)
+
+    def merge(self, other: 'TagBag') -> None:
+        """Adds non-empty tags of other bag along with their ids"""
+        for tag, num in other._tags.items():
+            if tag and tag not in self._tags:
+                self._tags[tag] = num
+
+    def num(self, tag: str) -> str | None:
+        return self._tags.get(tag)
+
+    def nums(self) -> dict[str, str]:
+        """Returns known tag ids mapped to tags"""
+        return {num: tag for tag, num in self._tags.items() if num}
+
+
+def solve_tag_conflicts(ai: AlbumInfo, tags_raw: TagBag) -> None:
     if not TAG_CONFLICTS:
         load_tag_conflicts()
     for ctag, clistpair in TAG_CONFLICTS.items():
@@ -437,71 +545,352 @@ def solve_tag_conflicts(ai: AlbumInfo, tags_raw: list[str]) -> None:
                 tags_raw.remove(ctag)
 
 
-def is_filtered_out_by_extra_tags(ai: AlbumInfo, tags_raw: list[str], extra_tags: list[str],
-                                  id_seq: list[int], subfolder: str, id_seq_ex: list[int] | None = None) -> bool:
-    suc = True
-    sname = f'{f"[{subfolder}] " if subfolder else ""}Album {ai.sname}'
-    if id_seq and ai.id not in id_seq and not (id_seq_ex and ai.id in id_seq_ex):
-        suc = False
-        Log.trace(f'{sname} isn\'t contained in id list \'{id_seq!s}\'. Skipped!')
-
-    for extag in extra_tags:
+class TagMatcher:
+    """
+    Precompiled tag / wildcard tag, matches the same way get_matching_tag() does
+    """
+    __slots__ = ('pattern', 'tag')
+
+    def __init__(self, tag: str, force_regex=False) -> None:
+        self.tag = tag
+        self.pattern = None
+        if is_wtag(tag) or (force_regex and (normalize_wtag(tag) != tag or re.escape(tag) != tag)):
+            # forced regex for a tag without any special symbols is a simple comparison
+            self.pattern = prepare_regex_fullmatch(normalize_wtag(tag))
+
+    def match(self, mtags: Iterable[str], mtags_set: Collection[str]) -> str | None:
+        if self.pattern is None:
+            return self.tag if self.tag in mtags_set else None
+        for htag in mtags:
+            if self.pattern.fullmatch(htag):
+                return htag
+        return None
+
+
+class TextMatcher:
+    """
+    Aho-Corasick automaton over literal phrases. Finds all phrases contained in text as whole words
+    (bounded by text edges or TEXT_WORD_BOUNDARY_CHARS, same as converted extra tags do) in a single pass
+    """
+    __slots__ = ('_fail', '_goto', '_out')
+
+    def __init__(self, phrases: Iterable[str]) -> None:
+        self._goto: list[dict[str, int]] = [{}]
+        self._out: list[list[str]] = [[]]
+        for phrase in dict.fromkeys(phrases):
+            state = 0
+            for c in phrase:
+                if c not in self._goto[state]:
+                    self._goto[state][c] = len(self._goto)
+                    self._goto.append({})
+                    self._out.append([])
+                state = self._goto[state][c]
+            self._out[state].append(phrase)
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail_state = self._fail[state]
+                while fail_state and c not in self._goto[fail_state]:
+                    fail_state = self._fail[fail_state]
+                self._fail[next_state] = self._goto[fail_state].get(c, 0)
+                self._out[next_state].extend(self._out[self._fail[next_state]])
+
+    def find(self, text: str) -> set[str]:
+        hits: set[str] = set()
+        if len(self._goto) == 1:
+            return hits
+        goto, fail, out = self._goto, self._fail, self._out
+        text_len = len(text)
+        state = 0
+        for i, c in enumerate(text):
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            for phrase in out[state]:
+                start = i + 1 - len(phrase)
+                if phrase not in hits and (start == 0 or text[start - 1] in TEXT_WORD_BOUNDARY_CHARS) and (
+                        i + 1 == text_len or text[i + 1] in TEXT_WORD_BOUNDARY_CHARS):
+                    hits.add(phrase)
+        return hits
+
+
+@functools.lru_cache(maxsize=256)
+def compile_text_phrases(phrases: tuple[str, ...]) -> TextMatcher:
+    return TextMatcher(phrases)
+
+
+def is_text_literal(wtag: str) -> bool:
+    """Returns True if tag converted for text matching matches a plain phrase (no wildcards or regex syntax)"""
+    return not any(c in TEXT_NONLITERAL_CHARS for c in wtag)
+
+
+def normalize_text(text: str) -> str:
+    return text.replace('\n', ' ').strip().lower()
+
+
+def _match_text_member(matcher: TagMatcher | str, texts: list[str], phrase_hits: Set[str]) -> str | None:
+    if isinstance(matcher, str):
+        return texts[0] if matcher in phrase_hits else None
+    return matcher.match(texts, texts)
+
+
+class CompiledExtraTag:
+    """
+    Extra tag or group with precompiled tag matchers. Text (title / description) matchers are compiled on first use
+    """
+    KIND_OR = 0
+    KIND_NEG_AND = 1
+    KIND_NEG = 2
+    KIND_POS = 3
+
+    __slots__ = ('_text_matchers', 'extag', 'kind', 'matchers', 'tag')
+
+    def __init__(self, extag: str) -> None:
+        self.extag = extag
+        self._text_matchers: list[TagMatcher | str] | None = None
         if extag.startswith('('):
-            or_match_base = get_or_group_matching_tag(extag, tags_raw)
-            or_match_titl = match_text(extag, ai.title, 'or') if Config.check_title_pos and ai.title else None
-            or_match_desc = match_text(extag, ai.description, 'or') if Config.check_description_pos and ai.description else None
-            if or_match_base:
-                Log.trace(f'{sname} has BASE POS match: \'{or_match_base!s}\'')
-            if or_match_titl:
-                Log.trace(f'{sname} has TITL POS match: \'{or_match_titl!s}\'')
-            if or_match_desc:
-                Log.trace(f'{sname} has DESC POS match: \'{or_match_desc!s}\'')
-            if not bool(or_match_base or or_match_titl or or_match_desc):
-                suc = False
-                Log.trace(f'{sname} misses required tag matching \'{extag}\'. Skipped!')
+            self.kind, self.tag = CompiledExtraTag.KIND_OR, extag
+            self.matchers = [TagMatcher(tag) for tag in extag[1:-1].split('~')]
         elif extag.startswith('-('):
-            neg_matches = get_neg_and_group_matches(extag, tags_raw)
-            for conf, cn, td in zip(
-                (Config.check_title_neg, Config.check_description_neg),
-                ('TITL', 'DESC'),
-                (ai.title, ai.description),
-                strict=True,
-            ):
-                if conf and td:
-                    for tmatch in match_text(extag, td, 'and'):
-                        tmatch_s = tmatch[:100]
-                        Log.trace(f'{sname} has {cn} NEG match: \'{tmatch_s}\'')
-                        if tmatch_s not in neg_matches:
-                            neg_matches.append(f'{tmatch_s}...')
-            if neg_matches:
-                suc = False
-                Log.info(f'{sname} contains excluded tags combination \'{extag}\': {",".join(neg_matches)}. Skipped!')
+            self.kind, self.tag = CompiledExtraTag.KIND_NEG_AND, extag
+            self.matchers = [TagMatcher(wtag, True) for wtag in extag[2:-1].split(',')]
+        elif extag.startswith('-'):
+            self.kind, self.tag = CompiledExtraTag.KIND_NEG, extag[1:]
+            self.matchers = [TagMatcher(self.tag)]
         else:
-            negative = extag.startswith('-')
-            my_extag = extag[1:] if negative else extag
-            mtag = get_matching_tag(my_extag, tags_raw)
-            if negative is False and mtag:
-                Log.trace(f'{sname} has BASE POS match: \'{mtag}\'')
-            for conf, cn, np, td in zip(
-                (Config.check_title_pos, Config.check_title_neg, Config.check_description_pos, Config.check_description_neg),
-                ('TITL', 'TITL', 'DESC', 'DESC'),
-                ('POS', 'NEG', 'POS', 'NEG'),
-                (ai.title, ai.title, ai.description, ai.description),
-                strict=True,
-            ):
-                if conf and td and ((np == 'NEG') == negative) and not mtag:
-                    mtag = match_text(my_extag, td)
-                    if mtag:
-                        mtag = f'{mtag[:100]}...'
-                        if negative is False:
-                            Log.trace(f'{sname} has {cn} {np} match: \'{mtag}\'')
-            if mtag is not None and negative:
-                suc = False
-                Log.info(f'{sname} contains excluded tag \'{mtag}\' (\'{extag}\'). Skipped!')
-            elif mtag is None and not negative:
-                suc = False
-                Log.trace(f'{sname} misses required tag matching \'{my_extag}\'. Skipped!')
-    return not suc
+            self.kind, self.tag = CompiledExtraTag.KIND_POS, extag
+            self.matchers = [TagMatcher(self.tag)]
+
+    @property
+    def text_matchers(self) -> list[TagMatcher | str]:
+        """Text matcher per tag / group member, literal members are represented by their phrase (matched using TextMatcher)"""
+        if self._text_matchers is None:
+            members = (self.tag[1:-1].split('~') if self.kind == CompiledExtraTag.KIND_OR else
+                       self.tag[2:-1].split(',') if self.kind == CompiledExtraTag.KIND_NEG_AND else [self.tag])
+            self._text_matchers = [
+                member.replace('_', ' ') if is_text_literal(member) else
+                TagMatcher(convert_extra_tag_for_text_matching(member), self.kind == CompiledExtraTag.KIND_NEG_AND)
+                for member in members
+            ]
+        return self._text_matchers
+
+    @property
+    def text_phrases(self) -> list[str]:
+        return [matcher for matcher in self.text_matchers if isinstance(matcher, str)]
+
+    def match_any(self, mtags: Iterable[str], mtags_set: Collection[str]) -> str | None:
+        for matcher in self.matchers:
+            if mtag := matcher.match(mtags, mtags_set):
+                return mtag
+        return None
+
+    def match_all(self, mtags: Iterable[str], mtags_set: Collection[str]) -> list[str]:
+        matched_tags: list[str] = []
+        for matcher in self.matchers:
+            if not (mtag := matcher.match(mtags, mtags_set)):
+                return []
+            matched_tags.append(mtag)
+        return matched_tags
+
+    def match_text(self, text: str, phrase_hits: Set[str] | None = None) -> str | list[str] | None:
+        """Same as match_text(extag, text, group_type) with group type deduced from extag.
+        Phrase hits are literal phrases found in text by TextMatcher, searched for if not provided"""
+        texts = [normalize_text(text)]
+        if phrase_hits is None:
+            phrase_hits = compile_text_phrases(tuple(self.text_phrases)).find(texts[0])
+        if self.kind == CompiledExtraTag.KIND_NEG_AND:
+            matched_texts: list[str] = []
+            for matcher in self.text_matchers:
+                if not (mtext := _match_text_member(matcher, texts, phrase_hits)):
+                    return []
+                matched_texts.append(mtext)
+            return matched_texts
+        for matcher in self.text_matchers:
+            if mtext := _match_text_member(matcher, texts, phrase_hits):
+                return mtext
+        return None
+
+    def is_plain(self) -> bool:
+        return all(m.pattern is None for m in self.matchers)
+
+
+class ExtraTagsFilter:
+    """
+    Precompiled extra tags list. Use compile_extra_tags() to obtain (cached)
+    """
+    def __init__(self, extra_tags: Sequence[str]) -> None:
+        self.extra_tags = [CompiledExtraTag(extag) for extag in extra_tags]
+        key_groups = [frozenset(m.tag for m in cextag.matchers) for cextag in self.extra_tags
+                      if cextag.kind in (CompiledExtraTag.KIND_OR, CompiledExtraTag.KIND_POS) and cextag.is_plain()]
+        self.key_tags: frozenset[str] = min(key_groups, key=len, default=frozenset())
+        '''Plain tags one of which must be present in album tags to pass (unless matched by title / description)'''
+        self.neg_tags: frozenset[str] = frozenset(cextag.tag for cextag in self.extra_tags
+                                                  if cextag.kind == CompiledExtraTag.KIND_NEG and cextag.is_plain())
+        '''Plain tags none of which may be present in album tags to pass'''
+        self._text_matcher: TextMatcher | None = None
+
+    def text_hits(self, text: str) -> set[str]:
+        """Returns literal text phrases of all extra tags found in text"""
+        if self._text_matcher is None:
+            self._text_matcher = TextMatcher(phrase for cextag in self.extra_tags for phrase in cextag.text_phrases)
+        return self._text_matcher.find(normalize_text(text))
+
+    def can_pass(self, tags_set: Set[str], use_key_tags: bool) -> bool:
+        """Quick check using plain tags only. False means filter will reject album, True means full check is needed"""
+        return self.neg_tags.isdisjoint(tags_set) and not (use_key_tags and self.key_tags and self.key_tags.isdisjoint(tags_set))
+
+    def is_filtered_out(self, ai: AlbumInfo, tags_raw: Collection[str], id_seq: Collection[int], subfolder: str,
+                        id_seq_ex: Collection[int] | None = None, *, verbose=True, tags_set: Collection[str] | None = None) -> bool:
+        suc = True
+        trace = Log.should_log(LoggingFlags.TRACE)
+        sname = f'{f"[{subfolder}] " if subfolder else ""}Album {ai.sname}' if verbose or trace else ''
+        log_excluded = Log.info if verbose else Log.trace
+        tags_set = tags_set if tags_set is not None else tags_raw if isinstance(tags_raw, Set) else set(tags_raw)
+        text_hits: dict[str, set[str]] = {}
+
+        def match_text_cached(cextag_: CompiledExtraTag, text: str) -> str | list[str] | None:
+            if text not in text_hits:
+                text_hits[text] = self.text_hits(text)
+            return cextag_.match_text(text, text_hits[text])
+
+        if id_seq and ai.id not in id_seq and not (id_seq_ex and ai.id in id_seq_ex):
+            suc = False
+            if trace:
+                Log.trace(f'{sname} isn\'t contained in id list \'{id_seq!s}\'. Skipped!')
+
+        for cextag in self.extra_tags:
+            extag = cextag.extag
+            if cextag.kind == CompiledExtraTag.KIND_OR:
+                or_match_base = cextag.match_any(tags_raw, tags_set)
+                or_match_titl = match_text_cached(cextag, ai.title) if Config.check_title_pos and ai.title else None
+                or_match_desc = match_text_cached(cextag, ai.description) if Config.check_description_pos and ai.description else None
+                if trace and or_match_base:
+                    Log.trace(f'{sname} has BASE POS match: \'{or_match_base!s}\'')
+                if trace and or_match_titl:
+                    Log.trace(f'{sname} has TITL POS match: \'{or_match_titl!s}\'')
+                if trace and or_match_desc:
+                    Log.trace(f'{sname} has DESC POS match: \'{or_match_desc!s}\'')
+                if not bool(or_match_base or or_match_titl or or_match_desc):
+                    suc = False
+                    if trace:
+                        Log.trace(f'{sname} misses required tag matching \'{extag}\'. Skipped!')
+            elif cextag.kind == CompiledExtraTag.KIND_NEG_AND:
+                neg_matches = cextag.match_all(tags_raw, tags_set)
+                for conf, cn, td in zip(
+                    (Config.check_title_neg, Config.check_description_neg),
+                    ('TITL', 'DESC'),
+                    (ai.title, ai.description),
+                    strict=True,
+                ):
+                    if conf and td:
+                        for tmatch in match_text_cached(cextag, td):
+                            tmatch_s = tmatch[:100]
+                            if trace:
+                                Log.trace(f'{sname} has {cn} NEG match: \'{tmatch_s}\'')
+                            if tmatch_s not in neg_matches:
+                                neg_matches.append(f'{tmatch_s}...')
+                if neg_matches:
+                    suc = False
+                    if verbose or trace:
+                        log_excluded(f'{sname} contains excluded tags combination \'{extag}\': {",".join(neg_matches)}. Skipped!')
+            else:
+                negative = cextag.kind == CompiledExtraTag.KIND_NEG
+                my_extag = cextag.tag
+                mtag = cextag.match_any(tags_raw, tags_set)
+                if trace and negative is False and mtag:
+                    Log.trace(f'{sname} has BASE POS match: \'{mtag}\'')
+                for conf, cn, np, td in zip(
+                    (Config.check_title_pos, Config.check_title_neg, Config.check_description_pos, Config.check_description_neg),
+                    ('TITL', 'TITL', 'DESC', 'DESC'),
+                    ('POS', 'NEG', 'POS', 'NEG'),
+                    (ai.title, ai.title, ai.description, ai.description),
+                    strict=True,
+                ):
+                    if conf and td and ((np == 'NEG') == negative) and not mtag:
+                        mtag = match_text_cached(cextag, td)
+                        if mtag:
+                            mtag = f'{mtag[:100]}...'
+                            if trace and negative is False:
+                                Log.trace(f'{sname} has {cn} {np} match: \'{mtag}\'')
+                if mtag is not None and negative:
+                    suc = False
+                    if verbose or trace:
+                        log_excluded(f'{sname} contains excluded tag \'{mtag}\' (\'{extag}\'). Skipped!')
+                elif mtag is None and not negative:
+                    suc = False
+                    if trace:
+                        Log.trace(f'{sname} misses required tag matching \'{my_extag}\'. Skipped!')
+        return not suc
+
+
+@functools.lru_cache(maxsize=256)
+def compile_extra_tags(extra_tags: tuple[str, ...]) -> ExtraTagsFilter:
+    return ExtraTagsFilter(extra_tags)
+
+
+def is_filtered_out_by_extra_tags(ai: AlbumInfo, tags_raw: Collection[str], extra_tags: list[str],
+                                  id_seq: list[int], subfolder: str, id_seq_ex: list[int] | None = None) -> bool:
+    return compile_extra_tags(tuple(extra_tags)).is_filtered_out(ai, tags_raw, id_seq, subfolder, id_seq_ex)
+
+
+def is_filtered_out_by_title(ai: AlbumInfo, extra_tags: list[str]) -> bool:
+    """Title-only subset of is_filtered_out_by_extra_tags() - negative extra tags which can be matched before album page is fetched"""
+    if not Config.check_title_neg or not ai.title:
+        return False
+    sname = f'Album {ai.sname}'
+    extra_tags_filter = compile_extra_tags(tuple(extra_tags))
+    phrase_hits = extra_tags_filter.text_hits(ai.title)
+    for cextag in extra_tags_filter.extra_tags:
+        extag = cextag.extag
+        if cextag.kind == CompiledExtraTag.KIND_NEG_AND:
+            if tmatches := cextag.match_text(ai.title, phrase_hits):
+                Log.info(f'{sname} title contains excluded tags combination \'{extag}\': {",".join(_[:100] for _ in tmatches)}. Skipped!')
+                return True
+        elif cextag.kind == CompiledExtraTag.KIND_NEG:
+            if tmatch := cextag.match_text(ai.title, phrase_hits):
+                Log.info(f'{sname} title contains excluded tag \'{tmatch[:100]}...\' (\'{extag}\'). Skipped!')
+                return True
+    return False
+
+
+@functools.lru_cache(maxsize=16384)
+def _naming_tag(tag: str) -> tuple[str, str, bool] | None:
+    """Normalizes raw tag for naming. Returns (tag, letters key, is bracketed) or None if tag is to be skipped"""
+    tag = re_replace_symbols.sub('_', tag.replace('-', '').replace('\'', '').replace('.', ''))
+    alias = TAG_ALIASES.get(tag)
+    if alias is None and re_tags_to_process.match(tag) is None:
+        return None
+
+    tag = alias or tag
+
+    # digital_media_(artwork)
+    aser_match = re_bracketed_tag.match(tag)
+    if aser_match:
+        major_skip_match1 = re_tags_exclude_major1.match(aser_match.group(1))
+        major_skip_match2 = re_tags_exclude_major2.match(aser_match.group(2))
+        if major_skip_match1 or major_skip_match2:
+            return None
+        tag = trim_undersores(aser_match.group(1))
+        if len(tag) >= 17:
+            return None
+    elif alias is None and re_tags_to_not_exclude.match(tag) is None:
+        return None
+
+    tag = trim_undersores(tag)
+    return tag, _naming_tag_key(tag), bool(aser_match)
+
+
+@functools.lru_cache(maxsize=16384)
+def _naming_tag_key(tag: str) -> str:
+    return re_not_a_letter.sub('', re_numbered_or_counted_tag.sub(r'\1', tag))
+
+
+@functools.lru_cache(maxsize=4096)
+def _naming_tag_capitalized(tag: str) -> str:
+    return ''.join(c.upper() if (i == 0 or tag[i - 1] == '_') and c.isalpha() else c for i, c in enumerate(tag))
 
 
 def filtered_tags(tags_list: Collection[str]) -> str:
@@ -512,69 +901,50 @@ def filtered_tags(tags_list: Collection[str]) -> str:
         load_tag_aliases()
 
     tags_list_final: list[str] = []
+    # letters-only keys of accepted tags, joined with a separator which never appears in a key - one substring search per tag
+    keys_final: list[str] = []
+    keys_joined = ''
 
-    for tag in tags_list:
-        tag = re_replace_symbols.sub('_', tag.replace('-', '').replace('\'', '').replace('.', ''))
-        alias = TAG_ALIASES.get(tag)
-        if alias is None and re_tags_to_process.match(tag) is None:
-            continue
-
-        tag = alias or tag
-
-        # digital_media_(artwork)
-        aser_match = re_bracketed_tag.match(tag)
-        aser_valid = bool(aser_match)
-        if aser_match:
-            major_skip_match1 = re_tags_exclude_major1.match(aser_match.group(1))
-            major_skip_match2 = re_tags_exclude_major2.match(aser_match.group(2))
-            if major_skip_match1 or major_skip_match2:
-                continue
-            tag = trim_undersores(aser_match.group(1))
-            if len(tag) >= 17:
-                continue
-        elif alias is None and re_tags_to_not_exclude.match(tag) is None:
+    for tag_raw in tags_list:
+        naming_tag = _naming_tag(tag_raw)
+        if naming_tag is None:
             continue
+        tag, nutag, aser_valid = naming_tag
 
-        tag = trim_undersores(tag)
-
-        do_add = True
-        if len(tags_list_final) > 0:
-            nutag = re_not_a_letter.sub('', re_numbered_or_counted_tag.sub(r'\1', tag))
+        if tags_list_final:
             # try and see
             # 1) if this tag can be consumed by existing tags
             # 2) if this tag can consume existing tags
-            for i in reversed(range(len(tags_list_final))):
-                t = re_numbered_or_counted_tag.sub(r'\1', tags_list_final[i].lower())
-                nut = re_not_a_letter.sub('', t)
-                if len(nut) >= len(nutag) and (nutag in nut):
-                    do_add = False
-                    break
-            if do_add:
-                for i in reversed(range(len(tags_list_final))):
-                    t = re_numbered_or_counted_tag.sub(r'\1', tags_list_final[i].lower())
-                    nut = re_not_a_letter.sub('', t)
-                    if len(nutag) >= len(nut) and (nut in nutag):
-                        if aser_valid is False and tags_list_final[i][0].isupper():
-                            aser_valid = True
-                        del tags_list_final[i]
-        if do_add:
-            if aser_valid:
-                i: int
-                c: str
-                for i, c in enumerate(tag):
-                    if (i == 0 or tag[i - 1] == '_') and c.isalpha():
-                        tag = f'{tag[:i]}{c.upper()}{tag[i + 1:]}'
-            tags_list_final.append(tag)
+            if nutag in keys_joined:
+                continue
+            consumed = [i for i, nut in enumerate(keys_final) if nut in nutag]
+            if consumed:
+                for i in reversed(consumed):
+                    if aser_valid is False and tags_list_final[i][0].isupper():
+                        aser_valid = True
+                    del tags_list_final[i]
+                    del keys_final[i]
+                keys_joined = '\n'.join(keys_final)
+        if aser_valid:
+            tag = _naming_tag_capitalized(tag)
+        tags_list_final.append(tag)
+        nut_final = _naming_tag_key(tag.lower()) if tag != tag.lower() else nutag
+        keys_final.append(nut_final)
+        keys_joined = f'{keys_joined}\n{nut_final}' if len(keys_final) > 1 else nut_final
 
     return trim_undersores(TAGS_CONCAT_CHAR.join(sorted(tags_list_final)))
 
 
-def load_actpac_json(src_file: str, dest_dict: dict[str, str] | dict[str, tuple[list[str], list[str]]], name: str, *, extract=True) -> None:
+def load_actpac_json(src_file: str, dest_dict: dict[str, str] | dict[str, tuple[list[str], list[str]]], name: str, *, extract=True,
+                     post_counts: dict[str, int] | None = None) -> None:
     try:
         Log.trace(f'Loading {name}...')
         with open(src_file, 'r', encoding=UTF8) as json_file:
             if extract:
-                dest_dict.update({k: (v[:v.find(',')] if ',' in v else v) for k, v in json.load(json_file).items()})
+                items: dict[str, str] = json.load(json_file)
+                dest_dict.update({k: (v[:v.find(',')] if ',' in v else v) for k, v in items.items()})
+                if post_counts is not None:
+                    post_counts.update({k: int(pc.group(1)) for k, v in items.items() if (pc := re_posts_count.search(v))})
             else:
                 dest_dict.update(json.load(json_file))
     except Exception:
@@ -583,15 +953,15 @@ def load_actpac_json(src_file: str, dest_dict: dict[str, str] | dict[str, tuple[
 
 
 def load_tag_nums() -> None:
-    load_actpac_json(FILE_LOC_TAGS, TAG_NUMS, 'tag nums')
+    load_actpac_json(FILE_LOC_TAGS, TAG_NUMS, 'tag nums', post_counts=TAG_POST_COUNTS)
 
 
 def load_artist_nums() -> None:
-    load_actpac_json(FILE_LOC_ARTS, ART_NUMS, 'artist nums')
+    load_actpac_json(FILE_LOC_ARTS, ART_NUMS, 'artist nums', post_counts=ART_POST_COUNTS)
 
 
 def load_category_nums() -> None:
-    load_actpac_json(FILE_LOC_CATS, CAT_NUMS, 'category nums')
+    load_actpac_json(FILE_LOC_CATS, CAT_NUMS, 'category nums', post_counts=CAT_POST_COUNTS)
 
 
 # def load_playlist_nums() -> None:
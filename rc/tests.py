@@ -8,31 +8,83 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 
 import asyncio
 import functools
+import json
+import os
 import pathlib
+import re
+import sqlite3
 import sys
+from argparse import ArgumentError
 from collections.abc import Callable
+from contextlib import closing
 from io import StringIO
 from tempfile import TemporaryDirectory
 from unittest import TestCase
 from unittest.mock import patch
 
+from bs4 import BeautifulSoup
+
+from .albumexport import AlbumExporter
+from .albumpage import AlbumPage
+from .async_fs import AsyncFS
+from .benchmark import run_benchmark
 from .cmdargs import prepare_arglist
 from .config import Config
-from .defs import DOWNLOAD_MODE_TOUCH, PREFIX, SEARCH_RULE_DEFAULT, SITE
+from .defs import (
+    DOWNLOAD_MODE_TOUCH,
+    IDGAP_CONFIDENCE_DEFAULT,
+    IDGAP_PREDICTION_AUTO,
+    IDGAP_VERIFY_INTERVAL,
+    PREFIX,
+    SEARCH_RULE_DEFAULT,
+    SITE,
+    SITE_AJAX_REQUEST_ALBUM,
+    UTF8,
+    DownloadResult,
+    LoggingFlags,
+    Mem,
+    Shard,
+)
+from .download import check_existing_image, check_existing_images
 from .downloader import AlbumDownloadWorker, ImageDownloadWorker
 from .fetch_html import RequestQueue
+from .idgaps import IdGapModel, IdGapsPredictor
+from .ids import process_ids
+from .iinfo import AIState, AlbumIdSequence, AlbumInfo, AlbumInfoJournal, IIFlags, IIState, ImageInfo, export_album_info, get_min_max_ids
+from .imgindex import ImageIndex
 from .logger import Log
 from .main import main_sync
-from .path_util import FileLock, FileLockError, _found_foldernames_dict
+from .metrics import Metrics, endpoint_of
+from .pages import process_pages
+from .path_util import (
+    FileLock,
+    FileLockError,
+    _found_album_ids_dict,
+    _found_foldernames_dict,
+    folder_already_exists,
+    get_album_folder_pages_count,
+    scan_dest_folder,
+)
+from .planner import apply_search_plan, make_search_plan
 from .rex import prepare_regex_fullmatch
+from .scenario import DownloadScenario
+from .shard import _claimed_ids, claim_album, filter_shard_albums, filter_shard_ids, finish_shard, release_claims
 from .tagger import (
     ART_NUMS,
     CAT_NUMS,
     TAG_ALIASES,
     TAG_CONFLICTS,
     TAG_NUMS,
+    CompiledExtraTag,
+    TagBag,
+    TextMatcher,
+    extra_tags_to_blacklist,
     extract_id_or_group,
+    extract_ids_from_file,
     extract_ids_from_links,
+    get_category_num,
+    get_tag_num,
+    is_filtered_out_by_title,
     load_artist_nums,
     load_category_nums,
     load_tag_aliases,
@@ -40,7 +92,10 @@ from .tagger import (
     load_tag_nums,
     match_text,
     normalize_wtag,
+    valid_blacklist,
 )
+from .util import normalize_path
+from .validators import valid_shard
 from .version import APP_NAME, APP_VERSION
 
 RUN_CONN_TESTS = 0
@@ -53,10 +108,19 @@ def test_prepare(log=False) -> Callable[[], Callable[[], None]]:
             def set_up_test() -> None:
                 AlbumDownloadWorker._instance = None
                 ImageDownloadWorker._instance = None
+                IdGapsPredictor._instance = None
                 _found_foldernames_dict.clear()
+                _found_album_ids_dict.clear()
                 Log._disabled = not log and not RUN_CONN_TESTS
                 Config._reset()
                 RequestQueue._reset()
+                Metrics._reset()
+                _claimed_ids.clear()
+                ImageIndex._reset()
+                IdGapModel._reset()
+                AsyncFS._reset()
+                AlbumInfoJournal.close(False)
+                AlbumExporter.close()
             set_up_test()
             test_func(*args, **kwargs)
         return invoke_test
@@ -120,6 +184,55 @@ class FileLockTests(TestCase):
                 self.assertRaises(FileLockError, lambda: asyncio.run(test_inner()))
 
 
+class AsyncFSTests(TestCase):
+    @test_prepare()
+    def test_asyncfs01_known_dirs(self) -> None:
+        async def test_inner() -> None:
+            base = normalize_path(tempdir)
+            await AsyncFS.makedirs(f'{base}a/b')
+            with patch('os.path.isdir', side_effect=AssertionError):  # cached
+                self.assertTrue(await AsyncFS.isdir(f'{base}a/b/'))
+            with open(f'{base}a/b/{PREFIX}1.jpg', 'wb') as imgf:
+                imgf.write(b'image')
+            self.assertEqual([f'{PREFIX}1.jpg'], await AsyncFS.listdir_files(f'{base}a/b'))
+            self.assertEqual(5, await AsyncFS.getsize(f'{base}a/b/{PREFIX}1.jpg'))
+            self.assertEqual(0, await AsyncFS.getsize(f'{base}a/b/{PREFIX}2.jpg'))
+            await AsyncFS.rename(f'{base}a', f'{base}c')
+            self.assertFalse(await AsyncFS.isdir(f'{base}a/b'))
+            self.assertTrue(await AsyncFS.isfile(f'{base}c/b/{PREFIX}1.jpg'))
+
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            asyncio.run(test_inner())
+        print(f'{self._testMethodName} passed')
+
+
+class FolderIndexTests(TestCase):
+    @test_prepare()
+    def test_folder_index01(self) -> None:
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            Config.dest_base = f'{pathlib.Path(tempdir).as_posix()}/'
+            Config.folder_scan_depth = 1
+            for fname in (f'{PREFIX}1337_(+5)_[2]_title', f'{PREFIX}1338_x', 'misc'):
+                pathlib.Path(tempdir).joinpath(fname).mkdir()
+            scan_dest_folder()
+            self.assertEqual(f'{Config.dest_base}{PREFIX}1337_(+5)_[2]_title', folder_already_exists(1337))
+            self.assertEqual(f'{Config.dest_base}{PREFIX}1338_x', folder_already_exists(1338))
+            self.assertEqual('', folder_already_exists(1339))
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_folder_index02_pages_count(self) -> None:
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            album_folder = pathlib.Path(tempdir).joinpath(f'{PREFIX}1337_(+5)_[2]_title')
+            album_folder.mkdir()
+            self.assertEqual((2, 0), get_album_folder_pages_count(album_folder.as_posix()))
+            for fname in (f'{PREFIX}11.jpg', f'{PREFIX}12.jpg', f'{PREFIX}!1337_preview.jpg'):
+                album_folder.joinpath(fname).touch()
+            self.assertEqual((2, 2), get_album_folder_pages_count(album_folder.as_posix()))
+            self.assertEqual((0, 0), get_album_folder_pages_count(pathlib.Path(tempdir).joinpath(f'{PREFIX}1338_x').as_posix()))
+        print(f'{self._testMethodName} passed')
+
+
 class CmdTests(TestCase):
     @test_prepare()
     def test_config_integrity(self):
@@ -214,6 +327,37 @@ class CmdTests(TestCase):
         # self.assertEqual('720p', Config.quality)
         print(f'{self._testMethodName} passed')
 
+    @test_prepare()
+    def test_cmd_pages05(self):
+        prepare_arglist(['pages', '-start', '1', '-pages', '3', '--skip-existing', '--check-title-neg', '-2d', '-(3d,elf)'])
+        self.assertTrue(Config.skip_existing)
+        self.assertFalse(Config.allow_duplicate_names)
+        self.assertTrue(is_filtered_out_by_title(AlbumInfo(1, 'Sketches 2D'), Config.extra_tags))
+        self.assertTrue(is_filtered_out_by_title(AlbumInfo(2, 'Elf in 3d space'), Config.extra_tags))
+        self.assertFalse(is_filtered_out_by_title(AlbumInfo(3, '3d render'), Config.extra_tags))
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_cmd_pages06_dedup_before_prefilter(self):
+        async def fetch_listing(*_, **__) -> BeautifulSoup:
+            return BeautifulSoup(''.join(
+                f'<div class="item thumb"><a href="{SITE}/comics/{album_id:d}/album-{album_id:d}/"><img data-original=""/></a>'
+                f'<div class="thumb_title">{title}</div></div>' for album_id, title in ((3, 'Same'), (2, 'Same'), (1, 'Other'))
+            ), 'html.parser')
+
+        async def download_stub(sequence: list[AlbumInfo], _: int) -> None:
+            queued.extend(ai.id for ai in sequence)
+
+        queued: list[int] = []
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            os.makedirs(f'{tempdir}/{PREFIX}3_same')
+            prepare_arglist(['pages', '-path', tempdir, '-start', '1', '-pages', '1', '--skip-existing'])
+            with patch('rc.pages.fetch_html', fetch_listing), patch('rc.pages.download', download_stub):
+                self.assertEqual(0, asyncio.run(process_pages()))
+        # latest 'Same' exists locally, older one must not replace it
+        self.assertEqual([1], queued)
+        print(f'{self._testMethodName} passed')
+
     @test_prepare()
     def test_cmd_ids01(self):
         prepare_arglist(['ids', '-seq', '(id=23~id=982)'])
@@ -253,6 +397,50 @@ class CmdTests(TestCase):
         self.assertEqual(1, len(Config.id_sequence))
         print(f'{self._testMethodName} passed')
 
+    @test_prepare()
+    def test_cmd_ids04(self):
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            idfile_path = f'{normalize_path(tempdir)}ids.txt'
+            with open(idfile_path, 'wt', encoding=UTF8) as idfile:
+                idfile.write('23 id=982,\n  5,5\n')
+            prepare_arglist(['ids', '-idfile', idfile_path, '-dmode', 'touch'])
+            self.assertEqual(idfile_path, Config.use_id_file)
+            self.assertListEqual([23, 982, 5, 5], list(extract_ids_from_file(Config.use_id_file)))
+            with open(idfile_path, 'at', encoding=UTF8) as idfile:
+                idfile.write('id=12a\n')
+            self.assertRaises(ValueError, list, extract_ids_from_file(Config.use_id_file))
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_cmd_ids05_search_plan(self):
+        prepare_arglist(['ids', '-start', '1001', '-end', '3000', '-dmode', 'touch', 'orc', '(elf~pregnant)', '-3d'])
+        self.assertFalse(Config.no_search_pushdown)
+        plan = make_search_plan(Config.extra_tags, 2000)
+        self.assertIsNotNone(plan)
+        self.assertEqual((get_tag_num('orc'), '', ''), plan[:3])
+        self.assertEqual(401, plan.posts)
+        self.assertIsNone(make_search_plan(Config.extra_tags, 500))
+        self.assertIsNone(make_search_plan(['2d'], 10**5))  # both tag and category
+        self.assertEqual(','.join(sorted((get_tag_num('elf'), get_tag_num('pregnant')))), make_search_plan(['(elf~pregnant)'], 10**5).search_tags)
+        apply_search_plan(plan)
+        self.assertEqual((1001, 3000), (Config.start_id, Config.end_id))
+        self.assertEqual(get_tag_num('orc'), Config.search_tags)
+        Config.check_title_pos = True
+        self.assertIsNone(make_search_plan(Config.extra_tags, 2000))
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_cmd_pages07_blacklist_pushdown(self):
+        prepare_arglist(['pages', '-start', '1', '-pages', '1', '-orc', '-2d', '-big_*', '-monster_gir*', '-u:someone', '-(elf,3d)'])
+        self.assertEqual(f'tag:{get_tag_num("orc")},cat:{get_category_num("2d")},tag:{get_tag_num("2d")},'
+                         f'{valid_blacklist("monster_gir*")}', extra_tags_to_blacklist(Config.extra_tags))
+        Config.solve_tag_conflicts = True
+        load_tag_conflicts()
+        self.assertEqual('', extra_tags_to_blacklist([f'-{next(iter(TAG_CONFLICTS))}']))
+        Config.check_votes = True
+        self.assertEqual('', extra_tags_to_blacklist(Config.extra_tags))
+        print(f'{self._testMethodName} passed')
+
     @test_prepare()
     def test_cmd_wtags01(self):
         prepare_arglist(['pages', '-start', '1', '-pages', '5',
@@ -278,6 +466,652 @@ class CmdTests(TestCase):
         print(f'{self._testMethodName} passed')
 
 
+class BenchmarkTests(TestCase):
+    @test_prepare()
+    def test_benchmark_ids(self):
+        results = run_benchmark(['-albums', '3', '-images', '2-2', '-size', '4', '-missing_rate', '0', '--', '-log', 'error'])
+        self.assertEqual(0, results['exit_code'])
+        self.assertEqual(3, results['albums'])
+        self.assertEqual(6, results['images'])
+        self.assertEqual(6 * 4 * Mem.KB, results['bytes'])
+        self.assertEqual(3, results['server']['album_pages'])
+        self.assertTrue(SITE_AJAX_REQUEST_ALBUM.startswith(SITE))
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_benchmark_metrics(self):
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            metrics_path = f'{tempdir}/metrics.json'
+            results = run_benchmark(['-albums', '2', '-images', '1-1', '-size', '1', '--', '-log', 'error', '-metrics_file', metrics_path])
+            self.assertEqual(0, results['exit_code'])
+            with open(metrics_path, 'rt', encoding=UTF8) as metrics_file:
+                metrics = json.load(metrics_file)
+        self.assertEqual(2, metrics['counters']['albums_total']['success'])
+        self.assertEqual(2, metrics['counters']['images_total']['success'])
+        self.assertEqual(2 * Mem.KB, metrics['counters']['received_bytes_total']['image'])
+        self.assertEqual(2, metrics['histograms']['request_seconds']['comic']['count'])
+        self.assertEqual(2, metrics['histograms']['parse_seconds']['html']['count'])
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_benchmark_watch(self):
+        results = run_benchmark(['-mode', 'watch', '-albums', '3', '-images', '1-1', '-size', '1', '-missing_rate', '0',
+                                 '--', '-log', 'error', '-polls', '2', '-delay', '0-0'])
+        self.assertEqual(0, results['exit_code'])
+        self.assertEqual(3, results['albums'])
+        self.assertEqual(2, results['server']['listing_pages'])
+        self.assertEqual(3, results['server']['album_pages'])
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_benchmark_watch_retry(self):
+        with patch('rc.watch.finish_shard') as watch_finish_shard, patch('rc.download.finish_shard') as download_finish_shard:
+            results = run_benchmark(['-mode', 'watch', '-albums', '10', '-images', '1-1', '-size', '1', '-missing_rate', '30',
+                                     '--', '-log', 'error', '-polls', '3', '-delay', '0-0'])
+        self.assertEqual(0, results['exit_code'])
+        # not found ids are requested again during every next poll
+        self.assertLess(0, results['server']['missing_404'])
+        self.assertEqual(0, results['server']['missing_404'] % 3)
+        self.assertEqual(results['albums'] + results['server']['missing_404'], results['server']['album_pages'])
+        watch_finish_shard.assert_called_once()
+        download_finish_shard.assert_not_called()
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_benchmark_cpu_workers(self):
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            metrics_path = f'{tempdir}/metrics.json'
+            results = run_benchmark(['-albums', '4', '-images', '1-2', '-size', '1', '-missing_rate', '0', '--', '-log', 'error',
+                                     '-cpu_workers', '2', '-metrics_file', metrics_path])
+            self.assertEqual(0, results['exit_code'])
+            with open(metrics_path, 'rt', encoding=UTF8) as metrics_file:
+                metrics = json.load(metrics_file)
+        self.assertEqual(4, results['albums'])
+        self.assertEqual(results['server']['images'], results['images'])
+        self.assertEqual(4, metrics['histograms']['parse_seconds']['html']['count'])  # observed by worker processes
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_benchmark_dedup(self):
+        results = run_benchmark(['-albums', '3', '-images', '2-2', '-size', '4', '-missing_rate', '0', '--', '-log', 'error', '-dedup'])
+        self.assertEqual(0, results['exit_code'])
+        self.assertEqual(6, results['images'])
+        self.assertEqual(6 * 4 * Mem.KB, results['bytes'])
+        self.assertEqual(4 * Mem.KB, results['disk_bytes'])  # synthetic images are all the same
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_benchmark_continue(self):
+        results = run_benchmark(['-albums', '3', '-images', '2-2', '-size', '4', '-missing_rate', '0', '-runs', '2', '--', '-log', 'error',
+                                 '-continue'])
+        self.assertEqual(0, results['exit_code'])
+        self.assertEqual(6, results['images'])
+        self.assertEqual(6, results['server']['images'])  # second run: complete images are known from images index
+        self.assertEqual(0, results['server']['image_heads'])
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_benchmark_page_seek(self):
+        results = run_benchmark(['-mode', 'pages', '-albums', '2000', '-images', '1-1', '-size', '1', '-missing_rate', '0', '--', '-log', 'error',
+                                 '-begin_id', '520', '-stop_id', '501', '-pseek'])
+        self.assertEqual(0, results['exit_code'])
+        self.assertEqual(20, results['albums'])
+        self.assertGreater(12, results['server']['listing_pages'])  # 76 without seek
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_benchmark_lookahead_probe(self):
+        results = run_benchmark(['-albums', '40', '-images', '1-1', '-size', '1', '-missing_rate', '0', '--', '-log', 'error',
+                                 '-count', '10', '-lookahead', '100', '-lprobe'])
+        self.assertEqual(0, results['exit_code'])
+        self.assertEqual(40, results['albums'])
+        self.assertGreater(40 + 20, results['server']['album_pages'])  # 40 + 100 without probing
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_benchmark_album_export(self):
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            export_path = f'{normalize_path(tempdir)}albums.jsonl'
+            results = run_benchmark(['-albums', '3', '-images', '1-1', '-size', '4', '-missing_rate', '0', '--', '-log', 'error',
+                                     '-export', export_path])
+            self.assertEqual(0, results['exit_code'])
+            with open(export_path, 'rt', encoding=UTF8) as export_file:
+                records = [json.loads(line) for line in export_file]
+            self.assertEqual(3, len(records))
+            self.assertTrue(all(record['result'] == 'success' and record['pages'] == 1 for record in records))
+        print(f'{self._testMethodName} passed')
+
+
+class AlbumExportTests(TestCase):
+    @test_prepare()
+    def test_albumexport01_sqlite(self):
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            Config.album_export = f'{normalize_path(tempdir)}albums.db'
+            page = AlbumPage()
+            page.tags_raw, page.arts_raw, page.expected_pages_count = TagBag(['orc', 'elf']), TagBag(['artist1']), 5
+            AlbumExporter.open()
+            for result in (DownloadResult.FAIL_SKIPPED, DownloadResult.SUCCESS):  # replaced
+                ai = AlbumInfo(7, 'Title')
+                AlbumExporter.stage(ai, page)
+                AlbumExporter.commit(ai, result)
+            AlbumExporter.commit(AlbumInfo(8), DownloadResult.SUCCESS)  # not staged
+            AlbumExporter.close()
+            with closing(sqlite3.connect(Config.album_export)) as db:
+                rows = db.execute('SELECT id, title, result, pages, tags, artists FROM albums').fetchall()
+            self.assertEqual([(7, 'Title', 'success', 5, '["elf", "orc"]', '["artist1"]')], rows)
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_albumexport02_image_failures(self):
+        async def process_album_stub(_: AlbumInfo) -> DownloadResult:
+            return DownloadResult.SUCCESS
+
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            Config.album_export = f'{normalize_path(tempdir)}albums.jsonl'
+            AlbumExporter.open()
+            ai = AlbumInfo(7, 'Title')
+            ai.images.extend(ImageInfo(ai, image_id, '', f'{image_id:d}.jpg') for image_id in (71, 72))
+            AlbumExporter.stage(ai, AlbumPage())
+            with AlbumDownloadWorker([ai], process_album_stub) as adwn:
+                asyncio.run(adwn._at_task_finish(ai, DownloadResult.SUCCESS))  # scanned, images are queued
+                self.assertEqual(0, os.path.getsize(Config.album_export))
+                ai.images[0].set_state(IIState.DONE)
+                ai.images[1].set_state(IIState.FAILED)
+                adwn.at_album_completed(ai)
+            AlbumExporter.close()
+            with open(Config.album_export, 'rt', encoding=UTF8) as export_file:
+                self.assertEqual(['fail_retries'], [json.loads(line)['result'] for line in export_file])
+        print(f'{self._testMethodName} passed')
+
+
+class TagBagTests(TestCase):
+    @test_prepare()
+    def test_tagbag01_ops(self):
+        tags = TagBag(['orc', 'elf', '3d', 'orc'])
+        self.assertEqual(['orc', 'elf', '3d'], list(tags))
+        cats = TagBag(['', 'comedy'], lambda cat: '11' if cat == 'comedy' else None)
+        tags.merge(cats)
+        self.assertEqual(['orc', 'elf', '3d', 'comedy'], list(tags))
+        self.assertEqual({'11': 'comedy'}, tags.nums())
+        tags.remove('orc')
+        self.assertNotIn('orc', tags)
+        self.assertRaises(KeyError, tags.remove, 'orc')
+        self.assertTrue(tags.isdisjoint({'orc', '2d'}))
+        ai = AlbumInfo(1, 'Title')
+        scenario = DownloadScenario('a: orc; b: elf -3d; c: 3d; d: * -utp always')
+        self.assertEqual('c', scenario.get_matching_subquery(ai, tags, '', '').subfolder)
+        print(f'{self._testMethodName} passed')
+
+
+class ScenarioTests(TestCase):
+    @test_prepare()
+    def test_scenario01_matching(self):
+        scenario = DownloadScenario('a: 2d -orc; b: 3d -(elf,orc); c: (orc~elf); d: * -utp always')
+        ai = AlbumInfo(1, 'Title')
+        self.assertEqual('a', scenario.get_matching_subquery(ai, ['2d', 'elf'], '', '').subfolder)
+        self.assertEqual('c', scenario.get_matching_subquery(ai, ['2d', 'orc'], '', '').subfolder)
+        self.assertEqual('b', scenario.get_matching_subquery(ai, ['3d', 'orc'], '', '').subfolder)
+        self.assertEqual('c', scenario.get_matching_subquery(ai, ['3d', 'orc', 'elf'], '', '').subfolder)
+        self.assertEqual('d', scenario.get_matching_subquery(ai, ['comedy'], '', '').subfolder)
+        Config.check_title_pos = True
+        ai.title = 'Orc party'
+        self.assertEqual('c', scenario.get_matching_subquery(ai, ['comedy'], '', '').subfolder)
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_scenario02_micro_benchmark(self):
+        results = run_benchmark(['-micro', 'scenario', '-albums', '200', '-iterations', '1', '-subqueries', '30'])
+        self.assertEqual(0, results['exit_code'])
+        self.assertEqual(0, results['mismatches'])
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_scenario03_tags_micro_benchmark(self):
+        results = run_benchmark(['-micro', 'tags', '-albums', '100', '-iterations', '1'])
+        self.assertEqual(0, results['exit_code'])
+        self.assertEqual(0, results['mismatches'])
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_scenario04_text_phrases(self):
+        text_matcher = TextMatcher(['dark elf', 'elf', 'big ass', 'ass'])
+        self.assertEqual({'dark elf', 'elf', 'ass'}, text_matcher.find('a (dark elf) with no class or sass, just ass'))
+        self.assertEqual(set(), text_matcher.find('elfish darkelf'))
+        for extag, text, group_type in (('(orc~dark_elf)', 'The Dark Elf\nparty', 'or'), ('-(orc,elf)', 'orc and "elf"', 'and'),
+                                        ('x-ray', '[x-ray]', ''), ('elf*', 'elfish party', ''), ('orc', 'orcs', '')):
+            self.assertEqual(bool(match_text(extag, text, group_type)), bool(CompiledExtraTag(extag).match_text(text)))
+        Config.check_title_neg = True
+        self.assertTrue(is_filtered_out_by_title(AlbumInfo(1, 'Dark elf (orc)'), ['-(orc,dark_elf)']))
+        self.assertFalse(is_filtered_out_by_title(AlbumInfo(2, 'Dark elves (orc)'), ['-(orc,dark_elf)']))
+        print(f'{self._testMethodName} passed')
+
+
+class LoggerTests(TestCase):
+    @test_prepare(True)
+    def test_logger01_writer(self):
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            Config.log_file = f'{tempdir}/log.txt'
+            Config.logging_flags = LoggingFlags.DEBUG
+            with patch('sys.stdout', new_callable=StringIO) as stdout:
+                Log.init()
+                try:
+                    for i in range(5):
+                        Log.info(f'message {i:d}')
+                    Log.trace('trace message')
+                    Log.flush()
+                    self.assertIn('message 4', stdout.getvalue())
+                finally:
+                    Log.shutdown()
+            self.assertIsNone(Log._writer)
+            with open(Config.log_file, 'rt', encoding=UTF8) as log_file:
+                self.assertEqual([f'message {i:d}' for i in range(5)], log_file.read().splitlines())
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare(True)
+    def test_logger02_json_rotate(self):
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            Config.log_file = f'{tempdir}/log.txt'
+            Config.log_json = True
+            Config.logging_flags = LoggingFlags.INFO
+            with patch('sys.stdout', new_callable=StringIO), patch('rc.logger.LOG_FILE_SIZE_MAX', 200):
+                Log.init()
+                try:
+                    for i in range(10):
+                        Log.warn(f'message {i:d}')
+                        Log.flush()
+                finally:
+                    Log.shutdown()
+            self.assertEqual({'log.txt', 'log.txt.1', 'log.txt.2', 'log.txt.3'}, set(os.listdir(tempdir)))
+            with open(Config.log_file, 'rt', encoding=UTF8) as log_file:
+                records = [json.loads(line) for line in log_file.read().splitlines()]
+        self.assertEqual('message 9', records[-1]['message'])
+        self.assertEqual('warn', records[-1]['level'])
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare(True)
+    def test_logger03_rotate_encoded_size(self):
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            Config.log_file = f'{tempdir}/log.txt'
+            Config.logging_flags = LoggingFlags.INFO
+            Config.nocolors = True
+            message = '\u0436' * 30  # 2 bytes per character in utf-8
+            with patch('sys.stdout', new_callable=StringIO), patch('rc.logger.LOG_FILE_SIZE_MAX', 100):
+                Log.init()
+                try:
+                    for _ in range(6):
+                        Log.warn(message)
+                        Log.flush()
+                finally:
+                    Log.shutdown()
+            line_size = len(message.encode(UTF8)) + 1
+            for log_name in os.listdir(tempdir):
+                self.assertGreaterEqual(100 + line_size, os.path.getsize(f'{tempdir}/{log_name}'))
+        print(f'{self._testMethodName} passed')
+
+
+class MetricsTests(TestCase):
+    @test_prepare()
+    def test_metrics01_disabled(self):
+        Metrics.inc('retries_total', '429')
+        with Metrics.timer('parse_seconds', 'html'):
+            pass
+        self.assertEqual({}, Metrics.to_json()['counters'])
+        self.assertEqual({}, Metrics.to_json()['histograms'])
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_metrics02_prometheus(self):
+        Metrics.enable()
+        Metrics.inc('retries_total', '429')
+        Metrics.inc('retries_total', '429', 2)
+        Metrics.set('queue_size', 'images', 7)
+        Metrics.observe('request_seconds', 'comic', 0.02)
+        Metrics.observe('request_seconds', 'comic', 100.0)
+        text = Metrics.to_prometheus()
+        self.assertIn('# TYPE rc_retries_total counter\nrc_retries_total{status="429"} 3\n', text)
+        self.assertIn('rc_queue_size{queue="images"} 7\n', text)
+        self.assertIn('rc_request_seconds_bucket{endpoint="comic",le="0.01"} 0\n', text)
+        self.assertIn('rc_request_seconds_bucket{endpoint="comic",le="0.025"} 1\n', text)
+        self.assertIn('rc_request_seconds_bucket{endpoint="comic",le="+Inf"} 2\n', text)
+        self.assertIn('rc_request_seconds_count{endpoint="comic"} 2\n', text)
+        self.assertEqual(100.0, Metrics.to_json()['histograms']['request_seconds']['comic']['max'])
+        self.assertEqual('comic', endpoint_of(f'{SITE}/comic/1234/a/'))
+        self.assertEqual('tag_vote_state_public', endpoint_of(f'{SITE}/tag_vote_state_public.php?video_id=1'))
+        self.assertEqual('root', endpoint_of(SITE))
+        print(f'{self._testMethodName} passed')
+
+
+class InfoListsTests(TestCase):
+    @test_prepare()
+    def test_infolists01_merge(self):
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            Config.dest_base = normalize_path(tempdir)
+            Config.save_tags = Config.save_descriptions = Config.merge_lists = True
+            with open(f'{Config.dest_base}{PREFIX}!tags_1-5.txt', 'wt', encoding=UTF8) as listfile:
+                listfile.write(f'{PREFIX}1: a\n{PREFIX}3: b\n{PREFIX}5: c\n')
+            with open(f'{Config.dest_base}{PREFIX}!tags_2-3.txt', 'wt', encoding=UTF8) as listfile:
+                listfile.write(f'{PREFIX}2: d\n{PREFIX}3: e\n')
+            with open(f'{Config.dest_base}{PREFIX}!descriptions_1-1.txt', 'wt', encoding=UTF8) as listfile:
+                listfile.write(f'{PREFIX}1:\nuploader:\nline 1\nline 2\n\n')
+            ai = AlbumInfo(4)
+            ai.tags, ai.description = 'f', '\nuploader:\ndesc\n'
+            ai.set_state(AIState.PROCESSED)
+            self.assertEqual([('', f'{PREFIX}!tags_1-5.txt'), ('', f'{PREFIX}!descriptions_1-4.txt')], export_album_info([ai]))
+            self.assertEqual([f'{PREFIX}!descriptions_1-4.txt', f'{PREFIX}!tags_1-5.txt'], sorted(os.listdir(tempdir)))
+            with open(f'{Config.dest_base}{PREFIX}!tags_1-5.txt', 'rt', encoding=UTF8) as listfile:
+                self.assertEqual(f'{PREFIX}1: a\n{PREFIX}2: d\n{PREFIX}3: e\n{PREFIX}4: f\n{PREFIX}5: c\n', listfile.read())
+            with open(f'{Config.dest_base}{PREFIX}!descriptions_1-4.txt', 'rt', encoding=UTF8) as listfile:
+                self.assertEqual(f'{PREFIX}1:\nuploader:\nline 1\nline 2\n\n{PREFIX}4:\nuploader:\ndesc\n\n', listfile.read())
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_infolists02_journal_recovery(self):
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            Config.dest_base = normalize_path(tempdir)
+            Config.save_tags = True
+            AlbumInfoJournal.open()
+            ai = AlbumInfo(7)
+            ai.tags = 'a'
+            AlbumInfoJournal.append(ai)
+            AlbumInfoJournal._file.write('{"id": 8, "subfo')  # interrupted
+            AlbumInfoJournal.close(False)
+            AlbumInfoJournal.open()
+            self.assertEqual([7], [rai.id for rai in AlbumInfoJournal.recovered()])
+            self.assertEqual([('', f'{PREFIX}!tags_7-7.txt')], export_album_info([]))
+            self.assertEqual([f'{PREFIX}!tags_7-7.txt'], os.listdir(tempdir))
+        print(f'{self._testMethodName} passed')
+
+
+class ShardTests(TestCase):
+    @test_prepare()
+    def test_shard01_filter(self):
+        self.assertEqual(Shard(2, 3), valid_shard('2/3'))
+        for invalid in ('0/3', '4/3', '1', '1/0', 'a/b'):
+            with self.assertRaises((ArgumentError, TypeError)):  # bare ArgumentError raises TypeError
+                valid_shard(invalid)
+        Config.shard = valid_shard('2/3')
+        self.assertEqual([1, 4, 7], [ai.id for ai in filter_shard_albums([AlbumInfo(idi) for idi in range(1, 9)])])
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_shard02_claims_and_merge(self):
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            Config.dest_base = normalize_path(tempdir)
+            Config.save_tags = True
+            shards_dir = f'{Config.dest_base}{PREFIX}!shards'
+            for shard_index, album_id in ((1, 2), (2, 3)):
+                _claimed_ids.clear()
+                Config.shard = Shard(shard_index, 2)
+                ai = AlbumInfo(album_id)
+                ai.tags = f'tag{album_id:d}'
+                ai.set_state(AIState.PROCESSED)
+                self.assertTrue(claim_album(ai))
+                self.assertTrue(claim_album(ai))  # own claim
+                finish_shard(export_album_info([ai]))
+                if shard_index == 1:
+                    self.assertTrue(os.path.isdir(shards_dir))
+                    self.assertTrue(os.path.isfile(f'{Config.dest_base}{PREFIX}!tags_2-2.txt'))
+                    _claimed_ids.clear()
+                    self.assertTrue(claim_album(ai))  # own claim left by previous run
+                    _claimed_ids.clear()
+                    Config.shard = Shard(2, 2)
+                    self.assertFalse(claim_album(ai))  # claimed by another shard
+            self.assertFalse(os.path.isdir(shards_dir))
+            self.assertEqual([f'{PREFIX}!tags_2-3.txt'], os.listdir(tempdir))
+            with open(f'{Config.dest_base}{PREFIX}!tags_2-3.txt', 'rt', encoding=UTF8) as tags_file:
+                self.assertEqual(f'{PREFIX}2: tag2\n{PREFIX}3: tag3\n', tags_file.read())
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_shard03_restart_after_failure(self):
+        async def process_album_stub(_: AlbumInfo) -> DownloadResult:
+            return DownloadResult.FAIL_RETRIES
+
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            Config.dest_base = normalize_path(tempdir)
+            Config.shard = Shard(1, 2)
+            ai1, ai2 = AlbumInfo(2), AlbumInfo(4)
+            self.assertTrue(claim_album(ai1))
+            self.assertTrue(claim_album(ai2))
+            with AlbumDownloadWorker([ai1, ai2], process_album_stub) as adwn:
+                asyncio.run(adwn._at_task_finish(ai1, DownloadResult.FAIL_RETRIES))
+            self.assertFalse(os.path.isfile(f'{Config.dest_base}{PREFIX}!shards/{PREFIX}2.claim'))
+            # crash: claim of album 4 is left behind
+            _claimed_ids.clear()
+            Config.shard = Shard(2, 2)
+            self.assertFalse(claim_album(ai2))
+            Config.shard = Shard(1, 2)  # restart
+            self.assertTrue(claim_album(ai1))
+            self.assertTrue(claim_album(ai2))
+            release_claims()
+            self.assertEqual([], os.listdir(f'{Config.dest_base}{PREFIX}!shards'))
+        print(f'{self._testMethodName} passed')
+
+
+class IdGapModelTests(TestCase):
+    @test_prepare()
+    def test_idgaps01_model_learn_and_store(self):
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            Config.dest_base = normalize_path(tempdir)
+            Config.predict_id_gaps = IDGAP_PREDICTION_AUTO
+            Config.id_gaps_confidence = IDGAP_CONFIDENCE_DEFAULT
+            IdGapModel.load()
+            # odd ids never exist within 1000-1199, 1200-1399 is a dead range
+            for album_id in range(1000, 1100):
+                IdGapModel.observe(album_id, album_id % 2 == 0)
+            for album_id in range(1200, 1240):
+                IdGapModel.observe(album_id, False)
+            self.assertTrue(IdGapModel.is_gap(1101))
+            self.assertFalse(IdGapModel.is_gap(1102))
+            self.assertTrue(IdGapModel.is_gap(1300))
+            self.assertEqual(0.0, IdGapModel.predict(5000))
+            IdGapModel.store()
+            IdGapModel._reset()
+            IdGapModel.load()
+            self.assertTrue(IdGapModel.is_gap(1101))
+            self.assertFalse(IdGapModel.is_gap(1102))
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_idgaps02_predictor_verification(self):
+        Config.predict_id_gaps = IDGAP_PREDICTION_AUTO
+        Config.id_gaps_confidence = IDGAP_CONFIDENCE_DEFAULT
+        for album_id in range(1000, 1050):
+            IdGapModel.observe(album_id, False)
+        gpred = IdGapsPredictor.get()
+        skips = [bool(gpred.need_skip(AlbumInfo(album_id))) for album_id in range(1050, 1050 + IDGAP_VERIFY_INTERVAL)]
+        self.assertEqual([True] * (IDGAP_VERIFY_INTERVAL - 1) + [False], skips)
+        # verified id exists -> prediction gets disabled
+        gpred.count_existing(AlbumInfo(1050 + IDGAP_VERIFY_INTERVAL - 1))
+        self.assertFalse(gpred.need_skip(AlbumInfo(1100)))
+        # predictions confirmed again -> re-enabled
+        for album_id in range(1100, 1110):
+            gpred.count_nonexisting(AlbumInfo(album_id))
+        self.assertTrue(gpred.need_skip(AlbumInfo(1110)))
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_idgaps03_probe_uses_stored_model(self):
+        async def fetch_album(url: str, **_) -> bytes:
+            album_id = int(re.search(r'/(\d+)/', url).group(1))
+            requested.append(album_id)
+            return f'<html><head><title>{"Album" if album_id <= 1100 else "404 Not Found"}</title></head></html>'.encode()
+
+        async def download_stub(*_, **__) -> None:
+            pass
+
+        requested: list[int] = []
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            Config.dest_base = normalize_path(tempdir)
+            Config.predict_id_gaps = IDGAP_PREDICTION_AUTO
+            for album_id in range(1000, 1090):
+                IdGapModel.observe(album_id, album_id % 2 == 0)
+            IdGapModel.store()
+            IdGapModel._reset()
+            prepare_arglist(['ids', '-path', tempdir, '-start', '1000', '-end', '1090', '-lookahead', '100', '-lprobe', '-gpred', '1'])
+            with patch('rc.idgaps.fetch_html_raw', fetch_album), patch('rc.ids.download', download_stub):
+                self.assertEqual(0, asyncio.run(process_ids()))
+        self.assertEqual(1100, Config.end)
+        self.assertEqual([], [album_id for album_id in requested if album_id % 2 and album_id < 1200])  # predicted gaps are not probed
+        # probe results are learned too
+        self.assertLess(0.5, IdGapModel.predict(max(requested)))
+        self.assertEqual(0.0, IdGapModel.predict(100000))
+        print(f'{self._testMethodName} passed')
+
+
+class ImageIndexTests(TestCase):
+    @test_prepare()
+    def test_imgindex01_dedup_and_known_ids(self):
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            Config.dest_base = normalize_path(tempdir)
+            Config.dedup_images = True
+            ImageIndex.load()
+            iis = [ImageInfo(AlbumInfo(album_id), image_id, '', f'{image_id:d}.jpg') for album_id, image_id in ((1, 11), (2, 21), (3, 11))]
+            for ii in iis:
+                ii.album.name = f'{ii.album.id:d}'
+            for ii in iis[:2]:
+                os.makedirs(ii.my_folder)
+                with open(ii.my_fullpath, 'wb') as imgf:
+                    imgf.write(b'image')
+                hasher = ImageIndex.new_hasher(ii, 2)  # resumed download
+                hasher.update(b'age')
+                self.assertEqual(ii is iis[1], asyncio.run(ImageIndex.add_image(ii, hasher.hexdigest(), '', '')))
+            self.assertTrue(os.path.samefile(iis[0].my_fullpath, iis[1].my_fullpath))
+            ImageIndex.store()
+            ImageIndex._reset()
+            ImageIndex.load()
+            os.makedirs(iis[2].my_folder)
+            self.assertTrue(asyncio.run(ImageIndex.try_link_known(iis[2])))
+            self.assertTrue(os.path.samefile(iis[0].my_fullpath, iis[2].my_fullpath))
+            self.assertFalse(asyncio.run(ImageIndex.try_link_known(ImageInfo(AlbumInfo(4), 41, '', '41.jpg'))))
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_imgindex02_found_folders(self):
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            Config.dest_base = normalize_path(tempdir)
+            Config.relink_known_images = True
+            os.makedirs(f'{Config.dest_base}{PREFIX}5_title')
+            for image_id, content in ((51, b'image'), (52, b'')):
+                with open(f'{Config.dest_base}{PREFIX}5_title/{PREFIX}{image_id:d}.jpg', 'wb') as imgf:
+                    imgf.write(content)
+            scan_dest_folder()
+            ImageIndex.load()
+            ImageIndex.store()
+            folder_mtime = os.stat(f'{Config.dest_base}{PREFIX}5_title').st_mtime_ns
+            with open(f'{Config.dest_base}{PREFIX}!images.json', 'rt', encoding=UTF8) as index_file:
+                self.assertEqual({'!folders': {f'{PREFIX}5_title': folder_mtime}, '51': [f'{PREFIX}5_title/{PREFIX}51.jpg', 5, '', '', '', False]},
+                                 json.load(index_file))
+            ImageIndex._reset()
+            with patch('os.scandir', side_effect=AssertionError):  # unmodified folder is not indexed again
+                ImageIndex.load()
+            self.assertIn(51, ImageIndex._images)
+            ai = AlbumInfo(6)
+            ai.name = f'{PREFIX}6_title'
+            os.makedirs(ai.my_folder)
+            self.assertFalse(asyncio.run(ImageIndex.try_link_known(ImageInfo(ai, 52, '', f'{PREFIX}52.jpg'))))
+            ii = ImageInfo(ai, 51, '', f'{PREFIX}51.jpg')
+            with patch('os.link', side_effect=OSError):  # copy if hardlinks are not supported
+                self.assertTrue(asyncio.run(ImageIndex.try_link_known(ii)))
+            self.assertFalse(os.path.samefile(f'{Config.dest_base}{PREFIX}5_title/{PREFIX}51.jpg', ii.my_fullpath))
+            with open(ii.my_fullpath, 'rb') as imgf:
+                self.assertEqual(b'image', imgf.read())
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_imgindex03_completeness_checks(self):
+        class HeadResponse:
+            status, content_type, content_length, headers, closed = 200, 'image/jpeg', 5, {'ETag': '"5"'}, True
+
+        async def wrap_head(method: str, url: str, **_) -> HeadResponse:
+            head_links.append((method, url))
+            return HeadResponse()
+
+        head_links: list[tuple[str, str]] = []
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            Config.dest_base = normalize_path(tempdir)
+            Config.continue_mode = True
+            ai = AlbumInfo(7)
+            ai.name = f'{PREFIX}7_title'
+            os.makedirs(ai.my_folder)
+            for image_id, content in ((71, b'image'), (72, b'ima'), (73, None)):
+                ai.images.append(ImageInfo(ai, image_id, f'{SITE}/{image_id:d}.jpg', f'{PREFIX}{image_id:d}.jpg'))
+                if content is not None:
+                    with open(ai.images[-1].my_fullpath, 'wb') as imgf:
+                        imgf.write(content)
+            with patch('rc.download.wrap_request', wrap_head):
+                self.assertEqual(1, asyncio.run(check_existing_images(ai)))
+                self.assertEqual([('HEAD', f'{SITE}/71.jpg'), ('HEAD', f'{SITE}/72.jpg')], head_links)
+                self.assertEqual([True, False, False], [ii.has_flag(IIFlags.KNOWN_COMPLETE) for ii in ai.images])
+                head_links.clear()
+                self.assertEqual(1, asyncio.run(check_existing_images(ai)))  # complete image is known, not requested again
+                self.assertEqual([('HEAD', f'{SITE}/72.jpg')], head_links)
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_imgindex04_completeness_check_redirect(self):
+        class HeadResponse:
+            content_type, content_length, closed = 'image/jpeg', 5, True
+
+            def __init__(self, status: int, location='') -> None:
+                self.status = status
+                self.headers = {'Location': location} if location else {}
+
+        async def wrap_head(method: str, url: str, **kwargs) -> HeadResponse:
+            requests.append((method, url, kwargs['allow_redirects'], kwargs['noproxy']))
+            return HeadResponse(302, 'https://images.example.com/71.jpg') if url.startswith(SITE) else HeadResponse(200)
+
+        requests: list[tuple[str, str, bool, bool]] = []
+        Config.proxy = 'http://127.0.0.1:8080'
+        Config.download_without_proxy = True
+        ii = ImageInfo(AlbumInfo(7), 71, f'{SITE}/71.jpg', f'{PREFIX}71.jpg')
+        with patch('rc.download.wrap_request', wrap_head):
+            self.assertTrue(asyncio.run(check_existing_image(ii, 5)))
+        # same as image download: redirect to image host is followed manually and bypasses proxy
+        self.assertEqual([('HEAD', f'{SITE}/71.jpg', False, False), ('HEAD', 'https://images.example.com/71.jpg', True, True)], requests)
+        print(f'{self._testMethodName} passed')
+
+    @test_prepare()
+    def test_imgindex05_concurrent_dedup(self):
+        async def add_images() -> list[bool]:
+            return list(await asyncio.gather(*(ImageIndex.add_image(ii, digest, '', '') for ii in iis)))
+
+        with TemporaryDirectory(prefix=f'{APP_NAME}_{self._testMethodName}_') as tempdir:
+            Config.dest_base = normalize_path(tempdir)
+            Config.dedup_images = True
+            ImageIndex.load()
+            iis = [ImageInfo(AlbumInfo(album_id), album_id * 10 + 1, '', f'{album_id:d}1.jpg') for album_id in (1, 2, 3)]
+            for ii in iis:
+                ii.album.name = f'{ii.album.id:d}'
+                os.makedirs(ii.my_folder)
+                with open(ii.my_fullpath, 'wb') as imgf:
+                    imgf.write(b'image')
+            digest = ImageIndex.new_hasher(iis[0], 5).hexdigest()
+            # same content finished concurrently: only the first one is kept, the rest are linked to it
+            self.assertEqual([False, True, True], asyncio.run(add_images()))
+            self.assertTrue(all(os.path.samefile(iis[0].my_fullpath, ii.my_fullpath) for ii in iis[1:]))
+            self.assertEqual(3, len(ImageIndex._images))
+        print(f'{self._testMethodName} passed')
+
+
+class AlbumQueueTests(TestCase):
+    @test_prepare()
+    def test_albumqueue01_lazy_sequence(self):
+        async def process_album_dummy(_: AlbumInfo) -> DownloadResult:
+            return DownloadResult.SUCCESS
+
+        Config.shard = valid_shard('2/3')
+        sequence = AlbumIdSequence(filter_shard_ids(range(1, 6001)))
+        self.assertEqual((1, 5998), get_min_max_ids(sequence))
+        self.assertIn(4, sequence)
+        self.assertNotIn(5, sequence)
+        with AlbumDownloadWorker(sequence, process_album_dummy) as adwn:
+            taken = [adwn._take_next() for _ in range(1500)]
+            self.assertEqual(500, adwn.get_workload_size())
+            self.assertEqual(4498, taken[-1].id)
+        print(f'{self._testMethodName} passed')
+
+
 class DownloadTests(TestCase):
     @test_prepare(True)
     def test_ids_touch(self):
@@ -18,14 +18,17 @@ from .defs import (
     CONNECT_TIMEOUT_SOCKET_READ,
     DOWNLOAD_POLICY_DEFAULT,
     DURATION_MAX,
+    IDGAP_CONFIDENCE_MIN,
     IDGAP_PREDICTION_OFF,
     LOGGING_FLAGS,
     NAMING_FLAGS,
     SEARCH_RULE_ALL,
     SLASH,
     Duration,
+    IntPair,
     LoggingFlags,
     NamingFlags,
+    Shard,
 )
 from .logger import Log
 from .rex import re_non_search_symbols, re_session_id
@@ -45,12 +48,12 @@ def find_and_resolve_config_conflicts() -> bool:
     if Config.proxy and Config.download_without_proxy and Config.html_without_proxy:
         Log.fatal('\nError: proxy exists but is disabled for both html and download requests!')
         raise ValueError
-    if all(_ in (False, None) for _ in (Config.use_id_sequence, Config.use_link_sequence)):
+    if all(_ in (False, None) for _ in (Config.use_id_sequence, Config.use_link_sequence, Config.use_id_file)):
         if Config.start_id > Config.end_id or Config.start > Config.end:
             Log.fatal(f'\nError: invalid id bounds: start ({Config.start:d}|{Config.start_id}) > end ({Config.end:d}|{Config.end_id})')
             raise ValueError
     if Config.lookahead:
-        if Config.use_id_sequence:
+        if Config.use_id_sequence or Config.use_id_file:
             Log.fatal('\nError: lookahead argument cannot be used together with id sequence!')
             raise ValueError
         if Config.store_continue_cmdfile:
@@ -94,6 +97,14 @@ def find_and_resolve_config_conflicts() -> bool:
     if Config.scan_all_pages and Config.start_id <= 1:
         Log.info('Info: \'--scan-all-pages\' flag was set but post id lower bound was not provided, ignored')
         delay_for_message = True
+    if Config.lookahead_probe and not (Config.lookahead and Config.lookahead > 0):
+        Log.info('Info: \'--lookahead-probe\' flag was set but lookahead was not provided, ignored')
+        Config.lookahead_probe = False
+        delay_for_message = True
+    if Config.seek_pages and (Config.end_id >= 10**9 or Config.favourites):
+        Log.info('Info: \'--seek-pages\' flag was set but post id upper bound was not provided or listing is not ordered by id, ignored')
+        Config.seek_pages = False
+        delay_for_message = True
 
     # if Config.check_votes is True and not len(Config.extra_tags):
     #     Log.info('Info: \'--check-votes\' flag was set but no extra tags were provided, ignored')
@@ -161,6 +172,10 @@ def valid_lookahead(val: str) -> int:
     return valid_int(val, lb=-200, ub=200, nonzero=True)
 
 
+def valid_id_gaps_confidence(val: str) -> int:
+    return valid_int(val, lb=IDGAP_CONFIDENCE_MIN, ub=100)
+
+
 def valid_path(pathstr: str) -> str:
     try:
         newpath = normalize_path(os.path.expanduser(pathstr.strip('\'"')))
@@ -179,6 +194,38 @@ def valid_filepath_abs(pathstr: str) -> str:
         raise ArgumentError
 
 
+def valid_filepath_in(pathstr: str) -> str:
+    try:
+        newpath = normalize_path(os.path.abspath(os.path.expanduser(pathstr.strip('\'"'))), False)
+        assert os.path.isfile(newpath)
+        return newpath
+    except Exception:
+        raise ArgumentError
+
+
+def valid_filepath_out(pathstr: str) -> str:
+    try:
+        newpath = normalize_path(os.path.abspath(os.path.expanduser(pathstr.strip('\'"'))), False)
+        assert not os.path.isdir(newpath) and os.path.isdir(os.path.dirname(newpath))
+        return newpath
+    except Exception:
+        raise ArgumentError
+
+
+def valid_port(val: str) -> int:
+    return valid_int(val, lb=1, ub=65535)
+
+
+def valid_shard(val: str) -> Shard:
+    try:
+        parts = val.split('/')
+        assert len(parts) == 2
+        count = positive_nonzero_int(parts[1])
+        return Shard(valid_int(parts[0], lb=1, ub=count), count)
+    except Exception:
+        raise ArgumentError
+
+
 def valid_search_string(search_str: str) -> str:
     try:
         assert len(search_str) == 0 or re_non_search_symbols.search(search_str) is None
@@ -267,6 +314,16 @@ def valid_duration(duration: str) -> Duration:
         raise ArgumentError
 
 
+def valid_delay_range(delay: str) -> IntPair:
+    try:
+        parts = delay.split('-', maxsplit=1)
+        delay_min = positive_int(parts[0])
+        delay_max = valid_int(parts[-1], lb=delay_min)
+        return IntPair(delay_min, delay_max)
+    except Exception:
+        raise ArgumentError
+
+
 def valid_timeout(timeout: str) -> ClientTimeout:
     try:
         timeout_int = positive_nonzero_int(timeout) if timeout else CONNECT_TIMEOUT_BASE
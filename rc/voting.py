@@ -7,14 +7,13 @@ Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
 #
 
 import json
-from collections.abc import MutableSequence
 from contextlib import suppress
 from typing import Literal, TypedDict
 
 from rc.defs import SITE_AJAX_REQUEST_VIDEO_VOTING, VOTE_TO_REMOVAL_THRESHOLD
 from rc.fetch_html import fetch_html_raw
 from rc.logger import Log
-from rc.tagger import get_artist_num, get_category_num, get_tag_num
+from rc.tagger import TagBag
 
 
 class ACTVoting(TypedDict):
@@ -46,17 +45,8 @@ class PostVotings(TypedDict):
     pending_items: list
 
 
-async def filter_act_by_votes_count(ai, sname, ars: MutableSequence[str], cas: MutableSequence[str], tas: MutableSequence[str]) -> None:
-    nameids_arts, nameids_cats, nameids_tags = {}, {}, {}
-    for c, m, d in zip(
-        (ars, cas, tas),
-        (get_artist_num, get_category_num, get_tag_num),
-        (nameids_arts, nameids_cats, nameids_tags),
-        strict=True,
-    ):
-        for act in c:
-            if act_id := m(act):
-                d[act_id] = act
+async def filter_act_by_votes_count(ai, sname, ars: TagBag, cas: TagBag, tas: TagBag) -> None:
+    nameids_arts, nameids_cats, nameids_tags = ars.nums(), cas.nums(), tas.nums()
     tids, cids, aids = tuple(','.join(_.keys()) for _ in (nameids_tags, nameids_cats, nameids_arts))
     v_bytes = await fetch_html_raw(SITE_AJAX_REQUEST_VIDEO_VOTING % (ai.id, tids, cids, aids))
     if v_bytes is None:
@@ -83,7 +73,7 @@ async def filter_act_by_votes_count(ai, sname, ars: MutableSequence[str], cas: M
         if acstatus not in ('normal', 'hardened') or acscore < VOTE_TO_REMOVAL_THRESHOLD:
             actype = acv['item_type']
             acname = {'category': nameids_cats, 'model': nameids_arts}.get(actype, {}).get(acid, 'Unknown')
-            acs = {'category': cas, 'model': ars}.get(actype, [])
+            acs = {'category': cas, 'model': ars}.get(actype, TagBag())
             Log.warn(f'{sname}: {actype} \'{acname}\' ({acid}) vote score is \'{acscore}\' with status \'{acstatus}\'! Removing!')
             with suppress(KeyError):
                 acs.remove(acname)
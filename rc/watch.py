@@ -0,0 +1,121 @@
+# coding=UTF-8
+"""
+Author: trickerer (https://github.com/trickerer, https://github.com/trickerer01)
+"""
+#########################################
+#
+#
+
+import random
+from asyncio import sleep
+
+from .albumpage import AlbumPageParser
+from .config import Config
+from .defs import PREFIX, SITE_AJAX_REQUEST_SEARCH_PAGE, UTF8, WATCH_RETRY_POLLS, DownloadResult, StrPair
+from .download import download
+from .fetch_html import create_session, fetch_html
+from .iinfo import AlbumIdSequence
+from .logger import Log
+from .pages import extract_album_refs
+from .path_util import scan_dest_folder
+from .rex import re_page_entry
+from .shard import filter_shard_ids, finish_shard
+from .util import format_time
+from .validators import find_and_resolve_config_conflicts
+
+__all__ = ('process_watch',)
+
+WATCH_STATE_FILE_NAME = f'{PREFIX}!watch.txt'
+
+
+def _state_file_path() -> str:
+    return f'{Config.dest_base}{WATCH_STATE_FILE_NAME}'
+
+
+def load_state() -> tuple[int | None, dict[int, int]]:
+    """Returns last processed post id and post ids to process again (id -> polls left)"""
+    try:
+        with open(_state_file_path(), 'rt', encoding=UTF8) as state_file:
+            lines = state_file.read().split()
+        return int(lines[0]), {int(idi): int(polls) for idi, polls in zip(lines[1::2], lines[2::2], strict=True)}
+    except (OSError, ValueError, IndexError):
+        return None, {}
+
+
+def store_state(last_id: int, retry_ids: dict[int, int]) -> None:
+    try:
+        with open(_state_file_path(), 'wt', encoding=UTF8) as state_file:
+            state_file.write(f'{last_id:d}\n')
+            state_file.writelines(f'{idi:d} {polls:d}\n' for idi, polls in sorted(retry_ids.items()))
+    except OSError:
+        Log.error(f'Error: unable to save watcher state to \'{_state_file_path()}\'!')
+
+
+async def fetch_max_id() -> int:
+    """Returns newest post id using first page of newest posts listing. Returns 0 on failure"""
+    a_html = await fetch_html(SITE_AJAX_REQUEST_SEARCH_PAGE % ('', '', '', '', '', 1))
+    return max((int(re_page_entry.search(aref['href']).group(1)) for aref in extract_album_refs(a_html)), default=0)
+
+
+async def process_watch() -> int:
+    Config.end = Config.start
+    if find_and_resolve_config_conflicts() is True:
+        await sleep(3.0)
+
+    scan_dest_folder()
+
+    last_id, retry_ids = (Config.start - 1, {}) if Config.start else load_state()
+    stored_lists: list[StrPair] = []
+    poll_count = 0
+    delay_min, delay_max = Config.watch_delay
+    async with create_session():
+        with AlbumPageParser():  # keep worker processes alive between polls
+            while True:
+                poll_count += 1
+                max_id = await fetch_max_id()
+                if max_id == 0:
+                    Log.error('Error: unable to fetch newest post id!')
+                elif last_id is None:
+                    Log.info(f'[watch] Newest post id is {max_id:d}, only posts after it will be downloaded')
+                    last_id = max_id
+                    store_state(last_id, retry_ids)
+                elif max_id > last_id or retry_ids:
+                    new_ids = range(last_id + 1, max(last_id, max_id) + 1)
+                    if new_ids:
+                        Log.info(f'[watch] Found {len(new_ids):d} new post id(s): {new_ids.start:d}-{new_ids.stop - 1:d}')
+                    if retry_ids:
+                        Log.info(f'[watch] Retrying {len(retry_ids):d} unfinished post id(s)...')
+                    ids = [*sorted(retry_ids), *new_ids] if retry_ids else new_ids
+                    Config.start, Config.end = ids[0], ids[-1]
+                    Config.id_sequence = ids if isinstance(ids, range) else frozenset(ids)
+                    v_entries = AlbumIdSequence(filter_shard_ids(ids))
+                    unfinished: dict[int, DownloadResult] = {}
+                    if v_entries:
+                        summary = await download(v_entries, len(ids) - len(v_entries), finalize=False)
+                        stored_lists.extend(summary.stored_lists)
+                        unfinished = summary.unfinished
+                    if Config.aborted:
+                        return -1
+                    # failed and not (yet) published posts are retried during next polls
+                    retry_ids = {idi: retry_ids.get(idi, WATCH_RETRY_POLLS + 1) - 1 for idi in unfinished}
+                    for idi in [idi for idi, polls in retry_ids.items() if polls <= 0]:
+                        Log.warn(f'[watch] Post id {idi:d} is still unfinished ({unfinished[idi]!s}) after {WATCH_RETRY_POLLS:d} retries,'
+                                 f' giving up')
+                        del retry_ids[idi]
+                    last_id = max(last_id, max_id)
+                    store_state(last_id, retry_ids)
+                else:
+                    Log.info(f'[watch] No new posts (newest post id is {max_id:d})')
+
+                if 0 < Config.watch_polls <= poll_count:
+                    break
+                delay = random.uniform(delay_min, delay_max)
+                Log.info(f'[watch] Next poll in {format_time(int(delay))}...')
+                await sleep(delay)
+
+    finish_shard(stored_lists)
+    return 0
+
+#
+#
+#########################################